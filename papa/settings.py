@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'visits.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -127,6 +129,35 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Caches. The marketplace of unscheduled visits is cached here (see
+# visits.app.marketplace); with more than one server process, this must be a
+# backend shared between them, such as FileBasedCache or a memcached/redis
+# backend, so that changes made by one process invalidate the others' copy.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Fraction of cached minute balances to recompute and compare against the cache
+# (see visits.app.balances). Mismatches are logged as warnings.
+BALANCE_CACHE_VERIFY_RATE = 0.0
+
+# Serve the async versions of the read-heavy views (see visits.async_views).
+# Set by papa/asgi.py, so it is on when running under an ASGI server.
+ASYNC_VIEWS = os.environ.get('PAPA_ASYNC_VIEWS') == '1'
+
+# Per-request SQL instrumentation (see visits.middleware). Off unless
+# PAPA_SQL_INSTRUMENTATION=1. When on, each response carries a Server-Timing
+# header (unless SQL_INSTRUMENTATION_HEADERS is False), and requests making
+# more than SQL_LOG_QUERIES queries, spending more than SQL_LOG_MS in SQL or
+# repeating the same query shape more than SQL_LOG_DUPLICATES times are logged.
+SQL_INSTRUMENTATION = os.environ.get('PAPA_SQL_INSTRUMENTATION') == '1'
+SQL_INSTRUMENTATION_HEADERS = True
+SQL_LOG_QUERIES = 30
+SQL_LOG_MS = 100
+SQL_LOG_DUPLICATES = 5
+
 # Crispy forms (bootstrap4 form rendering)
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
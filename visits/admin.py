@@ -1,10 +1,179 @@
-from django.contrib import admin
+"""Admin for the visits models, which must stay fast however large the tables
+grow.
 
+Each changelist selects the relations its rows display (list_select_related),
+so a page is one query rather than one per row, and foreign keys are edited as
+raw ids rather than select boxes of every row. Searches are exact matches on
+the unique username (the member's email), and date hierarchies are on indexed
+columns. Unfiltered changelists of large tables show an estimated count (see
+EstimatedCountPaginator) instead of counting every row.
+
+Bulk actions go through the set-based operations in visits.app.scheduling and
+visits.app.plans, so they make the same number of queries however many rows
+are selected.
+"""
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.db.models.functions import Now
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+
+import visits.app.plans as plans
+import visits.app.scheduling as scheduling
 import visits.models
 
 
-admin.site.register(visits.models.Pal)
-admin.site.register(visits.models.Member)
-admin.site.register(visits.models.Visit)
-admin.site.register(visits.models.Fulfillment)
-admin.site.register(visits.models.MinuteLedger)
+# Tables estimated to have fewer rows than this are counted exactly
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def estimated_count(queryset):
+    """Returns an estimate of the number of rows in the queryset's table,
+    without reading the table: the planner's estimate on PostgreSQL, and
+    elsewhere the largest primary key, which overstates the count by the
+    number of rows deleted. Returns None when there is no estimate.
+    """
+    connection = connections[queryset.db]
+
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+
+        # reltuples is -1 until the table is first analyzed
+        return int(row[0]) if row and row[0] >= 0 else None
+
+    return queryset.model._default_manager.using(queryset.db).aggregate(last=Max("pk"))["last"]
+
+
+class EstimatedCountPaginator(Paginator):
+    """Uses estimated_count for unfiltered changelists of large tables, where
+    an exact COUNT(*) would read every row. Filtered (or searched) lists, and
+    small tables, are counted exactly.
+    """
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimated_count(self.object_list)
+
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+
+        return super().count
+
+
+class ModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+
+    # Skips counting the whole table again alongside a filtered list
+    show_full_result_count = False
+
+
+class PlanMinutesForm(forms.Form):
+    plan_minutes = forms.IntegerField(min_value=0, label="Monthly plan minutes")
+    effective = forms.DateField(initial=plans.current_month, help_text="The change takes effect from the start of this date's month.")
+
+
+@admin.register(visits.models.Member)
+class MemberAdmin(ModelAdmin):
+    list_display = ["id", "account", "plan_minutes"]
+    list_select_related = ["account"]
+    raw_id_fields = ["account"]
+    search_fields = ["account__username__exact"]
+    actions = ["change_plan_minutes"]
+
+    @admin.action(description="Change plan minutes of selected members")
+    def change_plan_minutes(self, request, queryset):
+        """Asks for the new plan minutes and the month they take effect, then
+        changes every selected Member's plan with a single UPDATE (or stores
+        the changes, if they take effect in a later month). With "select all",
+        the selected Members are never loaded.
+        """
+        form = PlanMinutesForm(request.POST if "apply" in request.POST else None)
+
+        if form.is_valid():
+            effective = form.cleaned_data["effective"]
+            count = plans.change_members(queryset, form.cleaned_data["plan_minutes"], effective)
+            self.message_user(request, f"Changed the plan minutes of {count} member(s) from {effective:%Y-%m}.", messages.SUCCESS)
+            return None
+
+        return TemplateResponse(request, "admin/visits/member/change_plan_minutes.html", {
+            **self.admin_site.each_context(request),
+            "title": "Change plan minutes",
+            "opts": self.model._meta,
+            "form": form,
+            "count": queryset.count(),
+            "select_across": request.POST.get("select_across", "0"),
+            "selected": request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            "action_checkbox_name": helpers.ACTION_CHECKBOX_NAME,
+        })
+
+
+@admin.register(visits.models.Pal)
+class PalAdmin(ModelAdmin):
+    list_display = ["id", "account"]
+    list_select_related = ["account"]
+    raw_id_fields = ["account"]
+    search_fields = ["account__username__exact"]
+
+
+@admin.register(visits.models.Visit)
+class VisitAdmin(ModelAdmin):
+    list_display = ["id", "when", "minutes", "status", "member"]
+    list_select_related = ["member__account"]
+    list_filter = ["status"]
+    raw_id_fields = ["member", "series"]
+    search_fields = ["member__account__username__exact"]
+    date_hierarchy = "when"
+    actions = ["cancel_visits"]
+
+    @admin.action(description="Cancel selected visits")
+    def cancel_visits(self, request, queryset):
+        """Cancels the selected upcoming Visits which have not been cancelled,
+        with their fulfillments and ledger entries, using
+        scheduling.cancel_visits. Visits which have already started are left
+        alone, as scheduling.cancel_series leaves them, so that members are
+        not refunded nor pals' credits taken back for visits which happened.
+        """
+        count = scheduling.cancel_visits(queryset.filter(cancelled=False, when__gt=Now()))
+        self.message_user(request, f"Cancelled {count} visit(s).", messages.SUCCESS)
+
+
+@admin.register(visits.models.Fulfillment)
+class FulfillmentAdmin(ModelAdmin):
+    list_display = ["id", "visit", "pal", "completed", "cancelled"]
+    list_select_related = ["visit__member__account", "pal__account"]
+    raw_id_fields = ["visit", "pal"]
+    search_fields = ["pal__account__username__exact"]
+    actions = ["complete_fulfillments"]
+
+    @admin.action(description="Complete selected fulfillments")
+    def complete_fulfillments(self, request, queryset):
+        """Completes the selected active Fulfillments whose Visits have ended,
+        crediting their Pals, in batches using
+        scheduling.complete_fulfillments.
+        """
+        count = scheduling.complete_fulfillments(queryset)
+        self.message_user(request, f"Completed {count} fulfillment(s).", messages.SUCCESS)
+
+
+@admin.register(visits.models.MinuteLedger)
+class MinuteLedgerAdmin(ModelAdmin):
+    list_display = ["id", "created", "account", "visit", "reason", "amount", "cancelled"]
+    list_select_related = ["account", "visit__member__account"]
+    raw_id_fields = ["account", "visit"]
+    search_fields = ["account__username__exact"]
+    date_hierarchy = "created"
+
+
+@admin.register(visits.models.PlanChange)
+class PlanChangeAdmin(ModelAdmin):
+    list_display = ["id", "effective", "plan_minutes", "member"]
+    list_select_related = ["member__account"]
+    raw_id_fields = ["member"]
+    search_fields = ["member__account__username__exact"]
+    date_hierarchy = "effective"
@@ -0,0 +1,320 @@
+"""Version 1 of the JSON API, covering the same operations as the HTML views.
+Requests are authenticated by the session, as for the HTML views, and POSTs
+must carry the CSRF token in the X-CSRFToken header. POST bodies are JSON
+objects with the same fields as the corresponding forms.
+
+Collections answer If-None-Match with 304 Not Modified when their ETag still
+matches. ETags are derived from change markers (see visits.app.changes) and
+the member's ledger_version, so checking one costs a couple of cache reads and
+primary key lookups rather than the full query. Lists of upcoming visits are
+computed as of the start of the current minute, so their contents (and ETags)
+only otherwise change from one minute to the next.
+
+Changes to the available visits are also pushed to pals as server-sent events
+(see available_events).
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import condition, require_GET, require_http_methods, require_POST
+
+import visits.app.balances as balances
+import visits.app.changes as changes
+import visits.app.events as events
+import visits.app.marketplace as marketplace
+import visits.app.pagination as pagination
+from visits.app.util import utcnow
+from .models import Member, Visit, VisitSeries
+from .forms import MemberVisitRequestForm, \
+    CancelRequestedVisitForm, \
+    AcceptVisitForm, \
+    AvailableVisitsFilterForm, \
+    CompleteFulfillmentForm, \
+    CancelFulfillmentForm
+
+
+def api_login_required(view):
+    """Like login_required, but responds with 401 instead of redirecting to the
+    login page.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({"errors": {"__all__": ["Authentication required."]}}, status=401)
+
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _minute():
+    """Returns the start of the current minute.
+    """
+    return utcnow().replace(second=0, microsecond=0)
+
+
+def _etag(*parts):
+    return hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _errors(form, status=400):
+    return JsonResponse({"errors": form.errors}, status=status)
+
+
+def _conflict(message):
+    return JsonResponse({"errors": {"__all__": [message]}}, status=409)
+
+
+def _data(request):
+    """Returns the JSON object in the request body, or None if there is none.
+    """
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+
+    return data if isinstance(data, dict) else None
+
+
+def _bad_request():
+    return JsonResponse({"errors": {"__all__": ["The request body must be a JSON object."]}}, status=400)
+
+
+def _visit(visit):
+    return {
+        "id": visit.id,
+        "when": visit.when.isoformat(),
+        "minutes": visit.minutes,
+        "tasks": visit.tasks,
+        "status": visit.status,
+        "series_id": visit.series_id,
+    }
+
+
+def _fulfillment(fulfillment):
+    return {
+        "id": fulfillment.id,
+        "completed": fulfillment.completed,
+        "visit": _visit(fulfillment.visit),
+    }
+
+
+def _page(page, serialize):
+    return {
+        "items": [serialize(item) for item in page],
+        "next": page.next_cursor,
+    }
+
+
+def _balance_etag(request):
+    version, plan_minutes = Member.objects.values_list("ledger_version", "plan_minutes").get(account=request.user)
+    now = utcnow()
+    return _etag("balance", request.user.pk, version, plan_minutes, now.year, now.month)
+
+
+@api_login_required
+@require_GET
+@condition(etag_func=_balance_etag)
+def balance(request):
+    """The member's minutes available this month.
+    """
+    now = utcnow()
+    plan_minutes_remaining, minutes_available = balances.current(request.user.member)
+
+    return JsonResponse({
+        "year": now.year,
+        "month": now.month,
+        "plan_minutes": request.user.member.plan_minutes,
+        "plan_minutes_remaining": plan_minutes_remaining,
+        "minutes_available": minutes_available,
+    })
+
+
+def _visits_etag(request):
+    member = request.user.member
+    return _etag("visits", member.pk, changes.marker(changes.member(member.pk)), _minute(), request.GET.get("after", ""))
+
+
+@condition(etag_func=_visits_etag)
+def _list_visits(request):
+    query = request.user.member.visit_set.filter(cancelled=False, when__gte=_minute())
+    return JsonResponse(_page(pagination.paginate(query, request.GET.get("after")), _visit))
+
+
+def _request_visit(request):
+    data = _data(request)
+
+    if data is None:
+        return _bad_request()
+
+    form = MemberVisitRequestForm(request.user, data)
+
+    if not form.is_valid():
+        return _errors(form)
+
+    booked = form.save()
+
+    if booked is None:
+        return _errors(form, 409)
+
+    if isinstance(booked, VisitSeries):
+        return JsonResponse({"items": [_visit(v) for v in booked.visit_set.order_by("when")]}, status=201)
+
+    return JsonResponse({"items": [_visit(booked)]}, status=201)
+
+
+@api_login_required
+@require_http_methods(["GET", "POST"])
+def visits(request):
+    """GET lists the member's upcoming visits, soonest first, paginated by the
+    "after" cursor. POST requests a new visit (or series of visits).
+    """
+    if request.method == "POST":
+        return _request_visit(request)
+
+    return _list_visits(request)
+
+
+@api_login_required
+@require_POST
+def cancel_visit(request, visit_id):
+    """Cancels one of the member's upcoming visits.
+    """
+    form = CancelRequestedVisitForm(request.user, {"visit_id": visit_id})
+
+    if not form.is_valid():
+        return _errors(form)
+
+    form.save()
+    return HttpResponse(status=204)
+
+
+def _fulfillments_etag(request):
+    pal = request.user.pal
+    return _etag("fulfillments", pal.pk, changes.marker(changes.pal(pal.pk)))
+
+
+@api_login_required
+@require_GET
+@condition(etag_func=_fulfillments_etag)
+def fulfillments(request):
+    """Lists the pal's active fulfillments, soonest first.
+    """
+    query = request.user.pal.fulfillment_set.select_related("visit").order_by("visit__when").filter(completed=False, cancelled=False)
+    return JsonResponse({"items": [_fulfillment(f) for f in query]})
+
+
+def _available_etag(request):
+    return _etag("available", request.user.member.pk, marketplace.version(), _minute(), request.GET.urlencode())
+
+
+@api_login_required
+@require_GET
+@condition(etag_func=_available_etag)
+def available(request):
+    """Lists the visits waiting for a pal, soonest first, paginated by the
+    "after" cursor. Accepts the same filters as the HTML view.
+    """
+    since = _minute()
+    filters = AvailableVisitsFilterForm(request.GET)
+
+    if filters.is_valid() and filters.is_filtered():
+        query = filters.filter(Visit.objects.unscheduled(since).exclude(member=request.user.member))
+        page = pagination.paginate(query, request.GET.get("after"))
+    elif filters.is_valid():
+        page = marketplace.available(request.user.member, request.GET.get("after"), now=since)
+    else:
+        return _errors(filters)
+
+    return JsonResponse(_page(page, _visit))
+
+
+@api_login_required
+@require_POST
+def accept_visit(request, visit_id):
+    """Schedules the pal for the visit.
+    """
+    form = AcceptVisitForm(request.user, {"visit_id": visit_id})
+
+    if not form.is_valid():
+        return _errors(form)
+
+    fulfillment = form.save()
+
+    if fulfillment is None:
+        return _conflict("Another Pal has already accepted this appointment.")
+
+    return JsonResponse(_fulfillment(fulfillment), status=201)
+
+
+@api_login_required
+@require_POST
+def complete_fulfillment(request, fulfillment_id):
+    """Completes one of the pal's finished fulfillments.
+    """
+    form = CompleteFulfillmentForm(request.user, {"fulfillment_id": fulfillment_id})
+
+    if not form.is_valid():
+        return _errors(form)
+
+    if not form.save():
+        return _conflict("That fulfillment can no longer be completed.")
+
+    return HttpResponse(status=204)
+
+
+@api_login_required
+@require_POST
+def cancel_fulfillment(request, fulfillment_id):
+    """Cancels one of the pal's upcoming fulfillments.
+    """
+    form = CancelFulfillmentForm(request.user, {"fulfillment_id": fulfillment_id})
+
+    if not form.is_valid():
+        return _errors(form)
+
+    if not form.save():
+        return _conflict("That fulfillment can no longer be cancelled.")
+
+    return HttpResponse(status=204)
+
+
+# How long clients should wait before reconnecting to available_events, in
+# milliseconds
+SSE_RETRY = 10000
+
+
+def last_event_id(request):
+    """Returns the id of the last event the client has seen, from the
+    Last-Event-ID header sent when an EventSource reconnects or the "after"
+    parameter, or None if neither is set.
+    """
+    try:
+        return int(request.headers.get("Last-Event-ID") or request.GET["after"])
+    except (KeyError, ValueError):
+        return None
+
+
+def sse_message(event):
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(_visit(event.visit))}\n\n"
+
+
+@api_login_required
+@require_GET
+def available_events(request):
+    """Sends the events (see visits.app.events) following the client's last
+    event as server-sent events, then closes the stream and asks the client to
+    reconnect after SSE_RETRY. When running under ASGI, this is replaced by
+    visits.async_views.available_events, which keeps the stream open.
+    """
+    last_id = last_event_id(request)
+    messages = [f"retry: {SSE_RETRY}\n\n"]
+
+    if last_id is None:
+        messages.append(f"id: {events.latest()}\n\n")
+    else:
+        messages.extend(sse_message(event) for event in events.following(request.user.member, last_id))
+
+    return HttpResponse("".join(messages), content_type="text/event-stream", headers={"Cache-Control": "no-cache"})
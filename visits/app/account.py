@@ -1,7 +1,17 @@
 """Logic for managing user accounts, for both Pals and Members.
 """
+import secrets
+from collections import namedtuple
+from itertools import islice
+
 from django.db import transaction
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
 from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
 
 from visits.models import Pal, Member
 
@@ -24,3 +34,120 @@ def add_new_account(first, last, email, pwd, member_plan_minutes, commit=True):
         pal.save()
 
     return user
+
+
+# The fields of each row read by import_accounts
+IMPORT_FIELDS = ("first_name", "last_name", "email", "plan_minutes")
+
+ImportedChunk = namedtuple("ImportedChunk", ["created", "duplicates", "invalid"])
+_ImportRow = namedtuple("_ImportRow", ["first", "last", "email", "plan_minutes", "password"])
+
+
+def _clean(line, row, with_password):
+    """Returns the validated _ImportRow of an import row, raising a
+    ValidationError if it is not valid.
+    """
+    first = (row.get("first_name") or "").strip()
+    last = (row.get("last_name") or "").strip()
+    email = (row.get("email") or "").strip()
+    password = row.get("password") or None
+
+    if not first or not last:
+        raise ValidationError(f"Line {line}: first_name and last_name are required.")
+
+    try:
+        validate_email(email)
+    except ValidationError:
+        raise ValidationError(f"Line {line}: {email!r} is not a valid email address.")
+
+    try:
+        plan_minutes = int(row.get("plan_minutes") or 0)
+    except (TypeError, ValueError):
+        raise ValidationError(f"Line {line}: plan_minutes must be a whole number.")
+
+    if plan_minutes < 0:
+        raise ValidationError(f"Line {line}: plan_minutes may not be negative.")
+
+    if with_password and not password:
+        raise ValidationError(f"Line {line}: password is required.")
+
+    return _ImportRow(first, last, email, plan_minutes, password)
+
+
+@transaction.atomic
+def _import_chunk(chunk, hash_passwords):
+    """Creates the accounts in a chunk of (line, row) pairs, skipping invalid
+    rows and those whose email already has an account.
+    """
+    rows = {}
+    duplicates = []
+    invalid = []
+
+    for line, row in chunk:
+        try:
+            row = _clean(line, row, hash_passwords is not None)
+        except ValidationError as e:
+            invalid.append(e.message)
+            continue
+
+        if row.email in rows:
+            duplicates.append(row.email)
+        else:
+            rows[row.email] = row
+
+    # Accounts are created with the email as the username, so existing
+    # accounts are found with a single lookup on the username's unique index
+    for email in User.objects.filter(username__in=rows).values_list("username", flat=True):
+        duplicates.append(email)
+        del rows[email]
+
+    rows = list(rows.values())
+
+    if hash_passwords is None:
+        # As make_password(None) would, but faster. Unusable passwords are
+        # random, so each invite token is unique.
+        passwords = [UNUSABLE_PASSWORD_PREFIX + secrets.token_hex(20) for _ in rows]
+    else:
+        passwords = hash_passwords([row.password for row in rows])
+
+    User.objects.bulk_create(
+        User(username=row.email, email=row.email, first_name=row.first, last_name=row.last, password=password)
+        for row, password in zip(rows, passwords)
+    )
+
+    # Not every backend returns primary keys from a bulk insert, so the new
+    # users are selected back out
+    users = User.objects.in_bulk([row.email for row in rows], field_name="username")
+    created = [users[row.email] for row in rows]
+
+    Member.objects.bulk_create(Member(account=user, plan_minutes=row.plan_minutes) for user, row in zip(created, rows))
+    Pal.objects.bulk_create(Pal(account=user) for user in created)
+
+    return ImportedChunk(created, duplicates, invalid)
+
+
+def import_accounts(rows, chunk_size=1000, hash_passwords=None):
+    """Creates a user account, with its Member and Pal, for each row of an
+    iterable of dicts with the keys in IMPORT_FIELDS. This is a generator,
+    which creates the accounts in chunks of up to chunk_size, one transaction
+    per chunk, yielding an ImportedChunk of the Users created, the emails
+    skipped as duplicates and the errors of the invalid rows skipped.
+
+    If hash_passwords is None, the accounts are created with unusable
+    passwords, and their owners are invited to set one (see invite_token).
+    Otherwise, each row must also have a "password", and hash_passwords is
+    called with each chunk's list of passwords and must return their hashes
+    (e.g. make_password, mapped over a process pool).
+    """
+    rows = enumerate(rows, start=1)
+
+    while chunk := list(islice(rows, chunk_size)):
+        yield _import_chunk(chunk, hash_passwords)
+
+
+def invite_token(user):
+    """Returns the uidb64 and token for the password reset confirmation page,
+    through which an imported user sets their password. The token is valid
+    until the password is set, for up to PASSWORD_RESET_TIMEOUT.
+    """
+    return urlsafe_base64_encode(force_bytes(user.pk)), default_token_generator.make_token(user)
@@ -0,0 +1,76 @@
+"""Cached minute balances for display.
+
+A Member's balances are a function of their ledger, their plan_minutes and the
+month, so they are cached under a key made from all three. Every ledger write
+goes through visits.app.ledger, which increments Member.ledger_version, so a
+write moves the account on to a new key and the old entry is never read again.
+Checking the current version is a primary key lookup, which is far cheaper
+than recomputing the balances from the account's MinuteRollups.
+
+Balances are only stored once the transaction that computed them has
+committed, so a rolled back transaction cannot leave behind an entry for a
+version that is later reused. Balance checks guarding ledger writes (see
+visits.app.scheduling) should not use the cache; they call
+Member.minutes_available directly, under the account's lock.
+
+Setting BALANCE_CACHE_VERIFY_RATE to a fraction between 0 and 1 recomputes
+that share of cache hits and logs a warning whenever the cached value differs.
+"""
+import logging
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from visits.app.util import utcnow
+from visits.models import Member
+
+
+logger = logging.getLogger(__name__)
+
+BALANCE_TIMEOUT = 24 * 60 * 60
+
+
+def _key(member_id, version, plan_minutes, month, year):
+    return f"balance:{member_id}:{version}:{plan_minutes}:{year}-{month}"
+
+
+def _compute(member_id, month, year):
+    """Returns the key and the (remaining_plan_minutes, available_minutes) of
+    the member, selected in the same query so they always agree.
+    """
+    version, plan_minutes, remaining, available = (
+        Member.objects
+        .with_minutes_available(month, year)
+        .values_list("ledger_version", "plan_minutes", "remaining_plan_minutes", "available_minutes")
+        .get(pk=member_id)
+    )
+
+    return _key(member_id, version, plan_minutes, month, year), (remaining, available)
+
+
+def for_month(member, month, year):
+    """Returns the member's (remaining_plan_minutes, available_minutes) for the
+    given month/year, from the cache if the member's ledger has not changed
+    since they were cached.
+    """
+    version, plan_minutes = Member.objects.values_list("ledger_version", "plan_minutes").get(pk=member.pk)
+    cached = cache.get(_key(member.pk, version, plan_minutes, month, year))
+
+    if cached is not None and random.random() >= settings.BALANCE_CACHE_VERIFY_RATE:
+        return cached
+
+    key, computed = _compute(member.pk, month, year)
+
+    if cached is not None and cached != computed and key == _key(member.pk, version, plan_minutes, month, year):
+        logger.warning("Cached balances %s for member %s do not match computed balances %s", cached, member.pk, computed)
+
+    transaction.on_commit(lambda: cache.set(key, computed, BALANCE_TIMEOUT))
+
+    return computed
+
+
+def current(member):
+    now = utcnow()
+    return for_month(member, now.month, now.year)
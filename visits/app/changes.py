@@ -0,0 +1,64 @@
+"""Change markers: version numbers kept in Django's cache for data which is
+expensive to read, which move on whenever the data changes. A reader may keep
+whatever it derived from the data for as long as the marker stays the same.
+
+visits.app.scheduling touches the markers of the marketplace and of the
+Members and Pals whose Visits or Fulfillments it changes. Markers start from
+the current time rather than zero, so that if one is evicted from the cache it
+does not return to a number it has already been.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+MARKETPLACE = ("marketplace",)
+
+
+def member(member_id):
+    """The scope of a Member's Visits.
+    """
+    return ("member", member_id)
+
+
+def pal(pal_id):
+    """The scope of a Pal's Fulfillments.
+    """
+    return ("pal", pal_id)
+
+
+def _key(scope):
+    return "changes:" + ":".join(str(part) for part in scope)
+
+
+def marker(scope):
+    """Returns the current marker of the scope. If the cache cannot hold it
+    (e.g. with the dummy backend), a new marker is returned every time.
+    """
+    key = _key(scope)
+    current = cache.get(key)
+
+    if current is None:
+        cache.add(key, time.time_ns(), None)
+        current = cache.get(key)
+
+    return current if current is not None else time.time_ns()
+
+
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
+
+
+def touch(*scopes):
+    """Moves each of the scopes on to a new marker, immediately and again once
+    the current transaction commits, so that anything derived from
+    uncommitted data in between is not kept.
+    """
+    keys = [_key(scope) for scope in scopes]
+    _bump(keys)
+    transaction.on_commit(lambda: _bump(keys))
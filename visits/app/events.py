@@ -0,0 +1,47 @@
+"""The feed of changes to the marketplace of unscheduled Visits, stored as
+VisitEvents. visits.app.scheduling records an event in the same transaction as
+each change, and pals' browsers follow the feed (see
+visits.async_views.available_events) instead of repeatedly reloading the list.
+
+Events are notifications rather than a replication log. Because ids are
+assigned before transactions commit, a reader may occasionally pass over an
+event which commits late, so clients should reload the list when they
+reconnect.
+"""
+from visits.app.util import utcnow
+from visits.models import VisitEvent
+
+
+BATCH_SIZE = 100
+
+
+def record(kind, visit_ids):
+    """Appends an event of the given kind for each of the Visits.
+    """
+    VisitEvent.objects.bulk_create(VisitEvent(visit_id=visit_id, kind=kind) for visit_id in visit_ids)
+
+
+def latest():
+    """Returns the id of the most recent event, or 0 if there are none.
+    """
+    return VisitEvent.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def following(member, last_id, size=BATCH_SIZE):
+    """Selects up to size events following last_id, in order, excluding those
+    of the member's own Visits.
+    """
+    return (
+        VisitEvent.objects
+        .select_related("visit")
+        .filter(id__gt=last_id)
+        .exclude(visit__member=member)
+        .order_by("id")[:size]
+    )
+
+
+def prune(age):
+    """Deletes events older than age. Returns the number deleted.
+    """
+    deleted, _ = VisitEvent.objects.filter(created__lt=utcnow() - age).delete()
+    return deleted
@@ -0,0 +1,143 @@
+"""Streaming exports of the MinuteLedger, joined to each entry's account and
+visit, for finance.
+
+Entries are read in chunks ordered by (created, id). Each chunk is a separate
+query which starts after the last entry of the previous one, ranging over
+ledger_created_idx, so memory use is bounded by the chunk size however large
+the ledger grows. Since no cursor is held open between chunks, a slow download
+does not keep a transaction (or a server-side cursor) open for its duration.
+"""
+import csv
+import io
+import json
+
+from django.db.models import Q
+
+from visits.app.util import first_day_of_month
+from visits.models import MinuteLedger
+
+
+CHUNK_SIZE = 2000
+
+FIELDS = [
+    "id",
+    "created",
+    "modified",
+    "account_id",
+    "email",
+    "first_name",
+    "last_name",
+    "visit_id",
+    "visit_when",
+    "visit_minutes",
+    "visit_status",
+    "reason",
+    "amount",
+    "cancelled",
+]
+
+
+def month_range(month, year):
+    """Returns the start and end of the month, for use as the start and end
+    of an export.
+    """
+    if month == 12:
+        return first_day_of_month(month, year), first_day_of_month(1, year + 1)
+
+    return first_day_of_month(month, year), first_day_of_month(month + 1, year)
+
+
+def ledger_chunks(start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Yields lists of up to chunk_size MinuteLedger entries created at or
+    after start and before end (either of which may be None), with their
+    accounts and visits, in order of (created, id).
+    """
+    entries = (
+        MinuteLedger.objects
+        .select_related("account", "visit")
+        .only(
+            "created", "modified", "amount", "reason", "cancelled", "account_id", "visit_id",
+            "account__email", "account__first_name", "account__last_name",
+            "visit__when", "visit__minutes", "visit__status",
+        )
+        .order_by("created", "id")
+    )
+
+    if start:
+        entries = entries.filter(created__gte=start)
+
+    if end:
+        entries = entries.filter(created__lt=end)
+
+    chunk = list(entries[:chunk_size])
+
+    while chunk:
+        yield chunk
+
+        if len(chunk) < chunk_size:
+            return
+
+        last = chunk[-1]
+        chunk = list(entries.filter(Q(created__gt=last.created) | Q(created=last.created, id__gt=last.id))[:chunk_size])
+
+
+def row(entry):
+    """Returns the values of FIELDS for the entry.
+    """
+    return {
+        "id": entry.id,
+        "created": entry.created.isoformat(),
+        "modified": entry.modified.isoformat(),
+        "account_id": entry.account_id,
+        "email": entry.account.email,
+        "first_name": entry.account.first_name,
+        "last_name": entry.account.last_name,
+        "visit_id": entry.visit_id,
+        "visit_when": entry.visit.when.isoformat(),
+        "visit_minutes": entry.visit.minutes,
+        "visit_status": entry.visit.status,
+        "reason": entry.reason,
+        "amount": entry.amount,
+        "cancelled": entry.cancelled,
+    }
+
+
+def csv_stream(chunks):
+    """Yields a CSV file, with a header row, in one string per chunk.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, FIELDS)
+    writer.writeheader()
+
+    for chunk in chunks:
+        writer.writerows(row(entry) for entry in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Just the header, when there are no entries
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def jsonl_stream(chunks):
+    """Yields a JSON lines file, one object per entry, in one string per
+    chunk.
+    """
+    for chunk in chunks:
+        yield "".join(json.dumps(row(entry)) + "\n" for entry in chunk)
+
+
+# The streams and content types of each format
+FORMATS = {
+    "csv": (csv_stream, "text/csv"),
+    "jsonl": (jsonl_stream, "application/x-ndjson"),
+}
+
+
+def export(format, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Returns an iterator of the strings making up an export of the entries
+    created between start and end in the format (a key of FORMATS).
+    """
+    stream, _ = FORMATS[format]
+    return stream(ledger_chunks(start, end, chunk_size))
@@ -0,0 +1,177 @@
+"""Logic for writing to the MinuteLedger while keeping each account's monthly
+MinuteRollup in step with it. All writes to the ledger should go through here.
+"""
+from datetime import date
+
+from django.db import transaction, IntegrityError
+from django.db.models import DateField, F, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+import visits.app.reports as reports
+from visits.models import Member, MinuteLedger, MinuteRollup
+
+
+def month_of(dt):
+    """Returns the first day of the month containing the supplied datetime,
+    which is the key used for MinuteRollups.
+    """
+    return date(dt.year, dt.month, 1)
+
+
+def lock(*account_ids):
+    """Increments the ledger_version of the accounts' Members. Until the
+    current transaction ends, this blocks any other transaction attempting to
+    write to the same accounts' ledgers, so it can be used to make a balance
+    check and the ledger write that depends on it atomic. Must be called
+    within a transaction.
+    """
+    Member.objects.filter(account_id__in=account_ids).update(ledger_version=F("ledger_version") + 1)
+
+
+def _plan(account_id):
+    """Returns the account's current plan_minutes (or 0 if it has no Member) as
+    an expression, for recording on a new rollup without a separate query.
+    """
+    return Coalesce(Subquery(Member.objects.filter(account_id=account_id).values("plan_minutes")[:1]), 0)
+
+
+def apply(account_id, month, credits=0, debits=0):
+    """Adds the supplied credits and debits to the account's MinuteRollup for
+    the month, creating it if necessary. Must be called within a transaction.
+    """
+    rollups = MinuteRollup.objects.filter(account_id=account_id, month=month)
+
+    if rollups.update(credits=F("credits") + credits, debits=F("debits") + debits):
+        return
+
+    try:
+        with transaction.atomic():
+            MinuteRollup.objects.create(account_id=account_id, month=month, credits=credits, debits=debits, plan_minutes=_plan(account_id))
+    except IntegrityError:
+        # Another transaction created the row first
+        rollups.update(credits=F("credits") + credits, debits=F("debits") + debits)
+
+
+@transaction.atomic
+def add(account, visit, reason, amount):
+    """Creates a new MinuteLedger entry and adds it to the account's rollup.
+    """
+    lock(account.pk)
+
+    entry = MinuteLedger(account=account, visit=visit, reason=reason, amount=amount)
+    entry.save()
+
+    if amount > 0:
+        apply(entry.account_id, month_of(entry.created), credits=amount)
+    else:
+        apply(entry.account_id, month_of(entry.created), debits=amount)
+
+    return entry
+
+
+@transaction.atomic
+def add_many(entries):
+    """Bulk inserts the supplied unsaved MinuteLedger entries and adds them to
+    their accounts' rollups, writing each affected rollup once.
+    """
+    lock(*{entry.account_id for entry in entries})
+
+    entries = MinuteLedger.objects.bulk_create(entries)
+    totals = {}
+
+    for entry in entries:
+        credits, debits = totals.get((entry.account_id, month_of(entry.created)), (0, 0))
+
+        if entry.amount > 0:
+            credits += entry.amount
+        else:
+            debits += entry.amount
+
+        totals[(entry.account_id, month_of(entry.created))] = (credits, debits)
+
+    for (account_id, month), (credits, debits) in totals.items():
+        apply(account_id, month, credits=credits, debits=debits)
+
+    return entries
+
+
+def _totals(entries):
+    """Groups the supplied MinuteLedger queryset by account and month, summing
+    credits and debits separately.
+    """
+    return (
+        entries
+        .annotate(month=TruncMonth("created", output_field=DateField()))
+        .values("account_id", "month")
+        .annotate(
+            credits=Sum("amount", filter=Q(amount__gt=0)),
+            debits=Sum("amount", filter=Q(amount__lt=0)),
+        )
+        .order_by()
+    )
+
+
+@transaction.atomic
+def cancel(entries):
+    """Cancels the supplied MinuteLedger entries, removing them from their
+    accounts' rollups. Returns the number of entries cancelled.
+    """
+    entries = entries.filter(cancelled=False)
+    account_ids = set(entries.values_list("account_id", flat=True))
+
+    if not account_ids:
+        return 0
+
+    # Lock before totalling so a concurrent cancellation of the same entries
+    # cannot remove them from the rollups twice
+    lock(*account_ids)
+
+    months = set()
+
+    for row in _totals(entries):
+        apply(row["account_id"], row["month"], credits=-(row["credits"] or 0), debits=-(row["debits"] or 0))
+        months.add(row["month"])
+
+    # Entries created in a closed month change its stored report
+    reports.invalidate(months)
+
+    return entries.update(cancelled=True)
+
+
+@transaction.atomic
+def rebuild(account_ids=None):
+    """Recomputes MinuteRollups from the raw MinuteLedger, either for all
+    accounts or only those listed in account_ids. Returns the number of rollup
+    rows written.
+    """
+    rollups = MinuteRollup.objects.all()
+    entries = MinuteLedger.objects.filter(cancelled=False)
+
+    # Move the accounts on to new ledger versions, so that balances cached
+    # (and ETags made) from the old rollups are not used again
+    if account_ids is not None:
+        rollups = rollups.filter(account_id__in=account_ids)
+        entries = entries.filter(account_id__in=account_ids)
+        lock(*account_ids)
+    else:
+        Member.objects.update(ledger_version=F("ledger_version") + 1)
+
+    # Keep the plans recorded for each month, and record the current plan for
+    # months which had no rollup
+    recorded = {(account_id, month): plan for account_id, month, plan in rollups.values_list("account_id", "month", "plan_minutes")}
+    members = Member.objects.all() if account_ids is None else Member.objects.filter(account_id__in=account_ids)
+    current = dict(members.values_list("account_id", "plan_minutes"))
+
+    rollups.delete()
+    reports.invalidate()
+
+    return len(MinuteRollup.objects.bulk_create(
+        MinuteRollup(
+            account_id=row["account_id"],
+            month=row["month"],
+            credits=row["credits"] or 0,
+            debits=row["debits"] or 0,
+            plan_minutes=recorded.get((row["account_id"], row["month"]), current.get(row["account_id"], 0)),
+        )
+        for row in _totals(entries).iterator()
+    ))
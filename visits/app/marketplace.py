@@ -0,0 +1,71 @@
+"""A shared, cached snapshot of the marketplace of unscheduled Visits which is
+displayed to every Pal.
+
+The snapshot is stored in Django's cache under the marketplace's change marker
+(see visits.app.changes), which visits.app.scheduling touches whenever a Visit
+enters or leaves the marketplace. Pals' own Visits are excluded from the
+snapshot in memory, so all Pals share the same one.
+
+When the snapshot is missing, only one request at a time rebuilds it. Others
+are served the previous snapshot until it is ready. In deployments with more
+than one process, the cache backend must be shared between them (e.g. the
+file-based or memcached backends) for changes in one process to invalidate
+the snapshot in the others.
+"""
+from django.core.cache import cache
+
+import visits.app.changes as changes
+import visits.app.pagination as pagination
+from visits.app.util import utcnow
+from visits.models import Visit
+
+
+SNAPSHOT_TIMEOUT = 300
+REBUILD_LOCK_TIMEOUT = 30
+
+LATEST_KEY = "marketplace:latest"
+
+
+def version():
+    """Returns the version of the snapshot which is currently valid.
+    """
+    return changes.marker(changes.MARKETPLACE)
+
+
+def snapshot():
+    """Returns the list of unscheduled Visits, ordered by (when, id), from the
+    cache if possible.
+    """
+    key = f"marketplace:{version()}"
+    visits = cache.get(key)
+
+    if visits is not None:
+        return visits
+
+    if cache.add(f"{key}:lock", True, REBUILD_LOCK_TIMEOUT):
+        try:
+            visits = list(Visit.objects.unscheduled().order_by("when", "id"))
+            cache.set_many({key: visits, LATEST_KEY: visits}, SNAPSHOT_TIMEOUT)
+        finally:
+            cache.delete(f"{key}:lock")
+
+        return visits
+
+    # Another request is rebuilding the snapshot. Serve the previous one in
+    # the meantime, unless there is none.
+    visits = cache.get(LATEST_KEY)
+
+    if visits is not None:
+        return visits
+
+    return list(Visit.objects.unscheduled().order_by("when", "id"))
+
+
+def available(member, cursor=None, size=pagination.PAGE_SIZE, now=None):
+    """Returns a Page of the Visits in the marketplace snapshot, excluding the
+    member's own Visits and any which started before now (by default, the
+    current time).
+    """
+    now = now or utcnow()
+    visits = (v for v in snapshot() if v.when >= now and v.member_id != member.pk)
+    return pagination.paginate_sorted(visits, cursor, size)
@@ -0,0 +1,107 @@
+"""Keyset (cursor) pagination for lists of Visits, ordered by (when, id).
+
+Rather than an offset, each page's cursor records the (when, id) of the last
+row on the page, and the next page selects the rows after it. Each page is
+therefore an index range scan no matter how far into the list it is, and rows
+inserted or removed elsewhere in the list do not shift the pages.
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from itertools import islice
+
+from django.db.models import Q
+
+
+PAGE_SIZE = 25
+
+
+class Page:
+    """A page of results. next_cursor is None on the last page.
+    """
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(when, pk):
+    """Returns an opaque, URL-safe cursor for the row with the given when/id.
+    """
+    return urlsafe_b64encode(f"{when.isoformat()}|{pk}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the (when, id) encoded in the cursor, or None if the cursor is
+    empty or invalid. Cursors come from the client, so any that fail to decode,
+    or whose when has no timezone (and so could not be compared with the
+    visits' times), are treated as invalid.
+    """
+    try:
+        when, pk = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        when, pk = datetime.fromisoformat(when), int(pk)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+    if when.tzinfo is None:
+        return None
+
+    return when, pk
+
+
+def _keyset(queryset, cursor, descending):
+    """Orders the queryset by (when, id) and selects the rows following the
+    cursor, plus one extra row to find out whether there is another page.
+    """
+    position = decode_cursor(cursor)
+
+    if descending:
+        queryset = queryset.order_by("-when", "-id")
+        if position:
+            queryset = queryset.filter(Q(when__lt=position[0]) | Q(when=position[0], id__lt=position[1]))
+    else:
+        queryset = queryset.order_by("when", "id")
+        if position:
+            queryset = queryset.filter(Q(when__gt=position[0]) | Q(when=position[0], id__gt=position[1]))
+
+    return queryset
+
+
+def _page(items, size):
+    """Returns the Page of up to size + 1 items selected for it.
+    """
+    if len(items) > size:
+        items = items[:size]
+        return Page(items, encode_cursor(items[-1].when, items[-1].pk))
+
+    return Page(items, None)
+
+
+def paginate(queryset, cursor=None, size=PAGE_SIZE, descending=False):
+    """Returns the Page of the queryset following the cursor (or the first
+    page if there is no cursor), ordered by (when, id).
+    """
+    return _page(list(_keyset(queryset, cursor, descending)[:size + 1]), size)
+
+
+async def apaginate(queryset, cursor=None, size=PAGE_SIZE, descending=False):
+    """Asynchronous version of paginate, for async views.
+    """
+    return _page([item async for item in _keyset(queryset, cursor, descending)[:size + 1]], size)
+
+
+def paginate_sorted(items, cursor=None, size=PAGE_SIZE):
+    """Returns the Page of an iterable of Visits, already sorted by (when, id),
+    following the cursor. Cursors are interchangeable with those from
+    paginate. Stops reading items as soon as the page is full.
+    """
+    position = decode_cursor(cursor)
+
+    if position:
+        items = (v for v in items if (v.when, v.pk) > position)
+
+    return _page(list(islice(items, size + 1)), size)
@@ -0,0 +1,212 @@
+"""Bulk changes to Members' plan_minutes, as when an insurer changes its
+coverage for thousands of members at once.
+
+Changes take effect from the start of a month. Those effective this month (or
+earlier) are applied straight away, replacing any earlier changes still
+waiting to be applied. Those effective later are stored as PlanChanges and
+applied by apply_due once their month arrives (see the apply_plan_changes
+command).
+
+Each MinuteRollup records the plan of its month, which is what balances count
+that month's debits against once it has closed (see
+MemberQuerySet.with_minutes_available). Applying a change sets the Member's
+plan_minutes, for the open month and later, and records it on the Member's
+rollups from the effective month on (discarding any monthly reports stored
+for those months), so months before it keep their plans.
+Plans changed other than through here (e.g. by saving a Member) apply to the
+open month, but are not recorded on its rollup.
+
+Applying a change also increments the Members' ledger_version, retiring the
+balances cached by visits.app.balances and the API's balance ETags.
+"""
+from collections import namedtuple
+from datetime import date
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+
+import visits.app.reports as reports
+from visits.app.util import utcnow
+from visits.models import Member, MinuteRollup, PlanChange
+
+
+CHUNK_SIZE = 1000
+
+PlanUpdate = namedtuple("PlanUpdate", ["changed", "unknown", "invalid"])
+
+
+def current_month():
+    """Returns the first day of the current month.
+    """
+    now = utcnow()
+    return date(now.year, now.month, 1)
+
+
+def _record(plans, effective):
+    """Records the plan_minutes of each Member id in the plans dict on their
+    MinuteRollups from the effective month on, with one UPDATE per distinct
+    number of minutes.
+    """
+    members = {}
+
+    for pk, minutes in plans.items():
+        members.setdefault(minutes, []).append(pk)
+
+    for minutes, pks in members.items():
+        accounts = Member.objects.filter(pk__in=pks).values("account_id")
+        MinuteRollup.objects.filter(account__in=accounts, month__gte=effective).update(plan_minutes=minutes)
+
+    reports.invalidate_since(effective)
+
+
+def _update(plans):
+    """Sets the plan_minutes of each Member id in the plans dict with a
+    bulk_update, without loading the Members.
+    """
+    Member.objects.bulk_update(
+        [Member(pk=pk, plan_minutes=minutes, ledger_version=F("ledger_version") + 1) for pk, minutes in plans.items()],
+        ["plan_minutes", "ledger_version"],
+    )
+
+
+def _apply(plans, effective, today):
+    """Applies the plan_minutes of each Member id in the plans dict from the
+    effective month, which has already begun.
+    """
+    _record(plans, effective)
+    _update(plans)
+    PlanChange.objects.filter(member__in=list(plans), effective__lte=today).delete()
+
+
+def _schedule(plans, effective):
+    """Stores a PlanChange for each Member id in the plans dict, replacing any
+    already stored for the same month.
+    """
+    PlanChange.objects.bulk_create(
+        [PlanChange(member_id=pk, plan_minutes=minutes, effective=effective) for pk, minutes in plans.items()],
+        update_conflicts=True,
+        unique_fields=["member", "effective"],
+        update_fields=["plan_minutes"],
+    )
+
+
+def _clean(line, row):
+    email = (row.get("email") or "").strip()
+
+    if not email:
+        raise ValidationError(f"Line {line}: email is required.")
+
+    try:
+        plan_minutes = int(row.get("plan_minutes"))
+    except (TypeError, ValueError):
+        raise ValidationError(f"Line {line}: plan_minutes must be a whole number.")
+
+    if plan_minutes < 0:
+        raise ValidationError(f"Line {line}: plan_minutes may not be negative.")
+
+    return email, plan_minutes
+
+
+@transaction.atomic
+def _change_chunk(chunk, effective, today):
+    plans = {}
+    invalid = []
+
+    for line, row in chunk:
+        try:
+            email, plan_minutes = _clean(line, row)
+        except ValidationError as e:
+            invalid.append(e.message)
+            continue
+
+        # The last row for an email wins
+        plans[email] = plan_minutes
+
+    # One lookup on the username's unique index (accounts are created with the
+    # email as the username) for the whole chunk
+    members = dict(Member.objects.filter(account__username__in=plans).values_list("account__username", "pk"))
+    unknown = [email for email in plans if email not in members]
+    plans = {members[email]: plan_minutes for email, plan_minutes in plans.items() if email in members}
+
+    if effective <= today:
+        _apply(plans, effective, today)
+    else:
+        _schedule(plans, effective)
+
+    return PlanUpdate(len(plans), unknown, invalid)
+
+
+def change(rows, effective, chunk_size=CHUNK_SIZE):
+    """Changes the plan_minutes of the Members in an iterable of dicts with
+    the keys "email" and "plan_minutes", from the month of the effective date.
+    This is a generator, which works in chunks of up to chunk_size rows, one
+    transaction per chunk, yielding a PlanUpdate of the number of Members
+    changed (or scheduled to change), the emails with no Member and the errors
+    of the invalid rows skipped.
+    """
+    effective = effective.replace(day=1)
+    today = current_month()
+    rows = enumerate(rows, start=1)
+
+    while chunk := list(islice(rows, chunk_size)):
+        yield _change_chunk(chunk, effective, today)
+
+
+@transaction.atomic
+def change_members(members, plan_minutes, effective, chunk_size=CHUNK_SIZE):
+    """Changes the plan_minutes of every Member in the queryset, from the month
+    of the effective date. Returns the number of Members changed (or scheduled
+    to change).
+    """
+    effective = effective.replace(day=1)
+    today = current_month()
+
+    if effective <= today:
+        PlanChange.objects.filter(member__in=members.values("pk"), effective__lte=today).delete()
+        MinuteRollup.objects.filter(account__in=members.values("account_id"), month__gte=effective).update(plan_minutes=plan_minutes)
+        reports.invalidate_since(effective)
+        return members.update(plan_minutes=plan_minutes, ledger_version=F("ledger_version") + 1)
+
+    ids = members.values_list("pk", flat=True).iterator(chunk_size=chunk_size)
+    count = 0
+
+    while chunk := list(islice(ids, chunk_size)):
+        _schedule(dict.fromkeys(chunk, plan_minutes), effective)
+        count += len(chunk)
+
+    return count
+
+
+def apply_due(chunk_size=CHUNK_SIZE):
+    """Applies the PlanChanges effective this month or earlier, oldest first,
+    deleting them as they are applied. Works in chunks of up to chunk_size,
+    one transaction per chunk, so may be interrupted and run again. Returns
+    the number applied.
+    """
+    today = current_month()
+    due = PlanChange.objects.filter(effective__lte=today).order_by("effective", "pk")
+    applied = 0
+
+    while True:
+        with transaction.atomic():
+            chunk = list(due.values_list("pk", "member_id", "plan_minutes", "effective")[:chunk_size])
+
+            if not chunk:
+                return applied
+
+            # Record each month's changes in order, so that where a Member has
+            # several, each applies until the next and the latest wins
+            months = {}
+
+            for _, member_id, minutes, effective in chunk:
+                months.setdefault(effective, {})[member_id] = minutes
+
+            for effective, plans in months.items():
+                _record(plans, effective)
+
+            _update({member_id: minutes for _, member_id, minutes, _ in chunk})
+            PlanChange.objects.filter(pk__in=[pk for pk, _, _, _ in chunk]).delete()
+
+        applied += len(chunk)
@@ -0,0 +1,195 @@
+"""Monthly usage and earnings figures for the operations dashboard (see
+visits.views.monthly_reports).
+
+Each month's figures come from four GROUP BY queries, over MinuteRollups,
+MinuteLedger entries of completed visits, Visits and Fulfillments, each a
+range scan of an index on the month or date. Any number of months is computed
+with the same four queries.
+
+A closed month's figures are computed once and stored as a MonthlyReport, so
+that the dashboard reads every past month from a single small table and only
+the open month is computed live. Stored months are discarded whenever the
+figures they were computed from change (see invalidate), which happens when a
+ledger entry created in an earlier month or a visit in an earlier month is
+cancelled, a plan change takes effect from an earlier month, or the rollups are
+rebuilt, and computed again the next time they are needed.
+
+The split of minutes used between plan and banked minutes uses the plan
+recorded on each MinuteRollup, like the balances do.
+"""
+from datetime import date, datetime
+
+from django.db.models import Count, DateField, F, IntegerField, Min, Q, Sum
+from django.db.models.functions import Least, TruncMonth
+
+from visits.app.util import UTC, utcnow
+from visits.models import Fulfillment, MinuteLedger, MinuteRollup, MonthlyReport, Visit
+
+
+def next_month(month):
+    """Returns the first day of the month following the supplied one.
+    """
+    return date(month.year + 1, 1, 1) if month.month == 12 else date(month.year, month.month + 1, 1)
+
+
+def current_month():
+    """Returns the first day of the current month, which is the open month.
+    """
+    now = utcnow()
+    return date(now.year, now.month, 1)
+
+
+def _months(start, end):
+    month = start
+
+    while month < end:
+        yield month
+        month = next_month(month)
+
+
+def datetime_of(month):
+    """Returns the start of the month as a UTC datetime.
+    """
+    return datetime(month.year, month.month, 1, tzinfo=UTC)
+
+
+def _by_month(queryset, field, start, end, **aggregates):
+    """Returns the aggregates of the queryset, filtered to the range start to
+    end of the field, for each month in that range. A single month (the open
+    one, on every view of the dashboard) is aggregated without truncating each
+    row's date, which on sqlite is a Python function call per row.
+    """
+    if end == next_month(start):
+        return {start: queryset.aggregate(**aggregates)}
+
+    rows = (
+        queryset
+        .annotate(month=TruncMonth(field, output_field=DateField()))
+        .values("month")
+        .annotate(**aggregates)
+        .order_by()
+    )
+
+    return {row["month"]: row for row in rows}
+
+
+def compute(start, end):
+    """Returns an unsaved MonthlyReport for each month from start up to (but
+    not including) end, both of which are first days of months.
+    """
+    reports = {month: MonthlyReport(month=month) for month in _months(start, end)}
+
+    if not reports:
+        return []
+
+    # Rollups are already monthly
+    rollups = (
+        MinuteRollup.objects
+        .filter(month__gte=start, month__lt=end)
+        .values("month")
+        .annotate(
+            minutes_used=-Sum("debits"),
+            plan_minutes_used=Sum(Least(-F("debits"), F("plan_minutes"), output_field=IntegerField())),
+        )
+        .order_by()
+    )
+
+    for row in rollups:
+        report = reports[row["month"]]
+        report.minutes_used = row["minutes_used"] or 0
+        report.plan_minutes_used = row["plan_minutes_used"] or 0
+        report.banked_minutes_used = report.minutes_used - report.plan_minutes_used
+
+    earnings = _by_month(
+        MinuteLedger.objects.filter(
+            created__gte=datetime_of(start),
+            created__lt=datetime_of(end),
+            reason=MinuteLedger.VISIT_FULFILLED,
+            cancelled=False,
+        ),
+        "created",
+        start,
+        end,
+        minutes_fulfilled=Sum("visit__minutes"),
+        minutes_earned=Sum("amount"),
+    )
+
+    for month, row in earnings.items():
+        report = reports[month]
+        report.minutes_fulfilled = row["minutes_fulfilled"] or 0
+        report.minutes_earned = row["minutes_earned"] or 0
+        report.platform_minutes = report.minutes_fulfilled - report.minutes_earned
+
+    visits = _by_month(
+        Visit.objects.filter(when__gte=datetime_of(start), when__lt=datetime_of(end)),
+        "when",
+        start,
+        end,
+        visits=Count("id"),
+        visits_cancelled=Count("id", filter=Q(status=Visit.CANCELLED)),
+    )
+
+    for month, row in visits.items():
+        reports[month].visits = row["visits"]
+        reports[month].visits_cancelled = row["visits_cancelled"]
+
+    fulfillments = _by_month(
+        Fulfillment.objects.filter(visit__when__gte=datetime_of(start), visit__when__lt=datetime_of(end)),
+        "visit__when",
+        start,
+        end,
+        fulfillments=Count("id"),
+        fulfillments_cancelled=Count("id", filter=Q(cancelled=True)),
+    )
+
+    for month, row in fulfillments.items():
+        reports[month].fulfillments = row["fulfillments"]
+        reports[month].fulfillments_cancelled = row["fulfillments_cancelled"]
+
+    return list(reports.values())
+
+
+def monthly():
+    """Returns the MonthlyReport of every month from the first with any
+    minutes used or earned up to the current one, newest first. Closed months
+    are read from those stored, computing and storing any missing. The current
+    month is computed afresh and not stored.
+    """
+    current = current_month()
+    first = MinuteRollup.objects.aggregate(first=Min("month"))["first"] or current
+    stored = {report.month: report for report in MonthlyReport.objects.filter(month__gte=first, month__lt=current)}
+    missing = [month for month in _months(first, current) if month not in stored]
+
+    if missing:
+        computed = [report for report in compute(missing[0], next_month(missing[-1])) if report.month not in stored]
+
+        # Another request may have stored some of the same months first
+        MonthlyReport.objects.bulk_create(computed, ignore_conflicts=True)
+        stored.update((report.month, report) for report in computed)
+
+    return compute(current, next_month(current)) + [stored[month] for month in sorted(stored, reverse=True)]
+
+
+def invalidate(months=None):
+    """Discards the stored MonthlyReports of the months (by default, of every
+    month), so that they are computed again when next needed. Months which
+    have not closed are never stored, and are skipped without a query.
+    """
+    if months is None:
+        MonthlyReport.objects.all().delete()
+        return
+
+    current = current_month()
+    months = [month for month in months if month < current]
+
+    if months:
+        MonthlyReport.objects.filter(month__in=months).delete()
+
+
+def invalidate_since(month):
+    """Discards the stored MonthlyReports from the month on, as when a plan
+    change is recorded on the rollups of closed months. Skips the query when
+    the month has not closed.
+    """
+    if month < current_month():
+        MonthlyReport.objects.filter(month__gte=month).delete()
@@ -1,16 +1,26 @@
 """Logic for scheduling, accepting, cancelling, and completing visits for
 Members and Pals.
 """
-from django.core.exceptions import ValidationError
-from django.db import transaction
+from datetime import timedelta
 
+from django.core.exceptions import ValidationError
+from django.db import transaction, IntegrityError
+from django.db.models import DateField
+from django.db.models.functions import Now, TruncMonth
+
+import visits.app.changes as changes
+import visits.app.events as events
+import visits.app.ledger as ledger
+import visits.app.reports as reports
 from visits.app.util import utcnow
-from visits.models import Visit, Fulfillment, MinuteLedger
+from visits.models import Visit, VisitEvent, VisitSeries, Fulfillment, MinuteLedger
 
 
 MIN_VISIT_LENGTH = 10
 DEFAULT_VISIT_LENGTH = 60
 FULFILLMENT_PAL_CUT = 0.85
+MIN_SERIES_OCCURRENCES = 2
+MAX_SERIES_OCCURRENCES = 26
 
 
 def validate_new_visit(member, when, minutes):
@@ -36,12 +46,25 @@ def create_visit(member, when, minutes, tasks, commit=True):
 
     if commit:
         visit.save()
-        minutes = MinuteLedger(account=member.account, visit=visit, reason=MinuteLedger.VISIT_SCHEDULED, amount=-minutes)
-        minutes.save()
+        ledger.add(member.account, visit, MinuteLedger.VISIT_SCHEDULED, -minutes)
+        changes.touch(changes.MARKETPLACE, changes.member(member.pk))
+        events.record(VisitEvent.CREATED, [visit.pk])
 
     return visit
 
 
+@transaction.atomic
+def book_visit(member, when, minutes, tasks):
+    """Validates and creates a new Visit as a single atomic operation. The
+    member's account is locked before the balance check, so concurrent
+    requests (even from other processes) cannot both spend the same minutes.
+    Raises a ValidationError if the visit may not be booked.
+    """
+    ledger.lock(member.account_id)
+    validate_new_visit(member, when, minutes)
+    return create_visit(member, when, minutes, tasks)
+
+
 def validate_member_visit_cancellation(member, visit_id):
     """Raises a ValidationError if the Visit does not exist, does not belong to
     the Member, occurred in the past, or has already been cancelled.
@@ -66,10 +89,123 @@ def cancel_visit(visit, commit=True):
     fulfillments and invalidates MinuteLedger entries.
     """
     visit.cancelled = True
+    visit.status = Visit.CANCELLED
     if commit:
         visit.save()
-        visit.fulfillment_set.all().update(cancelled=True)
-        visit.minuteledger_set.all().update(cancelled=True)
+        cancel_visits(Visit.objects.filter(pk=visit.pk))
+
+
+@transaction.atomic
+def cancel_visits(visits):
+    """Cancels every Visit in the supplied queryset, along with their
+    fulfillments and MinuteLedger entries, using a fixed number of set-based
+    updates regardless of how many visits are selected. Returns the number of
+    visits cancelled.
+    """
+    ids = list(visits.values_list("pk", flat=True))
+    rows = list(
+        Visit.objects.filter(pk__in=ids)
+        .annotate(month=TruncMonth("when", output_field=DateField()))
+        .values_list("member_id", "month")
+    )
+    members = {member for member, _ in rows}
+    pals = set(Fulfillment.objects.filter(visit__in=ids, cancelled=False).values_list("pal_id", flat=True))
+
+    Fulfillment.objects.filter(visit__in=ids).update(cancelled=True)
+    ledger.cancel(MinuteLedger.objects.filter(visit__in=ids))
+    changes.touch(changes.MARKETPLACE, *map(changes.member, members), *map(changes.pal, pals))
+    events.record(VisitEvent.CANCELLED, ids)
+
+    # Cancelled visits are counted in their own month's report, which may
+    # differ from the month their ledger entries were created in
+    reports.invalidate({month for _, month in rows})
+
+    return Visit.objects.filter(pk__in=ids).update(cancelled=True, status=Visit.CANCELLED)
+
+
+def validate_new_series(member, when, minutes, cadence, occurrences):
+    """Raises a ValidationError if a series of visits beginning at the given
+    time cannot be booked. Every visit in the series is paid for when the
+    series is booked, so the member must have minutes available for the whole
+    series in each month the series touches. This costs one balance query per
+    month, rather than one per visit.
+    """
+    if when <= utcnow():
+        raise ValidationError("Visits must be scheduled in advance.")
+
+    if not MIN_SERIES_OCCURRENCES <= occurrences <= MAX_SERIES_OCCURRENCES:
+        raise ValidationError(f"A series must have between {MIN_SERIES_OCCURRENCES} and {MAX_SERIES_OCCURRENCES} visits.")
+
+    total = minutes * occurrences
+    months = sorted({(d.year, d.month) for d in VisitSeries.dates(when, cadence, occurrences)})
+
+    for year, month in months:
+        available = member.minutes_available(month, year)
+
+        if total > available:
+            raise ValidationError(f"This series needs {total} minutes, but you have {available} minutes available in {month}/{year}. You can earn more minutes by visiting other members, cancelling planned visits, or scheduling fewer visits.")
+
+
+@transaction.atomic
+def create_series(member, when, minutes, tasks, cadence, occurrences):
+    """Creates a VisitSeries along with all of its Visits and the MinuteLedger
+    entries paying for them, using bulk inserts.
+    """
+    series = VisitSeries(member=member, cadence=cadence, occurrences=occurrences)
+    series.save()
+
+    Visit.objects.bulk_create(
+        Visit(member=member, series=series, when=d, minutes=minutes, tasks=tasks)
+        for d in VisitSeries.dates(when, cadence, occurrences)
+    )
+
+    # Not every backend returns primary keys from a bulk insert, so select the
+    # new visits back out to link them to their ledger entries
+    visits = list(series.visit_set.all())
+
+    ledger.add_many([
+        MinuteLedger(account=member.account, visit=visit, reason=MinuteLedger.VISIT_SCHEDULED, amount=-visit.minutes)
+        for visit in visits
+    ])
+
+    changes.touch(changes.MARKETPLACE, changes.member(member.pk))
+    events.record(VisitEvent.CREATED, [visit.pk for visit in visits])
+
+    return series
+
+
+@transaction.atomic
+def book_series(member, when, minutes, tasks, cadence, occurrences):
+    """Validates and creates a new VisitSeries as a single atomic operation,
+    under the same per-account lock as book_visit. Raises a ValidationError if
+    the series may not be booked.
+    """
+    ledger.lock(member.account_id)
+    validate_new_series(member, when, minutes, cadence, occurrences)
+    return create_series(member, when, minutes, tasks, cadence, occurrences)
+
+
+def validate_member_series_cancellation(member, series_id):
+    """Raises a ValidationError if the VisitSeries does not exist, does not
+    belong to the Member, or has no upcoming visits left to cancel.
+    """
+    series = None
+
+    try:
+        series = member.visitseries_set.get(pk=series_id)
+        if not series.visit_set.filter(cancelled=False, when__gt=utcnow()).exists():
+            raise ValidationError("That series has no upcoming appointments.")
+    except VisitSeries.DoesNotExist:
+        raise ValidationError("Appointment series not found.")
+
+    return series
+
+
+def cancel_series(series):
+    """Cancels all of the series' upcoming visits as a unit. Visits which have
+    already started are left alone. Returns the number of visits cancelled.
+    """
+    return cancel_visits(series.visit_set.filter(cancelled=False, when__gt=Now()))
 
 
 def validate_new_fulfillment(pal, visit_id):
@@ -83,7 +219,7 @@ def validate_new_fulfillment(pal, visit_id):
             raise ValidationError("That appointment has been cancelled.")
         if visit.when <= utcnow():
             raise ValidationError("That appointment has already occurred.")
-        if visit.fulfillment_set.filter(cancelled=False).count() > 0:
+        if visit.fulfillment_set.filter(cancelled=False).exists():
             raise ValidationError("That appointment has already been scheduled with another Pal.")
     except Visit.DoesNotExist:
         raise ValidationError("Appointment not found.")
@@ -94,23 +230,40 @@ def validate_new_fulfillment(pal, visit_id):
 def create_fulfillment(pal, visit, commit=True):
     """Creates a Fulfillment for the Visit by the Pal. The new Fulfillment is
     considered "scheduled" but not "completed".
+
+    If commit is True, the Fulfillment is saved, unless another Pal claimed the
+    Visit first (or it was cancelled), in which case None is returned. The
+    claim is a conditional update of the Visit's status, backed up by the
+    unique_active_fulfillment constraint, so competing Pals never need to
+    wait on one another.
     """
     fulfillment = Fulfillment(visit=visit, pal=pal)
 
     if commit:
-        fulfillment.save()
+        try:
+            with transaction.atomic():
+                if not Visit.objects.filter(pk=visit.pk, status=Visit.UNSCHEDULED).update(status=Visit.SCHEDULED):
+                    return None
+
+                fulfillment.save()
+                changes.touch(changes.MARKETPLACE, changes.member(visit.member_id), changes.pal(pal.pk))
+                events.record(VisitEvent.CLAIMED, [visit.pk])
+        except IntegrityError:
+            return None
+
+        visit.status = Visit.SCHEDULED
 
     return fulfillment
 
 
-def validate_fulfillment_completion(fulfillment_id):
-    """Raises a ValidationError if the Fulfillment cannot be completed; for
-    example, because it has not finished yet.
+def validate_fulfillment_completion(pal, fulfillment_id):
+    """Raises a ValidationError if the Pal's Fulfillment cannot be completed;
+    for example, because it has not finished yet.
     """
     fulfillment = None
 
     try:
-        fulfillment = Fulfillment.objects.get(pk=fulfillment_id)
+        fulfillment = pal.fulfillment_set.select_related("visit", "pal__account").get(pk=fulfillment_id)
 
         if fulfillment.completed:
             raise ValidationError("This fulfillment has already been completed.")
@@ -124,7 +277,7 @@ def validate_fulfillment_completion(fulfillment_id):
         if not fulfillment.visit.is_over:
             raise ValidationError("This appointment is not yet complete.")
 
-    except Visit.DoesNotExist:
+    except Fulfillment.DoesNotExist:
         raise ValidationError("Fulfillment for this Visit not found")
 
     return fulfillment
@@ -134,31 +287,129 @@ def validate_fulfillment_completion(fulfillment_id):
 def complete_fulfillment(fulfillment, commit=True):
     """Completes a Fulfillment. If commit is True, saves the changes and logs
     the added minutes to the Pal's ledger, at the rate of FULFILLMENT_PAL_CUT.
+
+    The change is saved as a single conditional update on the Pal's active
+    Fulfillment. Returns False if it was no longer active (e.g. it was
+    completed by a concurrent request), in which case nothing is logged.
     """
     fulfillment.completed = True
 
     if commit:
-        fulfillment.save()
+        completed = Fulfillment.objects.filter(
+            pk=fulfillment.pk,
+            pal=fulfillment.pal_id,
+            completed=False,
+            cancelled=False,
+            visit__cancelled=False,
+        ).update(completed=True)
+
+        if not completed:
+            return False
+
+        Visit.objects.filter(pk=fulfillment.visit_id).update(status=Visit.COMPLETED)
+        changes.touch(changes.member(fulfillment.visit.member_id), changes.pal(fulfillment.pal_id))
 
         # Charge a 15% fee for minutes earned, but take a short-cut by
         # hard-coding the fee instead of making it config or storing it in
-        # the database or something. :D
+        # the database or something. :D The ledger only stores whole
+        # minutes, so the pal's cut is truncated.
+        ledger.add(
+            fulfillment.pal.account,
+            fulfillment.visit,
+            MinuteLedger.VISIT_FULFILLED,
+            int(FULFILLMENT_PAL_CUT * fulfillment.visit.minutes),
+        )
+
+    return True
+
+
+def _complete_batches(fulfillments, cutoff, batch_size):
+    last = 0
+
+    while True:
+        # Select visits which started before the cutoff using the database;
+        # the few still in progress are weeded out below.
+        batch = list(
+            fulfillments
+            .select_related("visit", "pal")
+            .filter(completed=False, cancelled=False, visit__cancelled=False, visit__when__lte=cutoff, pk__gt=last)
+            .order_by("pk")[:batch_size]
+        )
+
+        if not batch:
+            return
+
+        last = batch[-1].pk
+        yield _complete_fulfillments([f for f in batch if f.visit.when + timedelta(minutes=f.visit.minutes) <= cutoff])
+
+
+def complete_finished_fulfillments(grace=timedelta(0), batch_size=500):
+    """Completes every active Fulfillment whose Visit ended at least grace ago,
+    crediting the Pals' ledgers as complete_fulfillment does. This is a
+    generator which works through the Fulfillments in primary key order, one
+    transaction per batch of up to batch_size, yielding the number completed
+    by each batch.
+
+    Already completed Fulfillments are never selected (or credited) again, so
+    if interrupted, this may simply be run again to pick up where it left off.
+    """
+    yield from _complete_batches(Fulfillment.objects.all(), utcnow() - grace, batch_size)
+
+
+def complete_fulfillments(fulfillments, batch_size=500):
+    """Completes the active Fulfillments in the queryset whose Visits have
+    ended, in batches as complete_finished_fulfillments does. Returns the
+    number completed.
+    """
+    return sum(_complete_batches(fulfillments, utcnow(), batch_size))
+
+
+@transaction.atomic
+def _complete_fulfillments(fulfillments):
+    """Completes the supplied Fulfillments and credits their Pals with a fixed
+    number of queries, skipping any that are no longer active. Returns the
+    number completed.
+    """
+    if not fulfillments:
+        return 0
+
+    ledger.lock(*{f.pal.account_id for f in fulfillments})
+
+    completed = set(
+        Fulfillment.objects
+        .select_for_update()
+        .filter(pk__in=[f.pk for f in fulfillments], completed=False, cancelled=False)
+        .values_list("pk", flat=True)
+    )
+
+    Fulfillment.objects.filter(pk__in=completed).update(completed=True)
+    Visit.objects.filter(pk__in=[f.visit_id for f in fulfillments if f.pk in completed]).update(status=Visit.COMPLETED)
+    changes.touch(
+        *{changes.member(f.visit.member_id) for f in fulfillments if f.pk in completed},
+        *{changes.pal(f.pal_id) for f in fulfillments if f.pk in completed},
+    )
+
+    ledger.add_many([
         MinuteLedger(
-            account=fulfillment.pal.account,
-            visit=fulfillment.visit,
+            account_id=f.pal.account_id,
+            visit=f.visit,
             reason=MinuteLedger.VISIT_FULFILLED,
-            amount=(FULFILLMENT_PAL_CUT * fulfillment.visit.minutes),
-        ).save()
+            amount=int(FULFILLMENT_PAL_CUT * f.visit.minutes),
+        )
+        for f in fulfillments if f.pk in completed
+    ])
+
+    return len(completed)
 
 
-def validate_fulfillment_cancellation(fulfillment_id):
-    """Raises a ValidationError if the Fulfillment cannot be cancelled; for
-    example, because it has not finished yet.
+def validate_fulfillment_cancellation(pal, fulfillment_id):
+    """Raises a ValidationError if the Pal's Fulfillment cannot be cancelled;
+    for example, because it has not finished yet.
     """
     fulfillment = None
 
     try:
-        fulfillment = Fulfillment.objects.get(pk=fulfillment_id)
+        fulfillment = pal.fulfillment_set.select_related("visit").get(pk=fulfillment_id)
 
         if fulfillment.completed:
             raise ValidationError("That fulfillment has already been completed.")
@@ -169,7 +420,7 @@ def validate_fulfillment_cancellation(fulfillment_id):
         if fulfillment.visit.has_started:
             raise ValidationError("This appointment has already started.")
 
-    except Visit.DoesNotExist:
+    except Fulfillment.DoesNotExist:
         raise ValidationError("Fulfillment for this Visit not found")
 
     return fulfillment
@@ -178,7 +429,28 @@ def validate_fulfillment_cancellation(fulfillment_id):
 def cancel_fulfillment(fulfillment, commit=True):
     """Cancels the fulfillment, committing the changes to the database if
     commit is True.
+
+    The change is saved as a single conditional update on the Pal's active,
+    not yet started Fulfillment. Returns False if it no longer qualified.
+    Otherwise, the Visit is returned to the pool of unscheduled Visits.
     """
     fulfillment.cancelled = True
+
     if commit:
-        fulfillment.save()
+        with transaction.atomic():
+            cancelled = Fulfillment.objects.filter(
+                pk=fulfillment.pk,
+                pal=fulfillment.pal_id,
+                completed=False,
+                cancelled=False,
+                visit__when__gt=Now(),
+            ).update(cancelled=True)
+
+            if not cancelled:
+                return False
+
+            Visit.objects.filter(pk=fulfillment.visit_id, status=Visit.SCHEDULED).update(status=Visit.UNSCHEDULED)
+            changes.touch(changes.MARKETPLACE, changes.member(fulfillment.visit.member_id), changes.pal(fulfillment.pal_id))
+            events.record(VisitEvent.RELEASED, [fulfillment.visit_id])
+
+    return True
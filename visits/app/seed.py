@@ -0,0 +1,226 @@
+"""Bulk generation of realistic data for load testing: user accounts (each with
+a Member and a Pal), visits in every state spread over several years of
+history and the following weeks, their fulfillments, and the ledger entries
+paying for them. Everything is written with bulk inserts, and the rollups are
+rebuilt from the ledger at the end.
+"""
+import random
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+
+import visits.app.changes as changes
+import visits.app.ledger as ledger
+from visits.app.scheduling import FULFILLMENT_PAL_CUT
+from visits.app.util import utcnow
+from visits.models import Fulfillment, Member, MinuteLedger, Pal, Visit
+
+
+PLANS = [0, 60, 120, 240, 480]
+LENGTHS = [30, 45, 60, 90, 120]
+TASKS = [
+    "Help with groceries",
+    "Company and a walk around the block",
+    "Sort out the new phone",
+    "Drive to a doctor's appointment\nWait and drive back",
+    "Yard work",
+]
+
+# The share of visits generated in each state. Past visits are spread over
+# the requested number of years, future visits over the next few weeks.
+PAST_COMPLETED = "past_completed"
+PAST_SCHEDULED = "past_scheduled"
+PAST_UNSCHEDULED = "past_unscheduled"
+PAST_CANCELLED = "past_cancelled"
+UPCOMING_UNSCHEDULED = "upcoming_unscheduled"
+UPCOMING_SCHEDULED = "upcoming_scheduled"
+UPCOMING_CANCELLED = "upcoming_cancelled"
+STATES = {
+    PAST_COMPLETED: 45,
+    PAST_SCHEDULED: 5,
+    PAST_UNSCHEDULED: 5,
+    PAST_CANCELLED: 10,
+    UPCOMING_UNSCHEDULED: 15,
+    UPCOMING_SCHEDULED: 12,
+    UPCOMING_CANCELLED: 8,
+}
+UPCOMING_DAYS = 60
+
+
+@contextmanager
+def _historical_timestamps(model):
+    """Allows auto_now and auto_now_add fields of the model to be set
+    explicitly for the duration.
+    """
+    fields = [f for f in model._meta.fields if getattr(f, "auto_now", False) or getattr(f, "auto_now_add", False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+def _created_since(model, last_id):
+    return model.objects.filter(pk__gt=last_id).order_by("pk")
+
+
+def _last_id(model):
+    return model.objects.aggregate(last=Max("pk"))["last"] or 0
+
+
+def seed_accounts(count, rng, batch_size):
+    """Creates count user accounts, each with a Member and a Pal. All share
+    the password "swordfish". Returns the list of (member_id, pal_id,
+    account_id).
+    """
+    password = make_password("swordfish")
+    batch = uuid.uuid4().hex[:8]
+    last_user = _last_id(User)
+
+    User.objects.bulk_create(
+        (
+            User(
+                username=f"seed-{batch}-{i}@example.com",
+                email=f"seed-{batch}-{i}@example.com",
+                first_name=f"Seed{i}",
+                last_name=batch,
+                password=password,
+            )
+            for i in range(count)
+        ),
+        batch_size=batch_size,
+    )
+
+    account_ids = list(_created_since(User, last_user).values_list("pk", flat=True))
+    last_member = _last_id(Member)
+    last_pal = _last_id(Pal)
+
+    Member.objects.bulk_create((Member(account_id=a, plan_minutes=rng.choice(PLANS)) for a in account_ids), batch_size=batch_size)
+    Pal.objects.bulk_create((Pal(account_id=a) for a in account_ids), batch_size=batch_size)
+
+    return list(zip(
+        _created_since(Member, last_member).values_list("pk", flat=True),
+        _created_since(Pal, last_pal).values_list("pk", flat=True),
+        account_ids,
+    ))
+
+
+def _visit(rng, accounts, state, now, years):
+    member_id, _, account_id = rng.choice(accounts)
+    minutes = rng.choice(LENGTHS)
+
+    if state.startswith("past"):
+        when = now - timedelta(minutes=minutes) - timedelta(seconds=rng.randrange(3600, int(years * 365 * 86400)))
+    else:
+        when = now + timedelta(seconds=rng.randrange(3600, UPCOMING_DAYS * 86400))
+
+    # Whole minutes, like visits booked through the forms
+    when = when.replace(second=0, microsecond=0)
+
+    status = {
+        PAST_COMPLETED: Visit.COMPLETED,
+        PAST_SCHEDULED: Visit.SCHEDULED,
+        UPCOMING_SCHEDULED: Visit.SCHEDULED,
+        PAST_CANCELLED: Visit.CANCELLED,
+        UPCOMING_CANCELLED: Visit.CANCELLED,
+    }.get(state, Visit.UNSCHEDULED)
+
+    visit = Visit(member_id=member_id, when=when, minutes=minutes, tasks=rng.choice(TASKS), status=status, cancelled=status == Visit.CANCELLED)
+
+    # A pal other than the member
+    pal = None
+
+    if status in (Visit.SCHEDULED, Visit.COMPLETED):
+        pal = rng.choice(accounts)
+        while pal[2] == account_id and len(accounts) > 1:
+            pal = rng.choice(accounts)
+
+    # Booked up to a month before the visit, but not in the future
+    booked = min(now, when - timedelta(seconds=rng.randrange(3600, 30 * 86400)))
+
+    return visit, account_id, pal, booked
+
+
+@transaction.atomic
+def _seed_visit_batch(rng, accounts, states, count, now, years):
+    last_visit = _last_id(Visit)
+    batch = [_visit(rng, accounts, rng.choices(states[0], states[1])[0], now, years) for _ in range(count)]
+
+    Visit.objects.bulk_create([visit for visit, _, _, _ in batch])
+
+    fulfillments = []
+    entries = []
+
+    # Visits are selected back out in the order they were inserted, since
+    # not every backend returns primary keys from a bulk insert
+    for visit_id, (visit, account_id, pal, booked) in zip(_created_since(Visit, last_visit).values_list("pk", flat=True), batch):
+        entries.append(MinuteLedger(
+            account_id=account_id,
+            visit_id=visit_id,
+            reason=MinuteLedger.VISIT_SCHEDULED,
+            amount=-visit.minutes,
+            cancelled=visit.cancelled,
+            created=booked,
+            modified=booked,
+        ))
+
+        if pal:
+            fulfillments.append(Fulfillment(visit_id=visit_id, pal_id=pal[1], completed=visit.status == Visit.COMPLETED))
+
+        if visit.status == Visit.COMPLETED:
+            finished = visit.when + timedelta(minutes=visit.minutes)
+            entries.append(MinuteLedger(
+                account_id=pal[2],
+                visit_id=visit_id,
+                reason=MinuteLedger.VISIT_FULFILLED,
+                amount=int(FULFILLMENT_PAL_CUT * visit.minutes),
+                created=finished,
+                modified=finished,
+            ))
+
+    Fulfillment.objects.bulk_create(fulfillments)
+
+    with _historical_timestamps(MinuteLedger):
+        MinuteLedger.objects.bulk_create(entries)
+
+    return len(entries)
+
+
+def seed(users, visits, years=3, seed=None, batch_size=5000, progress=None):
+    """Creates users accounts and visits (in the proportions of STATES) with
+    their fulfillments and ledger entries, then rebuilds the rollups of the
+    new accounts. progress, if given, is called with the number of visits
+    created so far after each batch. Returns a dict of the number of rows
+    created.
+    """
+    rng = random.Random(seed)
+    now = utcnow()
+    states = (list(STATES.keys()), list(STATES.values()))
+
+    accounts = seed_accounts(users, rng, batch_size)
+    created = 0
+    entries = 0
+
+    while created < visits:
+        count = min(batch_size, visits - created)
+        entries += _seed_visit_batch(rng, accounts, states, count, now, years)
+        created += count
+
+        if progress:
+            progress(created)
+
+    account_ids = [account_id for _, _, account_id in accounts]
+    rollups = sum(ledger.rebuild(account_ids[i:i + 500]) for i in range(0, len(account_ids), 500))
+    changes.touch(changes.MARKETPLACE)
+
+    return {"users": len(accounts), "visits": created, "ledger": entries, "rollups": rollups}
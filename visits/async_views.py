@@ -0,0 +1,198 @@
+"""Asynchronous versions of the read-heavy views, served in place of those in
+visits.views when the site runs under ASGI (see ASYNC_VIEWS in the settings).
+While one of these waits on the database, the server's event loop is free to
+serve other connections, so a single process can hold many slow clients.
+
+They share their queries and template contexts with visits.views. Work which
+is not available through the async ORM (balances, the marketplace snapshot and
+form validation) runs in a worker thread via sync_to_async.
+"""
+import asyncio
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect
+
+import visits.app.balances as balances
+import visits.app.changes as changes
+import visits.app.events as events
+import visits.app.pagination as pagination
+from visits.app.util import utcnow
+from .models import Member, Pal
+from .forms import MemberVisitRequestForm, AvailableVisitsFilterForm, LedgerExportForm
+from .api import SSE_RETRY, last_event_id, sse_message
+from .views import member_visits, \
+    active_fulfillments, \
+    available_visits, \
+    list_visits_context, \
+    list_fulfillments_context, \
+    ledger_export_response
+
+
+def _authenticated_user(request):
+    user = request.user
+    return user if user.is_authenticated else None
+
+
+def login_required(view):
+    """Like django.contrib.auth.decorators.login_required, for async views.
+    The user is loaded from the session in a worker thread, after which
+    request.user may be used freely.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if await sync_to_async(_authenticated_user)(request) is None:
+            return redirect_to_login(request.get_full_path())
+
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@login_required
+async def request_visit(request):
+    """See visits.views.request_visit.
+    """
+    member = await Member.objects.aget(account_id=request.user.pk)
+    form = MemberVisitRequestForm(request.user)
+
+    # The template reads user.member, which would otherwise be queried from
+    # the event loop
+    request.user.member = member
+
+    if request.method == "POST":
+        form = MemberVisitRequestForm(request.user, request.POST)
+        if await sync_to_async(lambda: form.is_valid() and form.save())():
+            return redirect("list-visits")
+
+    plan_minutes_remaining, minutes_available = await sync_to_async(balances.current)(member)
+
+    return render(request, "request-visit.html", {
+        "form": form,
+        "plan_minutes_remaining": plan_minutes_remaining,
+        "minutes_available": minutes_available,
+    })
+
+
+@login_required
+async def list_visits(request):
+    """See visits.views.list_visits.
+    """
+    member = await Member.objects.aget(account_id=request.user.pk)
+    query = member_visits(member)
+    now = utcnow()
+
+    upcoming = await pagination.apaginate(query.filter(when__gte=now), request.GET.get("upcoming"))
+    past = None
+
+    if "past" in request.GET:
+        past = await pagination.apaginate(query.filter(when__lt=now), request.GET.get("past"), descending=True)
+
+    return render(request, "list-visits.html", list_visits_context(upcoming, past))
+
+
+@login_required
+async def list_fulfillments(request):
+    """See visits.views.list_fulfillments.
+    """
+    member = await Member.objects.aget(account_id=request.user.pk)
+    pal = await Pal.objects.aget(account_id=request.user.pk)
+
+    fulfillments = [f async for f in active_fulfillments(pal)]
+    filters = AvailableVisitsFilterForm(request.GET)
+    available = await sync_to_async(available_visits)(member, filters, request.GET.get("after"))
+    last_event = await sync_to_async(events.latest)()
+
+    return render(request, "list-fulfillments.html", list_fulfillments_context(request, fulfillments, filters, available, last_event))
+
+
+# How often each open stream checks for changes, how often it sends a comment
+# to keep idle connections open, and how long it stays open before the client
+# is asked to reconnect, in seconds
+EVENTS_POLL_INTERVAL = 1
+EVENTS_KEEPALIVE = 15
+EVENTS_STREAM_DURATION = 300
+
+
+async def _follow(member, last_id):
+    """Yields server-sent events as they are added to the feed. The feed is
+    only queried when the marketplace's change marker has moved, so an idle
+    stream costs one cache read per EVENTS_POLL_INTERVAL.
+    """
+    yield f"retry: {SSE_RETRY}\n\nid: {last_id}\n\n"
+
+    started = sent = time.monotonic()
+    marker = None
+
+    while time.monotonic() - started < EVENTS_STREAM_DURATION:
+        current = await sync_to_async(changes.marker)(changes.MARKETPLACE)
+
+        if current != marker:
+            batch = [event async for event in events.following(member, last_id)]
+
+            # Read the next batch straight away if this one was full
+            marker = current if len(batch) < events.BATCH_SIZE else None
+
+            for event in batch:
+                last_id = event.id
+                sent = time.monotonic()
+                yield sse_message(event)
+
+        if time.monotonic() - sent >= EVENTS_KEEPALIVE:
+            sent = time.monotonic()
+            yield ": keepalive\n\n"
+
+        await asyncio.sleep(EVENTS_POLL_INTERVAL)
+
+
+async def available_events(request):
+    """See visits.api.available_events. Keeps the stream open for up to
+    EVENTS_STREAM_DURATION, sending each event as it happens.
+    """
+    if await sync_to_async(_authenticated_user)(request) is None:
+        return JsonResponse({"errors": {"__all__": ["Authentication required."]}}, status=401)
+
+    if request.method != "GET":
+        return JsonResponse({"errors": {"__all__": ["Method not allowed."]}}, status=405, headers={"Allow": "GET"})
+
+    member = await Member.objects.aget(account_id=request.user.pk)
+    last_id = last_event_id(request)
+
+    if last_id is None:
+        last_id = await sync_to_async(events.latest)()
+
+    return StreamingHttpResponse(_follow(member, last_id), content_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def _staff_user(request):
+    user = request.user
+    return user if user.is_active and user.is_staff else None
+
+
+async def _chunks(iterator):
+    # Under ASGI, Django buffers the whole of a sync iterator before sending
+    # any of it, so each chunk is read in a worker thread instead
+    # (StopIteration cannot pass through sync_to_async, hence the default)
+    read = sync_to_async(next)
+
+    while (chunk := await read(iterator, None)) is not None:
+        yield chunk
+
+
+async def export_ledger(request):
+    """See visits.views.export_ledger. Streams the export without buffering
+    it.
+    """
+    if await sync_to_async(_staff_user)(request) is None:
+        return redirect_to_login(request.get_full_path(), "admin:login", REDIRECT_FIELD_NAME)
+
+    form = LedgerExportForm(request.GET)
+
+    if not await sync_to_async(form.is_valid)():
+        return HttpResponseBadRequest(form.errors.as_text(), content_type="text/plain")
+
+    return ledger_export_response(form, _chunks(form.export()))
@@ -1,10 +1,16 @@
+from datetime import datetime, time, timedelta
+
 import django.forms as forms
 
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 
 import visits.app.scheduling as scheduling
 import visits.app.account as account
+import visits.app.exports as exports
+from visits.app.util import UTC
+from visits.models import VisitSeries
 
 
 class UserRegistrationForm(UserCreationForm):
@@ -55,18 +61,55 @@ class MemberVisitRequestForm(UserForm):
     when = forms.DateTimeField(required=True, help_text="When would you like one of our Pals to visit you?")
     minutes = forms.IntegerField(required=True, initial=scheduling.DEFAULT_VISIT_LENGTH, min_value=scheduling.MIN_VISIT_LENGTH, help_text="How many minutes would you like to schedule this visit for?")
     tasks = forms.CharField(required=False, widget=forms.Textarea(attrs={'cols': 80, 'rows': 6}), help_text="Please provide some basic details about what kinds of things our Pal should be ready to help with.")
+    repeat = forms.ChoiceField(required=False, choices=[("", "Does not repeat")] + VisitSeries.CADENCES, help_text="Would you like this visit to repeat?")
+    occurrences = forms.IntegerField(required=False, min_value=scheduling.MIN_SERIES_OCCURRENCES, max_value=scheduling.MAX_SERIES_OCCURRENCES, help_text="If the visit repeats, how many visits would you like in total?")
 
     def clean(self):
         """Adds additional validation to ensure that the member has the minutes
-        available for the requested visit.
+        available for the requested visit (or series of visits). This gives
+        early feedback; the check is repeated under lock when the visit is
+        saved.
         """
         data = super().clean()
-        scheduling.validate_new_visit(self.member, data["when"], data["minutes"])
+
+        if "when" not in data or "minutes" not in data:
+            return data
+
+        if data.get("repeat"):
+            if not data.get("occurrences"):
+                raise ValidationError("Please enter the number of visits in the series.")
+
+            scheduling.validate_new_series(self.member, data["when"], data["minutes"], data["repeat"], data["occurrences"])
+        else:
+            scheduling.validate_new_visit(self.member, data["when"], data["minutes"])
+
         return data
 
     def save(self, commit=True):
+        """Books the visit, or series of visits. Returns None and adds the
+        error to the form if the member's balance changed after the form was
+        validated.
+
+        With commit=False, returns the unsaved Visit without checking the
+        balance under lock; saving it is then up to the caller. A series can
+        only be booked as a whole, so raises ValueError if the visit repeats.
+        """
         data = self.cleaned_data
-        return scheduling.create_visit(self.member, data["when"], data["minutes"], data["tasks"], commit)
+
+        if not commit:
+            if data.get("repeat"):
+                raise ValueError("A series of visits cannot be saved with commit=False.")
+
+            return scheduling.create_visit(self.member, data["when"], data["minutes"], data["tasks"], commit)
+
+        try:
+            if data.get("repeat"):
+                return scheduling.book_series(self.member, data["when"], data["minutes"], data["tasks"], data["repeat"], data["occurrences"])
+
+            return scheduling.book_visit(self.member, data["when"], data["minutes"], data["tasks"])
+        except ValidationError as e:
+            self.add_error(None, e)
+            return None
 
 
 class CancelRequestedVisitForm(UserForm):
@@ -85,6 +128,56 @@ class CancelRequestedVisitForm(UserForm):
         scheduling.cancel_visit(self.cleaned_data["visit"], commit)
 
 
+class CancelVisitSeriesForm(UserForm):
+    """Cancels the upcoming visits in a series after validating that it is
+    possible to do so.
+    """
+    series_id = forms.IntegerField(required=True, widget=forms.HiddenInput)
+
+    def clean(self):
+        cleaned_data = super().clean()
+
+        if "series_id" not in cleaned_data:
+            return cleaned_data
+
+        cleaned_data["series"] = scheduling.validate_member_series_cancellation(self.member, cleaned_data["series_id"])
+        return cleaned_data
+
+    def save(self, commit=True):
+        """Cancels the series' upcoming visits as a unit, so raises ValueError
+        with commit=False.
+        """
+        if not commit:
+            raise ValueError("A series of visits cannot be cancelled with commit=False.")
+
+        return scheduling.cancel_series(self.cleaned_data["series"])
+
+
+class AvailableVisitsFilterForm(forms.Form):
+    """Filters for the list of available visits shown to Pals. All fields are
+    optional. See VisitQuerySet.matching.
+    """
+    WEEKDAYS = [(1, "Mon"), (2, "Tue"), (3, "Wed"), (4, "Thu"), (5, "Fri"), (6, "Sat"), (7, "Sun")]
+
+    start = forms.DateField(required=False, label="From", help_text="YYYY-MM-DD")
+    end = forms.DateField(required=False, label="Until", help_text="YYYY-MM-DD")
+    earliest = forms.TimeField(required=False, label="Starting after", help_text="HH:MM")
+    latest = forms.TimeField(required=False, label="Starting before", help_text="HH:MM")
+    weekdays = forms.TypedMultipleChoiceField(required=False, coerce=int, choices=WEEKDAYS, widget=forms.CheckboxSelectMultiple, label="Days")
+    min_minutes = forms.IntegerField(required=False, min_value=0, label="At least (minutes)")
+    max_minutes = forms.IntegerField(required=False, min_value=0, label="At most (minutes)")
+
+    def filter(self, query):
+        """Applies the form's filters to the supplied Visit queryset.
+        """
+        return query.matching(**self.cleaned_data)
+
+    def is_filtered(self):
+        """Returns True if any of the filters have been set.
+        """
+        return any(value not in (None, "", []) for value in self.cleaned_data.values())
+
+
 class AcceptVisitForm(UserForm):
     """Assigns a Visit to a Pal by creating a Fulfillment for that visit.
     """
@@ -96,7 +189,7 @@ class AcceptVisitForm(UserForm):
         return cleaned_data
 
     def save(self, commit=True):
-        scheduling.create_fulfillment(self.pal, self.cleaned_data["visit"], commit)
+        return scheduling.create_fulfillment(self.pal, self.cleaned_data["visit"], commit)
 
 
 class CompleteFulfillmentForm(UserForm):
@@ -106,11 +199,11 @@ class CompleteFulfillmentForm(UserForm):
 
     def clean(self):
         cleaned_data = super().clean()
-        cleaned_data["fulfillment"] = scheduling.validate_fulfillment_completion(cleaned_data["fulfillment_id"])
+        cleaned_data["fulfillment"] = scheduling.validate_fulfillment_completion(self.pal, cleaned_data["fulfillment_id"])
         return cleaned_data
 
     def save(self, commit=True):
-        scheduling.complete_fulfillment(self.cleaned_data["fulfillment"], commit)
+        return scheduling.complete_fulfillment(self.cleaned_data["fulfillment"], commit)
 
 
 class CancelFulfillmentForm(UserForm):
@@ -121,8 +214,73 @@ class CancelFulfillmentForm(UserForm):
 
     def clean(self):
         cleaned_data = super().clean()
-        cleaned_data["fulfillment"] = scheduling.validate_fulfillment_cancellation(cleaned_data["fulfillment_id"])
+        cleaned_data["fulfillment"] = scheduling.validate_fulfillment_cancellation(self.pal, cleaned_data["fulfillment_id"])
         return cleaned_data
 
     def save(self, commit=True):
-        scheduling.cancel_fulfillment(self.cleaned_data["fulfillment"])
+        return scheduling.cancel_fulfillment(self.cleaned_data["fulfillment"], commit)
+
+
+class LedgerExportForm(forms.Form):
+    """Selects the format and the MinuteLedger entries of an export (see
+    visits.app.exports): those created in a month, between two dates, or
+    (with neither) ever.
+    """
+    format = forms.ChoiceField(required=False, choices=[(f, f) for f in exports.FORMATS])
+    month = forms.RegexField(required=False, regex=r"^\d{4}-\d{2}$", help_text="YYYY-MM")
+    start = forms.DateField(required=False, help_text="YYYY-MM-DD")
+    end = forms.DateField(required=False, help_text="YYYY-MM-DD, inclusive")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        month = cleaned_data.get("month")
+
+        if month and (cleaned_data.get("start") or cleaned_data.get("end")):
+            raise ValidationError("Select either a month or a range of dates, not both.")
+
+        if month:
+            year, month = map(int, month.split("-"))
+
+            if not 1 <= month <= 12:
+                raise ValidationError("Invalid month.")
+
+            # Years 0 and 9999 fall outside the dates datetime can represent
+            try:
+                cleaned_data["range"] = exports.month_range(month, year)
+            except ValueError:
+                raise ValidationError("Invalid month.")
+        else:
+            start = cleaned_data.get("start")
+            end = cleaned_data.get("end")
+
+            try:
+                cleaned_data["range"] = (
+                    datetime.combine(start, time(), UTC) if start else None,
+                    datetime.combine(end + timedelta(days=1), time(), UTC) if end else None,
+                )
+            except OverflowError:
+                raise ValidationError("Invalid end date.")
+
+        cleaned_data["format"] = cleaned_data.get("format") or "csv"
+        return cleaned_data
+
+    def filename(self):
+        """Returns the name to download the export as.
+        """
+        data = self.cleaned_data
+        start, end = data["start"], data["end"]
+
+        if data["month"]:
+            name = data["month"]
+        elif start or end:
+            name = f"{start or ''}_{end or ''}"
+        else:
+            name = "all"
+
+        return f"ledger-{name}.{data['format']}"
+
+    def export(self, chunk_size=exports.CHUNK_SIZE):
+        """Returns the iterator of strings making up the export.
+        """
+        start, end = self.cleaned_data["range"]
+        return exports.export(self.cleaned_data["format"], start, end, chunk_size)
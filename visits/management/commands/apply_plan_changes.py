@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+import visits.app.plans as plans
+
+
+class Command(BaseCommand):
+    help = "Applies the plan changes which have taken effect. Run at the start of each month (e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=plans.CHUNK_SIZE, help="Number of changes to apply per transaction.")
+
+    def handle(self, *args, **options):
+        count = plans.apply_due(options["chunk_size"])
+        self.stdout.write(f"Applied {count} plan change(s).")
@@ -0,0 +1,90 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.middleware.csrf import get_token
+from django.template import Template
+from django.template.context import RequestContext
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.urls import reverse
+
+from visits.app.util import utcnow
+from visits.forms import CancelRequestedVisitForm
+from visits.models import Visit
+from visits.views import visit_rows
+
+
+# The visits table as it was rendered before list_visits switched to
+# precomputed rows: a Form instance, CSRF token and URL lookup per row.
+FORM_PER_ROW = Template("""
+{% for visit, form in visits %}
+<tr>
+  <td>{{ visit.when }}</td>
+  <td>{{ visit.minutes }}</td>
+  <td>{{ visit.tasks | linebreaksbr }}</td>
+  <td>{{ visit.str_state | capfirst }}</td>
+  <td>
+    {% if not visit.is_completed and not visit.has_started %}
+    <form method="post" action="{% url 'cancel-visit' %}">
+      {% csrf_token %}
+      {{ form }}
+      <button type="submit" class="btn btn-danger">Cancel</button>
+    </form>
+    {% endif %}
+  </td>
+</tr>
+{% endfor %}
+""")
+
+
+class Command(BaseCommand):
+    help = "Times rendering the member's visits table with a Form per row against precomputed rows. Does not touch the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000], help="Numbers of rows to render.")
+        parser.add_argument("--repeat", type=int, default=3, help="Renders per measurement; the fastest is reported.")
+
+    def best_of(self, repeat, render):
+        timings = []
+
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - started)
+
+        return min(timings)
+
+    def handle(self, *args, **options):
+        request = RequestFactory().get(reverse("list-visits"))
+        request.user = AnonymousUser()
+        get_token(request)
+
+        when = utcnow() + timedelta(days=1)
+
+        self.stdout.write(f"{'rows':>8} {'form per row':>14} {'shared form':>14} {'speedup':>8}")
+
+        for count in options["rows"]:
+            visits = []
+
+            for i in range(count):
+                visit = Visit(id=i + 1, member_id=1, when=when + timedelta(hours=i), minutes=30, tasks="do things\nand stuff")
+                visit.active_fulfillments = []
+                visits.append(visit)
+
+            def form_per_row():
+                forms = [(v, CancelRequestedVisitForm(request.user, initial={"visit_id": v.id})) for v in visits]
+                FORM_PER_ROW.render(RequestContext(request, {"visits": forms}))
+
+            def shared_form():
+                render_to_string("visits-table.html", {
+                    "visits": visit_rows(visits),
+                    "cancel_visit_url": reverse("cancel-visit"),
+                    "cancel_series_url": reverse("cancel-series"),
+                }, request)
+
+            before = self.best_of(options["repeat"], form_per_row)
+            after = self.best_of(options["repeat"], shared_form)
+
+            self.stdout.write(f"{count:>8} {before * 1000:>12.1f}ms {after * 1000:>12.1f}ms {before / after:>7.1f}x")
@@ -0,0 +1,284 @@
+import json
+import sys
+import time
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment
+from django.urls import reverse
+
+import visits.app.scheduling as scheduling
+import visits.app.seed as seed
+import visits.urls
+from visits.app.util import utcnow
+from visits.models import Member, Visit, VisitSeries
+
+
+class QueryTimer:
+    """A database execute wrapper counting and timing the queries made while
+    it is installed.
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def _read(response):
+    """Reads the whole of a streamed response, which the async views stream
+    from an async iterator.
+    """
+    if not response.is_async:
+        return b"".join(response.streaming_content)
+
+    async def read():
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    return async_to_sync(read)()
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+class Workloads:
+    """The requests made against each URL, for a member (who is also a pal)
+    with plenty of minutes, or for a staff user for the URLs in staff_only.
+    Each method returns a list of (method, path, data) for the requested
+    number of iterations, creating whatever the requests act upon beforehand
+    so that it is not included in the timings.
+    """
+    staff_only = {"ledger-export", "monthly-reports"}
+
+    # Downloads whose streamed body is read in full (unlike the event streams,
+    # which never end)
+    read_streamed = {"ledger-export"}
+
+    def __init__(self, member):
+        self.member = member
+        self.user = member.account
+        self.pal = self.user.pal
+
+    def future(self, i=0):
+        return (utcnow() + timedelta(days=30, minutes=i)).replace(second=0, microsecond=0).isoformat()
+
+    def upcoming_visits(self, n):
+        return [scheduling.create_visit(self.member, utcnow() + timedelta(days=20, minutes=i), 30, "benchmark") for i in range(n)]
+
+    def available_visits(self, n):
+        return list(Visit.objects.unscheduled().exclude(member=self.member).order_by("?")[:n])
+
+    def scheduled_fulfillments(self, n):
+        return [scheduling.create_fulfillment(self.pal, v) for v in self.available_visits(n)]
+
+    def finished_fulfillments(self, n):
+        visits = Visit.objects.filter(status=Visit.UNSCHEDULED, when__lt=utcnow() - timedelta(hours=3)).exclude(member=self.member)
+        return [scheduling.create_fulfillment(self.pal, v) for v in visits.order_by("?")[:n]]
+
+    def get(self, name, n, params=None):
+        return [("get", reverse(name), params or {})] * n
+
+    # HTML views
+    def index(self, n):
+        return self.get("index", n)
+
+    def register(self, n):
+        # Only the form; registering is dominated by password hashing
+        return self.get("register", n)
+
+    def request_visit(self, n):
+        return self.get("request-visit", n) + [
+            ("post", reverse("request-visit"), {"when": self.future(i), "minutes": 30, "tasks": "benchmark"}) for i in range(n)
+        ]
+
+    def list_visits(self, n):
+        return self.get("list-visits", n) + self.get("list-visits", n, {"past": ""})
+
+    def cancel_visit(self, n):
+        return [("post", reverse("cancel-visit"), {"visit_id": v.id}) for v in self.upcoming_visits(n)]
+
+    def cancel_series(self, n):
+        series = [scheduling.create_series(self.member, utcnow() + timedelta(days=10, minutes=i), 30, "benchmark", VisitSeries.WEEKLY, 4) for i in range(n)]
+        return [("post", reverse("cancel-series"), {"series_id": s.id}) for s in series]
+
+    def list_fulfillments(self, n):
+        return self.get("list-fulfillments", n) + self.get("list-fulfillments", n, {"min_minutes": 60, "weekdays": [1, 3, 5]})
+
+    def schedule_fulfillment(self, n):
+        return [("post", reverse("schedule-fulfillment"), {"visit_id": v.id}) for v in self.available_visits(n)]
+
+    def complete_fulfillment(self, n):
+        return [("post", reverse("complete-fulfillment"), {"fulfillment_id": f.id}) for f in self.finished_fulfillments(n)]
+
+    def cancel_fulfillment(self, n):
+        return [("post", reverse("cancel-fulfillment"), {"fulfillment_id": f.id}) for f in self.scheduled_fulfillments(n)]
+
+    # Staff views
+    def ledger_export(self, n):
+        month = utcnow().strftime("%Y-%m")
+        return self.get("ledger-export", n, {"month": month}) + self.get("ledger-export", n, {"format": "jsonl"})
+
+    def monthly_reports(self, n):
+        return self.get("monthly-reports", n)
+
+    # JSON API
+    def api_balance(self, n):
+        return self.get("api-balance", n)
+
+    def api_visits(self, n):
+        return self.get("api-visits", n) + [
+            ("json", reverse("api-visits"), {"when": self.future(n + i), "minutes": 30, "tasks": "benchmark"}) for i in range(n)
+        ]
+
+    def api_cancel_visit(self, n):
+        return [("post", reverse("api-cancel-visit", args=[v.id]), {}) for v in self.upcoming_visits(n)]
+
+    def api_available(self, n):
+        return self.get("api-available", n)
+
+    def api_available_events(self, n):
+        return self.get("api-available-events", n, {"after": 0})
+
+    def api_accept_visit(self, n):
+        return [("post", reverse("api-accept-visit", args=[v.id]), {}) for v in self.available_visits(n)]
+
+    def api_fulfillments(self, n):
+        return self.get("api-fulfillments", n)
+
+    def api_complete_fulfillment(self, n):
+        return [("post", reverse("api-complete-fulfillment", args=[f.id]), {}) for f in self.finished_fulfillments(n)]
+
+    def api_cancel_fulfillment(self, n):
+        return [("post", reverse("api-cancel-fulfillment", args=[f.id]), {}) for f in self.scheduled_fulfillments(n)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database at each of several scales and times the requests to every URL in "
+        "visits/urls.py, recording p50/p95 latency, SQL query counts and SQL time as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000], help="Numbers of visits to seed.")
+        parser.add_argument("--visits-per-user", type=int, default=100, help="Number of visits seeded per user account.")
+        parser.add_argument("--iterations", type=int, default=20, help="Number of requests per URL and method.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the seeded data.")
+        parser.add_argument("--output", help="Write the results to this file instead of stdout.")
+
+    def log(self, message):
+        sys.stderr.write(message + "\n")
+
+    def handle(self, *args, **options):
+        settings.DEBUG = False
+        setup_test_environment(debug=False)
+
+        runner = DiscoverRunner(verbosity=0)
+        databases = runner.setup_databases()
+        results = []
+
+        try:
+            seeded = 0
+
+            for scale in sorted(options["scales"]):
+                self.log(f"Seeding {scale - seeded} visit(s)...")
+                users = max(2, (scale - seeded) // options["visits_per_user"])
+                counts = seed.seed(users, scale - seeded, seed=options["seed"] + scale)
+                seeded = scale
+
+                results.append({
+                    "visits": Visit.objects.count(),
+                    "seeded": counts,
+                    "urls": self.run(options["iterations"]),
+                })
+        finally:
+            runner.teardown_databases(databases)
+
+        output = json.dumps({"iterations": options["iterations"], "scales": results}, indent=2)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    def run(self, iterations):
+        # The busiest member, given enough minutes to keep booking
+        member = Member.objects.annotate(visits=Count("visit")).order_by("-visits").first()
+        Member.objects.filter(pk=member.pk).update(plan_minutes=10 ** 7)
+        member.refresh_from_db()
+
+        client = Client()
+        client.force_login(member.account)
+        staff, _ = User.objects.get_or_create(username="benchmark-staff", defaults={"is_staff": True})
+        staff_client = Client()
+        staff_client.force_login(staff)
+        workloads = Workloads(member)
+        results = {}
+
+        for pattern in visits.urls.urlpatterns:
+            workload = getattr(workloads, pattern.name.replace("-", "_"), None)
+
+            if workload is None:
+                results[pattern.name] = {"skipped": "no workload defined"}
+                continue
+
+            self.log(f"Benchmarking {pattern.name}...")
+            requester = staff_client if pattern.name in workloads.staff_only else client
+            read = pattern.name in workloads.read_streamed
+            timings = {}
+
+            for method, path, data in workload(iterations):
+                queries = QueryTimer()
+
+                with connection.execute_wrapper(queries):
+                    started = time.perf_counter()
+
+                    if method == "json":
+                        response = requester.post(path, data, content_type="application/json")
+                        method = "post"
+                    else:
+                        response = getattr(requester, method)(path, data)
+
+                    if read:
+                        # Streamed content is only queried for as it is read
+                        _read(response)
+
+                    elapsed = time.perf_counter() - started
+
+                timing = timings.setdefault(method.upper(), {"latency": [], "queries": [], "sql": [], "statuses": set()})
+                timing["latency"].append(elapsed)
+                timing["queries"].append(queries.count)
+                timing["sql"].append(queries.seconds)
+                timing["statuses"].add(response.status_code)
+
+            results[pattern.name] = {
+                method: {
+                    "requests": len(t["latency"]),
+                    "p50_ms": round(_percentile(t["latency"], 0.5) * 1000, 2),
+                    "p95_ms": round(_percentile(t["latency"], 0.95) * 1000, 2),
+                    "queries_p50": _percentile(t["queries"], 0.5),
+                    "queries_max": max(t["queries"]),
+                    "sql_p50_ms": round(_percentile(t["sql"], 0.5) * 1000, 2),
+                    "sql_p95_ms": round(_percentile(t["sql"], 0.95) * 1000, 2),
+                    "statuses": sorted(t["statuses"]),
+                }
+                for method, t in timings.items()
+            }
+
+        return results
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment
+
+import visits.app.account as account
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the throughput of concurrent GET requests served by the WSGI (sync views) and ASGI (async views) "
+        "applications. Each mode runs in its own process against a throwaway test database. Slow clients are "
+        "simulated by taking --latency ms to read each response."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/visits/list-visits", help="Path to request.")
+        parser.add_argument("--requests", type=int, default=500, help="Total number of requests per mode.")
+        parser.add_argument("--concurrency", type=int, default=50, help="Number of clients connected at once.")
+        parser.add_argument("--threads", type=int, default=4, help="Number of WSGI worker threads.")
+        parser.add_argument("--latency", type=int, default=50, help="Milliseconds each client takes to read its response.")
+        parser.add_argument("--visits", type=int, default=25, help="Number of visits to create for the requesting member.")
+        parser.add_argument("--mode", choices=["wsgi", "asgi"], help=(
+            "Run a single mode in this process and print its results as JSON. The ASGI mode also requires "
+            "PAPA_ASYNC_VIEWS=1 in the environment."
+        ))
+
+    def handle(self, *args, **options):
+        if options["mode"]:
+            self.stdout.write(json.dumps(self.run(options)))
+            return
+
+        self.stdout.write(f"{'mode':>6} {'requests':>9} {'seconds':>8} {'req/s':>8} {'errors':>7}")
+
+        for mode in ("wsgi", "asgi"):
+            env = dict(os.environ, PAPA_ASYNC_VIEWS="1" if mode == "asgi" else "0")
+            command = [sys.executable, sys.argv[0], "benchmark_wsgi_asgi", "--mode", mode] + [
+                f"--{name}={options[name]}" for name in ("path", "requests", "concurrency", "threads", "latency", "visits")
+            ]
+
+            result = json.loads(subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout.splitlines()[-1])
+            rate = result["requests"] / result["seconds"]
+            self.stdout.write(f"{mode:>6} {result['requests']:>9} {result['seconds']:>8.2f} {rate:>8.1f} {result['errors']:>7}")
+
+    def run(self, options):
+        settings.DEBUG = False
+        setup_test_environment(debug=False)
+
+        runner = DiscoverRunner(verbosity=0)
+        databases = runner.setup_databases()
+
+        try:
+            user = account.add_new_account("Bench", "Mark", "benchmark@example.com", "swordfish", 10 * options["visits"])
+
+            for i in range(options["visits"]):
+                scheduling.create_visit(user.member, utcnow() + timedelta(days=1, hours=i), 10, "do things")
+
+            client = Client()
+            client.force_login(user)
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+            if options["mode"] == "asgi":
+                return asyncio.run(self.run_asgi(options, cookie))
+
+            return self.run_wsgi(options, cookie)
+        finally:
+            runner.teardown_databases(databases)
+
+    def run_wsgi(self, options, cookie):
+        from django.core.wsgi import get_wsgi_application
+
+        application = get_wsgi_application()
+        latency = options["latency"] / 1000
+        statuses = []
+
+        def get():
+            environ = {
+                "REQUEST_METHOD": "GET",
+                "PATH_INFO": options["path"],
+                "QUERY_STRING": "",
+                "SERVER_NAME": "testserver",
+                "SERVER_PORT": "80",
+                "SERVER_PROTOCOL": "HTTP/1.1",
+                "HTTP_COOKIE": cookie,
+                "wsgi.version": (1, 0),
+                "wsgi.url_scheme": "http",
+                "wsgi.input": BytesIO(),
+                "wsgi.errors": sys.stderr,
+                "wsgi.multithread": True,
+                "wsgi.multiprocess": False,
+                "wsgi.run_once": False,
+            }
+
+            response = application(environ, lambda status, headers: statuses.append(status))
+
+            # The worker thread is held until the slow client has read the
+            # whole response
+            b"".join(response)
+            response.close()
+            time.sleep(latency)
+
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            for future in [pool.submit(get) for _ in range(options["requests"])]:
+                future.result()
+
+        return {
+            "requests": options["requests"],
+            "seconds": time.perf_counter() - started,
+            "errors": sum(1 for status in statuses if not status.startswith("200")),
+        }
+
+    async def run_asgi(self, options, cookie):
+        from django.core.asgi import get_asgi_application
+
+        application = get_asgi_application()
+        latency = options["latency"] / 1000
+        connections = asyncio.Semaphore(options["concurrency"])
+        statuses = []
+
+        async def get():
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": options["path"],
+                "raw_path": options["path"].encode(),
+                "query_string": b"",
+                "root_path": "",
+                "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+                "server": ("testserver", 80),
+                "client": ("127.0.0.1", 0),
+            }
+            disconnected = asyncio.Event()
+
+            async def receive():
+                if not hasattr(receive, "sent"):
+                    receive.sent = True
+                    return {"type": "http.request", "body": b"", "more_body": False}
+
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append(message["status"])
+                elif not message.get("more_body"):
+                    # Only this connection waits on the slow client
+                    await asyncio.sleep(latency)
+
+            async with connections:
+                await application(scope, receive, send)
+                disconnected.set()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(get() for _ in range(options["requests"])))
+
+        return {
+            "requests": options["requests"],
+            "seconds": time.perf_counter() - started,
+            "errors": sum(1 for status in statuses if status != 200),
+        }
@@ -0,0 +1,28 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+import visits.app.scheduling as scheduling
+
+
+class Command(BaseCommand):
+    help = "Completes every active fulfillment whose visit is over, crediting the pals' ledgers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace", type=int, default=0, help="Only complete visits which ended at least this many minutes ago.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Number of fulfillments to complete per transaction.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        total = 0
+
+        for count in scheduling.complete_finished_fulfillments(timedelta(minutes=options["grace"]), options["batch_size"]):
+            total += count
+
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Completed {count} fulfillment(s) in batch.")
+
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(f"Completed {total} fulfillment(s) in {elapsed:.2f}s ({rate:.1f}/s).")
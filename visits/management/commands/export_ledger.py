@@ -0,0 +1,46 @@
+import time
+from contextlib import ExitStack
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+
+import visits.app.exports as exports
+from visits.forms import LedgerExportForm
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the minute ledger, with each entry's account and visit, as CSV or JSON lines. Selects the entries "
+        "created in --month, or between --start and --end, or otherwise every entry. Entries are read and written a "
+        "chunk at a time, so memory use does not grow with the size of the export."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--month", help="Month to export, as YYYY-MM.")
+        parser.add_argument("--start", help="First day to export, as YYYY-MM-DD.")
+        parser.add_argument("--end", help="Last day to export, as YYYY-MM-DD.")
+        parser.add_argument("--format", choices=list(exports.FORMATS), default="csv", help="File format. Defaults to csv.")
+        parser.add_argument("--output", default="-", help="File to write to, or - (the default) for stdout.")
+        parser.add_argument("--chunk-size", type=int, default=exports.CHUNK_SIZE, help="Number of entries to read per query.")
+
+    def handle(self, *args, **options):
+        form = LedgerExportForm({name: options[name] for name in ("month", "start", "end", "format") if options[name]})
+
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+
+        started = time.monotonic()
+        written = 0
+
+        with ExitStack() as stack:
+            # The summary goes to stderr when the export itself is on stdout
+            if options["output"] == "-":
+                write, summary = partial(self.stdout.write, ending=""), self.stderr
+            else:
+                write, summary = stack.enter_context(open(options["output"], "w", newline="")).write, self.stdout
+
+            for chunk in form.export(options["chunk_size"]):
+                write(chunk)
+                written += len(chunk)
+
+        summary.write(f"Wrote {written} character(s) of {form.filename()} in {time.monotonic() - started:.2f}s.")
@@ -0,0 +1,82 @@
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+import visits.app.account as account
+from visits.management.rows import FORMATS, open_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports members (e.g. those covered by an insurance partner) from a CSV file with a header row, or a JSON "
+        "lines file, with the fields first_name, last_name, email and plan_minutes. Creates a user account with a "
+        "Member and a Pal for each, in chunks of bulk inserts. Rows whose email already has an account are skipped, "
+        "so an interrupted import may simply be run again. By default, the accounts get unusable passwords and links "
+        "inviting their owners to set one are written to --invites; with --passwords, each row must also have a "
+        "password, which is hashed in a pool of --processes processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="File to import, or - for stdin.")
+        parser.add_argument("--format", choices=FORMATS, help="File format. Defaults to jsonl for .jsonl files, otherwise csv.")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Number of rows to import per transaction.")
+        parser.add_argument("--invites", help="CSV file to write each new account's email and invite link to.")
+        parser.add_argument("--base-url", default="", help="Scheme and host to prefix invite links with, e.g. https://papa.example.com.")
+        parser.add_argument("--passwords", action="store_true", help="Set the passwords in the password field instead of inviting.")
+        parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Number of processes hashing passwords.")
+
+    def handle(self, *args, **options):
+        if not options["passwords"] and not options["invites"]:
+            raise CommandError("Either --invites or --passwords is required.")
+
+        with ExitStack() as stack:
+            rows = stack.enter_context(open_rows(options["file"], options["format"]))
+            hash_passwords = None
+            invites = None
+
+            if options["passwords"]:
+                pool = stack.enter_context(ProcessPoolExecutor(max_workers=options["processes"], initializer=django.setup))
+
+                def hash_passwords(passwords):
+                    chunksize = max(1, len(passwords) // (options["processes"] * 4))
+                    return list(pool.map(make_password, passwords, chunksize=chunksize))
+            else:
+                invites = csv.writer(stack.enter_context(open(options["invites"], "w", newline="")))
+                invites.writerow(["email", "invite"])
+
+            self.run(options, rows, hash_passwords, invites)
+
+    def run(self, options, rows, hash_passwords, invites):
+        started = time.monotonic()
+        created = duplicates = invalid = 0
+
+        for chunk in account.import_accounts(rows, options["chunk_size"], hash_passwords):
+            created += len(chunk.created)
+            duplicates += len(chunk.duplicates)
+            invalid += len(chunk.invalid)
+
+            for error in chunk.invalid:
+                self.stderr.write(error)
+
+            if invites:
+                for user in chunk.created:
+                    uidb64, token = account.invite_token(user)
+                    invites.writerow([user.email, options["base_url"] + reverse("password_reset_confirm", args=[uidb64, token])])
+
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Imported {created + duplicates + invalid} row(s).")
+
+        elapsed = time.monotonic() - started
+        total = created + duplicates + invalid
+
+        self.stdout.write(
+            f"Read {total} row(s) in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} rows/s): "
+            f"created {created} account(s), skipped {duplicates} duplicate(s) and {invalid} invalid row(s)."
+        )
@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+import visits.app.events as events
+
+
+class Command(BaseCommand):
+    help = "Deletes VisitEvents which are older than any connected pal could still need."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24, help="Delete events older than this many hours.")
+
+    def handle(self, *args, **options):
+        count = events.prune(timedelta(hours=options["hours"]))
+        self.stdout.write(f"Deleted {count} event(s).")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+import visits.app.ledger as ledger
+
+
+class Command(BaseCommand):
+    help = "Recomputes the monthly MinuteRollups from the raw MinuteLedger."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--account", type=int, action="append", dest="accounts", help="Limit the rebuild to this user account id (may be repeated).")
+
+    def handle(self, *args, **options):
+        count = ledger.rebuild(options["accounts"])
+        self.stdout.write(f"Rebuilt {count} rollup(s).")
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+import visits.app.seed as seed
+
+
+class Command(BaseCommand):
+    help = "Bulk creates user accounts and visits in every state, with fulfillments and years of ledger history, for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Number of user accounts (each is both a member and a pal).")
+        parser.add_argument("--visits", type=int, default=100000, help="Number of visits.")
+        parser.add_argument("--years", type=float, default=3, help="Years of history to spread past visits over.")
+        parser.add_argument("--seed", type=int, help="Random seed, for repeatable data.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Number of visits to create per transaction.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        def progress(count):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Created {count} visit(s).")
+
+        counts = seed.seed(options["users"], options["visits"], options["years"], options["seed"], options["batch_size"], progress)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Created {counts['users']} user(s), {counts['visits']} visit(s), {counts['ledger']} ledger entries "
+            f"and {counts['rollups']} rollup(s) in {elapsed:.2f}s."
+        )
@@ -0,0 +1,52 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+import visits.app.plans as plans
+from visits.management.rows import FORMATS, open_rows
+
+
+def month(value):
+    try:
+        return date.fromisoformat(f"{value}-01")
+    except ValueError:
+        raise CommandError(f"{value!r} is not a month in the form YYYY-MM.")
+
+
+class Command(BaseCommand):
+    help = (
+        "Changes members' monthly plan minutes, e.g. after an insurer changes its coverage, from a CSV file with a "
+        "header row, or a JSON lines file, with the fields email and plan_minutes. Changes effective this month or "
+        "earlier are applied immediately; later changes are applied by apply_plan_changes once their month arrives."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="File of plan changes, or - for stdin.")
+        parser.add_argument("--effective", type=month, default=plans.current_month(), help="Month the changes take effect, as YYYY-MM. Defaults to this month.")
+        parser.add_argument("--format", choices=FORMATS, help="File format. Defaults to jsonl for .jsonl files, otherwise csv.")
+        parser.add_argument("--chunk-size", type=int, default=plans.CHUNK_SIZE, help="Number of rows to update per transaction.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        changed = unknown = invalid = 0
+
+        with open_rows(options["file"], options["format"]) as rows:
+            for chunk in plans.change(rows, options["effective"], options["chunk_size"]):
+                changed += chunk.changed
+                unknown += len(chunk.unknown)
+                invalid += len(chunk.invalid)
+
+                for email in chunk.unknown:
+                    self.stderr.write(f"No member with the email {email}.")
+
+                for error in chunk.invalid:
+                    self.stderr.write(error)
+
+        elapsed = time.monotonic() - started
+        verb = "Changed" if options["effective"] <= plans.current_month() else "Scheduled changes to"
+
+        self.stdout.write(
+            f"{verb} the plans of {changed} member(s) from {options['effective']:%Y-%m} in {elapsed:.2f}s; "
+            f"skipped {unknown} unknown email(s) and {invalid} invalid row(s)."
+        )
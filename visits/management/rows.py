@@ -0,0 +1,43 @@
+"""Reading the rows of the files given to the bulk management commands.
+"""
+import csv
+import json
+import sys
+from contextlib import contextmanager
+
+from django.core.management.base import CommandError
+
+
+FORMATS = ["csv", "jsonl"]
+
+
+def _jsonl(file):
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+
+        try:
+            row = json.loads(text)
+        except ValueError:
+            raise CommandError(f"Line {line}: not valid JSON.")
+
+        if not isinstance(row, dict):
+            raise CommandError(f"Line {line}: not a JSON object.")
+
+        yield row
+
+
+@contextmanager
+def open_rows(path, format=None):
+    """Yields an iterator of dicts read from a CSV file with a header row or a
+    JSON lines file, or from stdin if path is "-". The format defaults to
+    jsonl for .jsonl files, otherwise csv.
+    """
+    format = format or ("jsonl" if path.endswith(".jsonl") else "csv")
+
+    if path == "-":
+        yield _jsonl(sys.stdin) if format == "jsonl" else csv.DictReader(sys.stdin)
+        return
+
+    with open(path, newline="") as file:
+        yield _jsonl(file) if format == "jsonl" else csv.DictReader(file)
@@ -0,0 +1,218 @@
+"""Per-request SQL instrumentation.
+
+When SQL_INSTRUMENTATION is on, QueryInstrumentationMiddleware times every
+query made while serving a request and reports the number of queries, the
+total SQL time, the slowest query and how many queries repeated the shape of
+an earlier one (the signature of an N+1 pattern) in a Server-Timing header.
+Requests exceeding any of the SQL_LOG_* thresholds are logged as warnings
+along with the queries responsible.
+
+Queries are attributed to the innermost function of ATTRIBUTED_MODULES on the
+stack when they run. Querysets are lazy, so one built in visits.models but
+evaluated in a view is only attributed if it is evaluated from one of those
+modules.
+
+When SQL_INSTRUMENTATION is off, the middleware removes itself at startup and
+no execute wrapper is installed, so it costs nothing. The queries run while
+streaming a response's content happen after the middleware returns and are not
+counted.
+"""
+import logging
+import re
+import sys
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+ATTRIBUTED_MODULES = ("visits.app.scheduling", "visits.models")
+
+# The recorder for the request being served. Context variables follow the
+# request into the worker threads of sync_to_async, so queries made there by
+# the async views are recorded too.
+_recorder = ContextVar("sql_recorder", default=None)
+
+
+def fingerprint(sql):
+    """Returns the shape of a query. Django passes parameters separately from
+    the SQL, so only lists of placeholders (e.g. for IN) vary between queries
+    of the same shape, and these are collapsed.
+    """
+    return re.sub(r"%s(?:, %s)+", "%s, ...", sql)
+
+
+def _caller():
+    frame = sys._getframe(2)
+
+    while frame is not None:
+        module = frame.f_globals.get("__name__")
+
+        if module in ATTRIBUTED_MODULES:
+            # co_qualname (which names methods with their class) is Python 3.11+
+            return f"{module}.{getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)}"
+
+        frame = frame.f_back
+
+    return None
+
+
+class QueryRecorder:
+    """Tallies the queries made while serving one request.
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = (0.0, None, None)
+        self.fingerprints = Counter()
+        self.callers = Counter()
+        self.fingerprint_callers = {}
+
+    def record(self, sql, seconds, caller):
+        shape = fingerprint(sql)
+
+        self.count += 1
+        self.seconds += seconds
+        self.fingerprints[shape] += 1
+        self.callers[caller] += 1
+        self.fingerprint_callers.setdefault(shape, Counter())[caller] += 1
+
+        if seconds > self.slowest[0]:
+            self.slowest = (seconds, sql, caller)
+
+    @property
+    def duplicates(self):
+        """The number of queries repeating the shape of an earlier query.
+        """
+        return sum(n - 1 for n in self.fingerprints.values() if n > 1)
+
+    def repeated(self, limit=3):
+        """Returns the most repeated query shapes as (count, sql, callers).
+        """
+        return [
+            (n, shape, dict(self.fingerprint_callers[shape]))
+            for shape, n in self.fingerprints.most_common(limit)
+            if n > 1
+        ]
+
+
+def _execute(execute, sql, params, many, context):
+    recorder = _recorder.get()
+
+    if recorder is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.record(sql, time.perf_counter() - started, _caller())
+
+
+def _install(connection, **kwargs):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+class QueryInstrumentationMiddleware:
+    """Records the SQL queries made by each request. Place it first in
+    MIDDLEWARE so that the queries of the other middleware (sessions,
+    authentication) are included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SQL_INSTRUMENTATION:
+            raise MiddlewareNotUsed()
+
+        self.get_response = get_response
+
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+        # Connections are per thread and opened on demand, so the wrapper is
+        # added to each as it connects, as well as to those already open
+        connection_created.connect(_install, dispatch_uid=__name__)
+
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        recorder = QueryRecorder()
+        token = _recorder.set(recorder)
+        started = time.perf_counter()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+
+        self.report(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = _recorder.set(recorder)
+        started = time.perf_counter()
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+
+        self.report(request, response, recorder, time.perf_counter() - started)
+        return response
+
+    def report(self, request, response, recorder, seconds):
+        if settings.SQL_INSTRUMENTATION_HEADERS:
+            timing = ", ".join([
+                f'sql;dur={recorder.seconds * 1000:.2f};desc="{recorder.count} queries"',
+                f'sql-duplicates;desc="{recorder.duplicates} queries"',
+                f"sql-slowest;dur={recorder.slowest[0] * 1000:.2f}",
+                f"total;dur={seconds * 1000:.2f}",
+            ])
+
+            if response.has_header("Server-Timing"):
+                timing = f"{response.headers['Server-Timing']}, {timing}"
+
+            response.headers["Server-Timing"] = timing
+
+        if (
+            recorder.count > settings.SQL_LOG_QUERIES
+            or recorder.seconds * 1000 > settings.SQL_LOG_MS
+            or recorder.duplicates > settings.SQL_LOG_DUPLICATES
+        ):
+            slowest_seconds, slowest_sql, slowest_caller = recorder.slowest
+            repeated = "; ".join(f"{n}x {shape[:200]} (from {callers})" for n, shape, callers in recorder.repeated())
+
+            logger.warning(
+                "Expensive request %s %s: %d queries, %.2fms SQL, %d duplicates. Slowest (%.2fms, from %s): %s. Repeated: %s. Callers: %s",
+                request.method,
+                request.path,
+                recorder.count,
+                recorder.seconds * 1000,
+                recorder.duplicates,
+                slowest_seconds * 1000,
+                slowest_caller,
+                (slowest_sql or "")[:200],
+                repeated or "none",
+                dict(recorder.callers),
+                extra={
+                    "sql_queries": recorder.count,
+                    "sql_ms": recorder.seconds * 1000,
+                    "sql_duplicates": recorder.duplicates,
+                    "sql_callers": dict(recorder.callers),
+                },
+            )
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:16
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import DateField, Q, Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def backfill_rollups(apps, schema_editor):
+    MinuteLedger = apps.get_model('visits', 'MinuteLedger')
+    MinuteRollup = apps.get_model('visits', 'MinuteRollup')
+
+    totals = (
+        MinuteLedger.objects.filter(cancelled=False)
+        .annotate(month=TruncMonth('created', output_field=DateField()))
+        .values('account_id', 'month')
+        .annotate(credits=Sum('amount', filter=Q(amount__gt=0)), debits=Sum('amount', filter=Q(amount__lt=0)))
+        .order_by()
+    )
+
+    MinuteRollup.objects.bulk_create(
+        MinuteRollup(account_id=row['account_id'], month=row['month'], credits=row['credits'] or 0, debits=row['debits'] or 0)
+        for row in totals.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('visits', '0009_auto_20220607_2039'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MinuteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('credits', models.IntegerField(default=0)),
+                ('debits', models.IntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='minuterollup',
+            constraint=models.UniqueConstraint(fields=('account', 'month'), name='unique_rollup_account_month'),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0010_minuterollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='member',
+            name='ledger_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
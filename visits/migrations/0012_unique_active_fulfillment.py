@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:20
+
+from django.db import migrations, models
+
+
+def cancel_duplicate_fulfillments(apps, schema_editor):
+    """Before the constraint existed, two pals could both claim a visit. Keep
+    the completed (or else the earliest) claim and cancel the others.
+    """
+    Fulfillment = apps.get_model('visits', 'Fulfillment')
+
+    seen = set()
+    duplicates = []
+
+    for pk, visit_id in Fulfillment.objects.filter(cancelled=False).order_by('visit_id', '-completed', 'id').values_list('id', 'visit_id').iterator():
+        if visit_id in seen:
+            duplicates.append(pk)
+        seen.add(visit_id)
+
+    Fulfillment.objects.filter(pk__in=duplicates).update(cancelled=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0011_member_ledger_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicate_fulfillments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='fulfillment',
+            constraint=models.UniqueConstraint(condition=models.Q(('cancelled', False)), fields=('visit',), name='unique_active_fulfillment'),
+        ),
+    ]
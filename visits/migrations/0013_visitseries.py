@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0012_unique_active_fulfillment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('cadence', models.CharField(choices=[('weekly', 'Every week'), ('biweekly', 'Every other week')], max_length=20)),
+                ('occurrences', models.PositiveIntegerField()),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='visits.member')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='visit',
+            name='series',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='visits.visitseries'),
+        ),
+    ]
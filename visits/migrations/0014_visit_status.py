@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:23
+
+from django.db import migrations, models
+
+
+def backfill_status(apps, schema_editor):
+    Visit = apps.get_model('visits', 'Visit')
+    Fulfillment = apps.get_model('visits', 'Fulfillment')
+
+    active = Fulfillment.objects.filter(cancelled=False)
+
+    Visit.objects.filter(cancelled=True).update(status='cancelled')
+    Visit.objects.filter(cancelled=False, pk__in=active.filter(completed=True).values('visit_id')).update(status='completed')
+    Visit.objects.filter(cancelled=False, pk__in=active.filter(completed=False).values('visit_id')).update(status='scheduled')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0013_visitseries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='status',
+            field=models.CharField(choices=[('unscheduled', 'Unscheduled'), ('scheduled', 'Scheduled'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], default='unscheduled', max_length=20),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['status', 'when'], name='visit_status_when_idx'),
+        ),
+    ]
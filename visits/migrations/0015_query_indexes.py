@@ -0,0 +1,74 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('visits', '0014_visit_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fulfillment',
+            name='pal',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='visits.pal'),
+        ),
+        migrations.AlterField(
+            model_name='fulfillment',
+            name='visit',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='visits.visit'),
+        ),
+        migrations.AlterField(
+            model_name='minuteledger',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='minuteledger',
+            name='visit',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='visits.visit'),
+        ),
+        migrations.AlterField(
+            model_name='minuterollup',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='visit',
+            name='member',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='visits.member'),
+        ),
+        migrations.AddIndex(
+            model_name='fulfillment',
+            index=models.Index(fields=['visit', 'cancelled'], name='fulfillment_visit_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fulfillment',
+            index=models.Index(fields=['pal', 'completed', 'cancelled'], name='fulfillment_pal_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fulfillment',
+            index=models.Index(condition=models.Q(('cancelled', False), ('completed', False)), fields=['id'], name='fulfillment_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='minuteledger',
+            index=models.Index(fields=['visit', 'cancelled'], name='ledger_visit_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='minuteledger',
+            index=models.Index(fields=['account', 'cancelled', 'created'], name='ledger_account_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(condition=models.Q(('cancelled', False)), fields=['when'], name='visit_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['member', 'cancelled', 'when'], name='visit_member_idx'),
+        ),
+    ]
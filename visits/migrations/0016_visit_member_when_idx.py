@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0015_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['member', 'when'], name='visit_member_when_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='visit',
+            name='visit_member_idx',
+        ),
+    ]
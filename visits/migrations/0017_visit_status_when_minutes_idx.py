@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0016_visit_member_when_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='visit',
+            name='visit_status_when_idx',
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['status', 'when', 'minutes'], name='visit_status_when_idx'),
+        ),
+    ]
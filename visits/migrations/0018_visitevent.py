@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0017_visit_status_when_minutes_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('kind', models.CharField(choices=[('created', 'Visit requested'), ('claimed', 'Visit accepted by a pal'), ('released', 'Visit released by its pal'), ('cancelled', 'Visit cancelled')], max_length=20)),
+                ('visit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='visits.visit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created'], name='visitevent_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0018_visitevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plan_minutes', models.PositiveIntegerField()),
+                ('effective', models.DateField()),
+                ('member', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='visits.member')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['effective'], name='planchange_effective_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='planchange',
+            constraint=models.UniqueConstraint(fields=('member', 'effective'), name='unique_plan_change'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0019_planchange'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='minuteledger',
+            index=models.Index(fields=['created', 'id'], name='ledger_created_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0020_minuteledger_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('computed', models.DateTimeField(auto_now=True)),
+                ('minutes_used', models.IntegerField(default=0)),
+                ('plan_minutes_used', models.IntegerField(default=0)),
+                ('banked_minutes_used', models.IntegerField(default=0)),
+                ('minutes_fulfilled', models.IntegerField(default=0)),
+                ('minutes_earned', models.IntegerField(default=0)),
+                ('platform_minutes', models.IntegerField(default=0)),
+                ('visits', models.IntegerField(default=0)),
+                ('visits_cancelled', models.IntegerField(default=0)),
+                ('fulfillments', models.IntegerField(default=0)),
+                ('fulfillments_cancelled', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='minuteledger',
+            index=models.Index(fields=['reason', 'created'], name='ledger_reason_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='minuterollup',
+            index=models.Index(fields=['month'], name='rollup_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['when', 'status'], name='visit_when_status_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:32
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_plan_minutes(apps, schema_editor):
+    # No earlier plans were recorded, so every month gets the current plan
+    Member = apps.get_model('visits', 'Member')
+    MinuteRollup = apps.get_model('visits', 'MinuteRollup')
+
+    plans = Member.objects.filter(account_id=OuterRef('account_id')).values('plan_minutes')[:1]
+    MinuteRollup.objects.update(plan_minutes=Coalesce(Subquery(plans), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0021_monthlyreport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='minuterollup',
+            name='plan_minutes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_plan_minutes, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,11 @@
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 
 from django.conf import settings
 from django.db import models
-from django.db.models import Sum, Q
-from django.db.models.functions import Now, TruncMonth
+from django.db.models import Case, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce, Greatest, Now
 
-from visits.app.util import utcnow, first_day_of_month, last_day_of_month
+from visits.app.util import UTC, utcnow, first_day_of_month
 
 
 class Pal(models.Model):
@@ -18,6 +18,47 @@ class Pal(models.Model):
         return f'(pal) {self.account.first_name} {self.account.last_name} <{self.account.email}>'
 
 
+class MemberQuerySet(models.QuerySet):
+    def with_minutes_available(self, month, year):
+        """Annotates each member with available_minutes and
+        remaining_plan_minutes for the given month/year (see
+        Member.minutes_available for how those are calculated) in a single
+        query, using correlated subqueries over the members' MinuteRollups.
+        """
+        rollups = MinuteRollup.objects.filter(account=OuterRef("account")).order_by().values("account")
+
+        # Sum up credits
+        credits = rollups.annotate(total=Sum("credits")).values("total")
+
+        # Sum up debits from each month, less the monthly plan minutes, for the
+        # months where the debits exceeded the plan (debits are negative, so
+        # debits + plan_minutes is negative only when the month went over).
+        # Closed months use the plan recorded on their rollup, and the open
+        # month the member's current plan.
+        now = utcnow()
+        plan = Case(
+            When(month__lt=first_day_of_month(now.month, now.year).date(), then=F("plan_minutes")),
+            default=OuterRef("plan_minutes"),
+            output_field=models.IntegerField(),
+        )
+        over = ExpressionWrapper(F("debits") + plan, output_field=models.IntegerField())
+        limit = ExpressionWrapper(plan * -1, output_field=models.IntegerField())
+        overage = rollups.annotate(total=Sum(Case(When(debits__lt=limit, then=over), default=0))).values("total")
+
+        # Debits for the selected month
+        used = rollups.filter(month=first_day_of_month(month, year).date()).values("debits")
+
+        remaining = Greatest(F("plan_minutes") + Coalesce(Subquery(used), 0), 0)
+
+        return self.annotate(
+            remaining_plan_minutes=remaining,
+            available_minutes=ExpressionWrapper(
+                remaining + Coalesce(Subquery(credits), 0) + Coalesce(Subquery(overage), 0),
+                output_field=models.IntegerField(),
+            ),
+        )
+
+
 class Member(models.Model):
     """A member account, associated with a registered user account, is able to
     request visits by pals.
@@ -25,6 +66,14 @@ class Member(models.Model):
     account = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     plan_minutes = models.PositiveIntegerField()
 
+    # Incremented by visits.app.ledger every time the account's ledger is
+    # written, and by visits.app.plans when the plan changes. Because that is
+    # an UPDATE of this row, it also serves as a per-account lock for the
+    # remainder of the transaction.
+    ledger_version = models.PositiveIntegerField(default=0)
+
+    objects = MemberQuerySet.as_manager()
+
     def __str__(self):
         return f'(member) {self.account.first_name} {self.account.last_name} <{self.account.email}>'
 
@@ -32,19 +81,7 @@ class Member(models.Model):
         """Calculates the number of plan minutes remaining for the given
         month/year based on the number of visits scheduled.
         """
-        debits = self.account.minuteledger_set.filter(
-            cancelled=False,
-            amount__lt=0,
-            created__gte=first_day_of_month(month, year),
-            created__lte=last_day_of_month(month, year),
-        ).aggregate(Sum("amount"))
-
-        total = abs(debits["amount__sum"] or 0)
-
-        if self.plan_minutes > total:
-            return self.plan_minutes - total
-
-        return 0
+        return Member.objects.with_minutes_available(month, year).values_list("remaining_plan_minutes", flat=True).get(pk=self.pk)
 
     @property
     def current_plan_minutes_remaining(self):
@@ -59,39 +96,21 @@ class Member(models.Model):
         total.
 
         The member earns banked minutes by fulfilling visits as a pal. Those
-        are simple and can be summed by aggregating all positive entries in
-        their ledger.
+        are simple and can be summed by adding up the credits in each of their
+        monthly MinuteRollups.
 
-        To figure out how many minutes a member has used each month, we first
-        have to collect the aggregate sum of minutes used each month. Any
-        minutes used above the number of monthly plan_minutes represents the
-        total debit to count against the member's banked minutes.
+        To figure out how many minutes a member has used each month, we look
+        at the debits in each month's MinuteRollup. Any minutes used above the
+        number of monthly plan_minutes represents the total debit to count
+        against the member's banked minutes.
 
         Finally, we add in any remaining minutes from the member's plan for the
         selected month.
-        """
-        ledger = self.account.minuteledger_set.filter(cancelled=False)
 
-        # Sum up credits
-        credits = ledger.filter(amount__gt=0).aggregate(Sum("amount"))["amount__sum"] or 0
-
-        # Select debits
-        debits_by_month = ledger.filter(amount__lt=0)
-        # Group by YYYY-MM
-        debits_by_month = debits_by_month.annotate(month=TruncMonth("created")).values("month")
-        # Add up amounts and subtract from plan_minutes (total will be
-        # negative, so total + plan_minutes == plan_minutes - -total)
-        debits_by_month = debits_by_month.annotate(total=Sum("amount") + self.plan_minutes).values("month", "total")
-        # Limit results to those where the total of debits is greater than the
-        # monthly plan minutes
-        debits_by_month = debits_by_month.filter(total__lt=0)
-        # Sum all debits
-        debits = sum(row["total"] for row in debits_by_month)
-
-        # Get the number of minutes remaining in the member's plan
-        plan_minutes = self.plan_minutes_remaining(month, year)
-
-        return  plan_minutes + credits + debits
+        The calculation itself lives in MemberQuerySet.with_minutes_available,
+        so that the same numbers can be annotated onto many members at once.
+        """
+        return Member.objects.with_minutes_available(month, year).values_list("available_minutes", flat=True).get(pk=self.pk)
 
     @property
     def current_minutes_available(self):
@@ -99,46 +118,169 @@ class Member(models.Model):
         return self.minutes_available(now.month, now.year)
 
 
-class VisitManager(models.Manager):
+class VisitQuerySet(models.QuerySet):
     def pending(self):
         """Selects all future visits that have not been cancelled.
         """
         return self.filter(cancelled=False, when__gte=Now())
 
-    def unscheduled(self):
-        """Selects pending visits which have no active, pending fulfillments.
+    def unscheduled(self, since=None):
+        """Selects visits starting from since (by default, the current time)
+        which have no active fulfillments. This is a range scan of the
+        (status, when) index.
+        """
+        return self.filter(status=Visit.UNSCHEDULED, when__gte=since or Now())
+
+    def matching(self, start=None, end=None, earliest=None, latest=None, weekdays=None, min_minutes=None, max_minutes=None):
+        """Filters visits by the date they start (start and end are inclusive
+        dates), the time of day they start (earliest and latest are inclusive
+        times, and wrap around midnight if earliest is later than latest), the
+        day of the week they start (weekdays are ISO weekday numbers, with
+        Monday as 1), and their length (min_minutes and max_minutes are
+        inclusive). Any filter may be omitted.
+
+        When combined with unscheduled, the date range and length are served by
+        the (status, when, minutes) index, and the time of day and weekday
+        are checked against the rows within that range.
+        """
+        query = self
+
+        if start:
+            query = query.filter(when__gte=datetime.combine(start, time.min, UTC))
+
+        if end:
+            query = query.filter(when__lt=datetime.combine(end + timedelta(days=1), time.min, UTC))
+
+        if min_minutes:
+            query = query.filter(minutes__gte=min_minutes)
+
+        if max_minutes:
+            query = query.filter(minutes__lte=max_minutes)
+
+        if earliest and latest and earliest > latest:
+            query = query.filter(Q(when__time__gte=earliest) | Q(when__time__lte=latest))
+        else:
+            if earliest:
+                query = query.filter(when__time__gte=earliest)
+            if latest:
+                query = query.filter(when__time__lte=latest)
+
+        if weekdays:
+            query = query.filter(when__iso_week_day__in=weekdays)
+
+        return query
+
+    def with_active_fulfillment(self):
+        """Prefetches each visit's active fulfillment, if any, so that
+        Visit.fulfillment and the properties derived from it do not need to
+        query for it. Costs one additional query regardless of the number of
+        visits selected.
+        """
+        return self.prefetch_related(models.Prefetch(
+            "fulfillment_set",
+            queryset=Fulfillment.objects.filter(cancelled=False),
+            to_attr="active_fulfillments",
+        ))
+
+
+class VisitSeries(models.Model):
+    """A set of visits requested together by a member, recurring at a fixed
+    interval. The series' visits are linked to it by Visit.series.
+    """
+    WEEKLY = "weekly"
+    BIWEEKLY = "biweekly"
+    CADENCES = [
+        (WEEKLY, "Every week"),
+        (BIWEEKLY, "Every other week"),
+    ]
+    INTERVALS = {
+        WEEKLY: timedelta(weeks=1),
+        BIWEEKLY: timedelta(weeks=2),
+    }
+
+    created = models.DateTimeField(auto_now_add=True)
+    member = models.ForeignKey(Member, on_delete=models.PROTECT)
+    cadence = models.CharField(max_length=20, choices=CADENCES)
+    occurrences = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f'Visit series ({self.get_cadence_display().lower()}, {self.occurrences} visits) {self.member}'
+
+    @staticmethod
+    def dates(when, cadence, occurrences):
+        """Returns the start time of each visit in a series.
         """
-        return self.pending().filter(Q(fulfillment__isnull=True) | Q(fulfillment__cancelled=True))
+        return [when + (VisitSeries.INTERVALS[cadence] * i) for i in range(occurrences)]
 
 
 class Visit(models.Model):
     """On its own, a visit requested by a member. Once it has been fulfilled by
     a pal, a linked fulfillment is created.
+
+    The status is derived from the cancelled flag and the visit's active
+    fulfillment, but is stored so that the marketplace of unscheduled visits
+    can be selected without joining fulfillments. visits.app.scheduling
+    keeps it up to date.
     """
-    member = models.ForeignKey(Member, on_delete=models.PROTECT)
+    UNSCHEDULED = "unscheduled"
+    SCHEDULED = "scheduled"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+    STATUSES = [
+        (UNSCHEDULED, "Unscheduled"),
+        (SCHEDULED, "Scheduled"),
+        (COMPLETED, "Completed"),
+        (CANCELLED, "Cancelled"),
+    ]
+
+    member = models.ForeignKey(Member, on_delete=models.PROTECT, db_index=False)
+    series = models.ForeignKey(VisitSeries, on_delete=models.PROTECT, null=True, blank=True)
     when = models.DateTimeField()
     minutes = models.PositiveIntegerField()
     tasks = models.TextField()
     cancelled = models.BooleanField(default=False)
+    status = models.CharField(max_length=20, choices=STATUSES, default=UNSCHEDULED)
 
     # Custom model manager
-    objects = VisitManager()
+    objects = VisitQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # VisitQuerySet.unscheduled and VisitQuerySet.matching
+            models.Index(fields=["status", "when", "minutes"], name="visit_status_when_idx"),
+            # VisitQuerySet.pending. Only created on backends supporting
+            # partial indexes.
+            models.Index(fields=["when"], condition=Q(cancelled=False), name="visit_pending_idx"),
+            # A member's visits, in order (also serves the member foreign key)
+            models.Index(fields=["member", "when"], name="visit_member_when_idx"),
+            # Every visit in a month, cancelled or not, for monthly reports
+            # (see visits.app.reports)
+            models.Index(fields=["when", "status"], name="visit_when_status_idx"),
+        ]
 
     def __str__(self):
-        return f'Visit ({self.str_state}) {self.member} for {self.minutes} minutes on {self.when}'
+        # The stored status, rather than str_state, which queries for the
+        # visit's fulfillment
+        return f'Visit ({self.status}) {self.member} for {self.minutes} minutes on {self.when}'
 
     @property
     def fulfillment(self):
-        # NOTE: django caches result sets
+        # Use the fulfillment prefetched by
+        # VisitQuerySet.with_active_fulfillment when available
+        if hasattr(self, "active_fulfillments"):
+            return self.active_fulfillments[0] if self.active_fulfillments else None
+
         return self.fulfillment_set.filter(cancelled=False).first()
 
     @property
     def is_scheduled(self):
-        return self.fulfillment is not None and self.fulfillment.completed is False
+        fulfillment = self.fulfillment
+        return fulfillment is not None and fulfillment.completed is False
 
     @property
     def is_completed(self):
-        return self.fulfillment is not None and self.fulfillment.completed is True
+        fulfillment = self.fulfillment
+        return fulfillment is not None and fulfillment.completed is True
 
     @property
     def is_over(self):
@@ -163,11 +305,26 @@ class Visit(models.Model):
 class Fulfillment(models.Model):
     """Records when a visit is fulfilled by a pal.
     """
-    visit = models.ForeignKey(Visit, on_delete=models.PROTECT)
-    pal = models.ForeignKey(Pal, on_delete=models.PROTECT)
+    visit = models.ForeignKey(Visit, on_delete=models.PROTECT, db_index=False)
+    pal = models.ForeignKey(Pal, on_delete=models.PROTECT, db_index=False)
     completed = models.BooleanField(default=False)
     cancelled = models.BooleanField(default=False)
 
+    class Meta:
+        constraints = [
+            # A visit may be scheduled with (or completed by) only one pal
+            models.UniqueConstraint(fields=["visit"], condition=Q(cancelled=False), name="unique_active_fulfillment"),
+        ]
+        indexes = [
+            # A visit's active fulfillment (also serves the visit foreign key)
+            models.Index(fields=["visit", "cancelled"], name="fulfillment_visit_idx"),
+            # A pal's active fulfillments (also serves the pal foreign key)
+            models.Index(fields=["pal", "completed", "cancelled"], name="fulfillment_pal_idx"),
+            # All active fulfillments, for batch completion. Only created on
+            # backends supporting partial indexes.
+            models.Index(fields=["id"], condition=Q(completed=False, cancelled=False), name="fulfillment_active_idx"),
+        ]
+
     def __str__(self):
         if self.cancelled:
             return f'(Cancelled) {self.visit}'
@@ -209,13 +366,149 @@ class MinuteLedger(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
-    account = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    visit = models.ForeignKey(Visit, on_delete=models.CASCADE)
+    account = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    visit = models.ForeignKey(Visit, on_delete=models.CASCADE, db_index=False)
     amount = models.IntegerField()
     reason = models.CharField(max_length=100, choices=REASONS)
     cancelled = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # A visit's entries, e.g. when cancelling it (also serves the
+            # visit foreign key)
+            models.Index(fields=["visit", "cancelled"], name="ledger_visit_idx"),
+            # An account's entries, e.g. when rebuilding its rollups (also
+            # serves the account foreign key)
+            models.Index(fields=["account", "cancelled", "created"], name="ledger_account_idx"),
+            # Every entry in a date range, in order, for exports (see
+            # visits.app.exports)
+            models.Index(fields=["created", "id"], name="ledger_created_idx"),
+            # Every entry of a kind in a date range, e.g. pals' earnings for
+            # monthly reports (see visits.app.reports)
+            models.Index(fields=["reason", "created"], name="ledger_reason_idx"),
+        ]
+
     def __str__(self):
         amount = self.amount if self.amount > 0 else f"({abs(self.amount)})"
         cancelled = " (cancelled)" if self.cancelled else ""
         return f"{self.created} | {amount} | {self.account} {cancelled}"
+
+
+class MinuteRollup(models.Model):
+    """Monthly totals of an account's active (uncancelled) MinuteLedger
+    entries, bucketed by the month in which each entry was created. Kept up to
+    date by visits.app.ledger in the same transaction as the ledger writes so
+    that balances can be calculated without scanning the entire ledger.
+    """
+    account = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    month = models.DateField()
+    credits = models.IntegerField(default=0)
+    debits = models.IntegerField(default=0)
+
+    # The member's plan_minutes for the month, which is what the month's
+    # debits are counted against once it has closed. Set from the member's
+    # plan when the rollup is created, and by visits.app.plans when a plan
+    # change takes effect from this month or earlier.
+    plan_minutes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also serves the account foreign key
+            models.UniqueConstraint(fields=["account", "month"], name="unique_rollup_account_month"),
+        ]
+        indexes = [
+            # Every account's rollup for a month, for monthly reports (see
+            # visits.app.reports)
+            models.Index(fields=["month"], name="rollup_month_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} | {self.credits} | ({abs(self.debits)}) | {self.account}"
+
+
+class VisitEvent(models.Model):
+    """A feed of the changes to the marketplace of unscheduled visits, which is
+    streamed to pals (see visits.async_views.available_events). Appended to by
+    visits.app.scheduling in the same transaction as each change, and read in
+    order of id.
+    """
+    CREATED = "created"
+    CLAIMED = "claimed"
+    RELEASED = "released"
+    CANCELLED = "cancelled"
+    KINDS = [
+        (CREATED, "Visit requested"),
+        (CLAIMED, "Visit accepted by a pal"),
+        (RELEASED, "Visit released by its pal"),
+        (CANCELLED, "Visit cancelled"),
+    ]
+
+    created = models.DateTimeField(auto_now_add=True)
+    visit = models.ForeignKey(Visit, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KINDS)
+
+    class Meta:
+        indexes = [
+            # Pruning old events
+            models.Index(fields=["created"], name="visitevent_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.created} | {self.kind} | {self.visit}"
+
+
+class PlanChange(models.Model):
+    """A change to a Member's plan_minutes taking effect from the start of a
+    future month, such as when an insurer changes its coverage. Applied, and
+    then deleted, by visits.app.plans once the month arrives.
+    """
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, db_index=False)
+    plan_minutes = models.PositiveIntegerField()
+
+    # The first day of the month the change takes effect
+    effective = models.DateField()
+
+    class Meta:
+        constraints = [
+            # Also serves the member foreign key
+            models.UniqueConstraint(fields=["member", "effective"], name="unique_plan_change"),
+        ]
+        indexes = [
+            # Changes which have come due
+            models.Index(fields=["effective"], name="planchange_effective_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.effective:%Y-%m} | {self.plan_minutes} | {self.member}"
+
+
+class MonthlyReport(models.Model):
+    """The usage and earnings figures of a closed month, computed once by
+    visits.app.reports so that the reporting dashboard need not aggregate the
+    ledger and visits of every past month on each view. Minute figures are
+    bucketed like MinuteRollups, by the month each ledger entry was created;
+    visit and fulfillment counts by the month of the visit.
+    """
+    # The first day of the month
+    month = models.DateField(unique=True)
+    computed = models.DateTimeField(auto_now=True)
+
+    # Minutes members spent on visits, split between their plans' minutes and
+    # the minutes they banked as pals
+    minutes_used = models.IntegerField(default=0)
+    plan_minutes_used = models.IntegerField(default=0)
+    banked_minutes_used = models.IntegerField(default=0)
+
+    # Minutes of completed visits, split between the pals who fulfilled them
+    # and the platform's cut (see FULFILLMENT_PAL_CUT)
+    minutes_fulfilled = models.IntegerField(default=0)
+    minutes_earned = models.IntegerField(default=0)
+    platform_minutes = models.IntegerField(default=0)
+
+    visits = models.IntegerField(default=0)
+    visits_cancelled = models.IntegerField(default=0)
+    fulfillments = models.IntegerField(default=0)
+    fulfillments_cancelled = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} | {self.minutes_used} used | {self.minutes_earned} earned | {self.platform_minutes} platform"
@@ -1,5 +1,8 @@
 from django.test import TestCase
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.utils.http import urlsafe_base64_decode
 
 import visits.app.account as account
 from visits.models import Member, Pal
@@ -18,3 +21,57 @@ class AccountTest(TestCase):
         self.assertEqual(user.member.plan_minutes, 90)
 
         self.assertIsInstance(user.pal, Pal)
+
+    def test__import_accounts(self):
+        account.add_new_account("Joe", "Blow", "existing@somewhere.com", "super secret", 90)
+
+        rows = [
+            {"first_name": "Ann", "last_name": "One", "email": "ann@somewhere.com", "plan_minutes": "60"},
+            {"first_name": "Bob", "last_name": "Two", "email": "bob@somewhere.com", "plan_minutes": ""},
+            {"first_name": "Ann", "last_name": "Again", "email": "ann@somewhere.com", "plan_minutes": "60"},
+            {"first_name": "Joe", "last_name": "Blow", "email": "existing@somewhere.com", "plan_minutes": "60"},
+            {"first_name": "", "last_name": "Nobody", "email": "nobody@somewhere.com", "plan_minutes": "60"},
+            {"first_name": "Bad", "last_name": "Email", "email": "not an email", "plan_minutes": "60"},
+            {"first_name": "Bad", "last_name": "Minutes", "email": "minutes@somewhere.com", "plan_minutes": "-1"},
+            {"first_name": "Cat", "last_name": "Three", "email": "cat@somewhere.com", "plan_minutes": "30"},
+        ]
+
+        chunks = list(account.import_accounts(rows, chunk_size=3))
+        self.assertEqual(len(chunks), 3)
+
+        created = [user for chunk in chunks for user in chunk.created]
+        self.assertEqual([user.email for user in created], ["ann@somewhere.com", "bob@somewhere.com", "cat@somewhere.com"])
+        self.assertEqual([d for chunk in chunks for d in chunk.duplicates], ["ann@somewhere.com", "existing@somewhere.com"])
+        self.assertEqual(len([e for chunk in chunks for e in chunk.invalid]), 3)
+        self.assertIn("Line 5:", chunks[1].invalid[0])
+
+        ann = User.objects.get(username="ann@somewhere.com")
+        self.assertEqual(ann.first_name, "Ann")
+        self.assertEqual(ann.member.plan_minutes, 60)
+        self.assertIsInstance(ann.pal, Pal)
+        self.assertEqual(User.objects.get(username="bob@somewhere.com").member.plan_minutes, 0)
+
+        # imported users are invited to set a password
+        self.assertFalse(ann.has_usable_password())
+        uidb64, token = account.invite_token(ann)
+        self.assertEqual(urlsafe_base64_decode(uidb64).decode(), str(ann.pk))
+        self.assertTrue(default_token_generator.check_token(ann, token))
+
+        # the invite is used up once the password is set
+        ann.set_password("super secret")
+        ann.save()
+        self.assertFalse(default_token_generator.check_token(ann, token))
+
+    def test__import_accounts_with_passwords(self):
+        rows = [
+            {"first_name": "Ann", "last_name": "One", "email": "ann@somewhere.com", "plan_minutes": "60", "password": "super secret"},
+            {"first_name": "Bob", "last_name": "Two", "email": "bob@somewhere.com", "plan_minutes": "60"},
+        ]
+
+        def hash_passwords(passwords):
+            return [make_password(password) for password in passwords]
+
+        chunk, = account.import_accounts(rows, hash_passwords=hash_passwords)
+        self.assertEqual(len(chunk.created), 1)
+        self.assertIn("password is required", chunk.invalid[0])
+        self.assertTrue(User.objects.get(username="ann@somewhere.com").check_password("super secret"))
@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+import visits.app.balances as balances
+import visits.app.ledger as ledger
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.models import MinuteRollup
+from visits.tests import new_user
+
+
+class BalancesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test__current(self):
+        user = new_user(mins=100)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(balances.current(user.member), (100, 100))
+
+        # served from the cache with a single version lookup
+        with self.assertNumQueries(1):
+            self.assertEqual(balances.current(user.member), (100, 100))
+
+        # ledger writes move the account to a new version
+        scheduling.create_visit(user.member, utcnow() + timedelta(minutes=5), 30, "do things")
+        self.assertEqual(balances.current(user.member), (70, 70))
+
+        # as do changes to the plan
+        user.member.plan_minutes = 200
+        user.member.save()
+        self.assertEqual(balances.current(user.member), (170, 170))
+
+    def test__rebuild(self):
+        pal = new_user(mins=100)
+        other = new_user(mins=100)
+
+        # a rollup which has lost the pal's earnings
+        visit = scheduling.create_visit(other.member, utcnow() - timedelta(days=1), 350, "do things")
+        scheduling.complete_fulfillment(scheduling.create_fulfillment(pal.pal, visit))
+        MinuteRollup.objects.filter(account=pal).update(credits=0)
+
+        for account_ids in ([pal.pk], None):
+            with self.subTest(account_ids=account_ids):
+                cache.clear()
+
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertEqual(balances.current(pal.member), (100, 100))
+
+                ledger.rebuild(account_ids)
+                self.assertEqual(balances.current(pal.member), (100, 397))
+                MinuteRollup.objects.filter(account=pal).update(credits=0)
+
+    def test__uncommitted(self):
+        user = new_user(mins=100)
+
+        # balances computed in a transaction which never commits are not cached
+        balances.current(user.member)
+
+        with self.assertNumQueries(2):
+            balances.current(user.member)
+
+    @override_settings(BALANCE_CACHE_VERIFY_RATE=1.0)
+    def test__verify(self):
+        user = new_user(mins=100)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            balances.current(user.member)
+
+        now = utcnow()
+        cache.set(balances._key(user.member.pk, user.member.ledger_version, 100, now.month, now.year), (1, 1))
+
+        with self.assertLogs("visits.app.balances", "WARNING"):
+            self.assertEqual(balances.current(user.member), (100, 100))
@@ -0,0 +1,113 @@
+import threading
+import time
+from datetime import timedelta
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.exceptions import ValidationError
+from django.db import connection, OperationalError
+from django.test import TransactionTestCase
+
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.models import Member
+from visits.tests import new_user
+
+
+class ConcurrentBookingTest(TransactionTestCase):
+    """Many threads, each with their own database connection, race to book
+    visits for the same member. Exactly as many visits as the member can
+    afford should be booked.
+
+    On sqlite, which allows one writer at a time across the whole database,
+    this passes even without ledger.lock; ForcedRaceTest shows that the lock
+    is what prevents the overdraw on backends with row locks.
+    """
+    THREADS = 8
+    ATTEMPTS = 5
+
+    def book(self, member_id, when, results):
+        for _ in range(self.ATTEMPTS):
+            while True:
+                try:
+                    member = Member.objects.select_related("account").get(pk=member_id)
+                    scheduling.book_visit(member, when, 30, "sorting assorted sorts")
+                    results.append("booked")
+                except ValidationError:
+                    results.append("rejected")
+                except OperationalError:
+                    # sqlite reports lock contention as an error instead of
+                    # waiting; try again
+                    time.sleep(0.01)
+                    continue
+                break
+
+        connection.close()
+
+    def test__book_visit_never_overdraws(self):
+        user = new_user(mins=300)
+        when = utcnow() + timedelta(days=1)
+        results = []
+
+        threads = [threading.Thread(target=self.book, args=(user.member.pk, when, results)) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count("booked"), 10)
+        self.assertEqual(results.count("rejected"), self.THREADS * self.ATTEMPTS - 10)
+        self.assertEqual(user.member.minutes_available(when.month, when.year), 0)
+        self.assertEqual(user.member.visit_set.count(), 10)
+
+
+@skipUnless(connection.features.has_select_for_update, "sqlite allows one writer at a time, so the race cannot be forced")
+class ForcedRaceTest(TransactionTestCase):
+    """Two threads book a visit for a member who can afford only one. After
+    checking the balance, each waits (for up to TIMEOUT) for the other to
+    check it too, so that without ledger.lock both check before either
+    writes. With the lock, the second thread waits for the first to commit
+    before checking, and is rejected.
+    """
+    TIMEOUT = 2
+
+    def race(self):
+        user = new_user(mins=30)
+        when = utcnow() + timedelta(days=1)
+        barrier = threading.Barrier(2, timeout=self.TIMEOUT)
+        validate_new_visit = scheduling.validate_new_visit
+        results = []
+
+        def validate_and_wait(*args):
+            validate_new_visit(*args)
+
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                pass
+
+        def book():
+            try:
+                member = Member.objects.select_related("account").get(pk=user.member.pk)
+                scheduling.book_visit(member, when, 30, "do things")
+                results.append("booked")
+            except ValidationError:
+                results.append("rejected")
+            finally:
+                connection.close()
+
+        with patch("visits.app.scheduling.validate_new_visit", validate_and_wait):
+            threads = [threading.Thread(target=book) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        return sorted(results)
+
+    def test__overdraws_without_lock(self):
+        with patch("visits.app.ledger.lock"):
+            self.assertEqual(self.race(), ["booked", "booked"])
+
+    def test__lock_prevents_overdraw(self):
+        self.assertEqual(self.race(), ["booked", "rejected"])
@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.test import TestCase
+
+import visits.app.events as events
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.models import VisitEvent, VisitSeries
+from visits.tests import new_user
+
+
+class EventsTest(TestCase):
+    def kinds(self, member, last_id=0):
+        return [(e.visit_id, e.kind) for e in events.following(member, last_id)]
+
+    def test__scheduling(self):
+        member = new_user(mins=1000)
+        pal = new_user()
+        start = events.latest()
+
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 30, "do things")
+        fulfillment = scheduling.create_fulfillment(pal.pal, visit)
+        scheduling.cancel_fulfillment(fulfillment)
+        scheduling.cancel_visit(visit)
+
+        self.assertEqual(self.kinds(pal.member, start), [
+            (visit.id, VisitEvent.CREATED),
+            (visit.id, VisitEvent.CLAIMED),
+            (visit.id, VisitEvent.RELEASED),
+            (visit.id, VisitEvent.CANCELLED),
+        ])
+
+        # members are not told about their own visits
+        self.assertEqual(self.kinds(member.member, start), [])
+
+        series = scheduling.create_series(member.member, utcnow() + timedelta(days=1), 30, "do things", VisitSeries.WEEKLY, 3)
+        self.assertEqual(len(self.kinds(pal.member, events.latest() - 3)), 3)
+        self.assertTrue(all(e.visit.series == series for e in events.following(pal.member, events.latest() - 3)))
+
+    def test__prune(self):
+        member = new_user(mins=1000)
+        scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 30, "do things")
+
+        self.assertEqual(events.prune(timedelta(hours=1)), 0)
+        VisitEvent.objects.update(created=utcnow() - timedelta(hours=2))
+        self.assertEqual(events.prune(timedelta(hours=1)), 1)
@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+from datetime import timedelta
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+import visits.app.exports as exports
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.models import MinuteLedger
+from visits.tests import new_user
+
+
+class ExportsTest(TestCase):
+    def setUp(self):
+        self.user = new_user(mins=1000)
+
+        for i in range(5):
+            scheduling.create_visit(self.user.member, utcnow() + timedelta(days=i + 1), 10, "do things")
+
+        # Entries sharing a created time are ordered by id, and split across
+        # chunks without being skipped or repeated
+        MinuteLedger.objects.update(created=utcnow())
+
+    def test__ledger_chunks(self):
+        chunks = list(exports.ledger_chunks(chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([entry.id for chunk in chunks for entry in chunk], list(MinuteLedger.objects.order_by("id").values_list("id", flat=True)))
+
+    def test__ledger_chunks_queries(self):
+        chunks = exports.ledger_chunks(chunk_size=2)
+
+        for chunk in chunks:
+            # Each chunk's accounts and visits are read with it
+            with CaptureQueriesContext(connection) as queries:
+                [exports.row(entry) for entry in chunk]
+
+            self.assertEqual(len(queries.captured_queries), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            list(exports.ledger_chunks(chunk_size=2))
+
+        self.assertEqual(len(queries.captured_queries), 3)
+
+    def test__ledger_chunks_range(self):
+        now = utcnow()
+        start, end = exports.month_range(now.month, now.year)
+        self.assertEqual(sum(map(len, exports.ledger_chunks(start, end))), 5)
+
+        start, end = exports.month_range(12, now.year - 1)
+        self.assertEqual(list(exports.ledger_chunks(start, end)), [])
+        self.assertEqual(list(exports.ledger_chunks(end=now - timedelta(days=1))), [])
+
+    def test__csv(self):
+        rows = list(csv.DictReader(io.StringIO("".join(exports.export("csv", chunk_size=2)))))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]["email"], self.user.email)
+        self.assertEqual(rows[0]["amount"], "-10")
+        self.assertEqual(rows[0]["reason"], MinuteLedger.VISIT_SCHEDULED)
+
+    def test__csv_empty(self):
+        MinuteLedger.objects.all().delete()
+        self.assertEqual("".join(exports.export("csv")), ",".join(exports.FIELDS) + "\r\n")
+
+    def test__jsonl(self):
+        rows = [json.loads(line) for line in "".join(exports.export("jsonl", chunk_size=2)).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(list(rows[0]), exports.FIELDS)
+
+    def test__command(self):
+        now = utcnow()
+        out = io.StringIO()
+        err = io.StringIO()
+        call_command("export_ledger", month=f"{now:%Y-%m}", format="jsonl", stdout=out, stderr=err)
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+        self.assertIn(f"ledger-{now:%Y-%m}.jsonl", err.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command("export_ledger", month="9999-12", stdout=out, stderr=err)
@@ -0,0 +1,69 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+import visits.app.ledger as ledger
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.models import MinuteLedger, MinuteRollup
+from visits.tests import new_user
+
+
+class LedgerTest(TestCase):
+    def rollup(self, user):
+        return MinuteRollup.objects.get(account=user, month=ledger.month_of(utcnow()))
+
+    def test__add(self):
+        member = new_user()
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 30, "sorting assorted sorts")
+
+        ledger.add(member, visit, MinuteLedger.VISIT_FULFILLED, 20)
+        ledger.add(member, visit, MinuteLedger.VISIT_SCHEDULED, -15)
+
+        rollup = self.rollup(member)
+        self.assertEqual(rollup.credits, 20)
+        self.assertEqual(rollup.debits, -45)
+
+        # records the member's plan for the month
+        self.assertEqual(rollup.plan_minutes, 90)
+
+    def test__cancel(self):
+        member = new_user()
+        visit1 = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 30, "sorting assorted sorts")
+        visit2 = scheduling.create_visit(member.member, utcnow() + timedelta(days=2), 20, "sorting assorted sorts")
+
+        self.assertEqual(ledger.cancel(visit1.minuteledger_set.all()), 1)
+        self.assertEqual(self.rollup(member).debits, -20)
+
+        # already cancelled entries are not removed from the rollup twice
+        self.assertEqual(ledger.cancel(visit1.minuteledger_set.all()), 0)
+        self.assertEqual(self.rollup(member).debits, -20)
+
+        ledger.cancel(visit2.minuteledger_set.all())
+        self.assertEqual(self.rollup(member).debits, 0)
+
+    def test__rebuild(self):
+        member = new_user(mins=300)
+        pal = new_user(mins=300)
+
+        visit = scheduling.create_visit(member.member, utcnow() - timedelta(hours=3), 100, "sorting assorted sorts")
+        scheduling.complete_fulfillment(scheduling.create_fulfillment(pal.pal, visit))
+        scheduling.cancel_visit(scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 50, "sorting assorted sorts"))
+
+        expected = sorted(MinuteRollup.objects.values_list("account_id", "month", "credits", "debits"))
+        MinuteRollup.objects.all().delete()
+
+        self.assertEqual(ledger.rebuild([member.pk]), 1)
+        self.assertEqual(self.rollup(member).debits, -100)
+        self.assertFalse(MinuteRollup.objects.filter(account=pal).exists())
+
+        call_command("rebuild_minute_rollups", stdout=StringIO())
+        self.assertEqual(sorted(MinuteRollup.objects.values_list("account_id", "month", "credits", "debits")), expected)
+
+        # keeps the plans recorded for each month
+        MinuteRollup.objects.filter(account=pal).update(plan_minutes=45)
+        ledger.rebuild()
+        self.assertEqual(self.rollup(pal).plan_minutes, 45)
+        self.assertEqual(pal.member.minutes_available(visit.when.month, visit.when.year), 385)
@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase
+
+import visits.app.marketplace as marketplace
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.tests import new_user
+
+
+class MarketplaceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test__snapshot(self):
+        member = new_user(mins=1000)
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 30, "do things")
+
+        self.assertEqual(marketplace.snapshot(), [visit])
+
+        # served from the cache until something changes
+        with self.assertNumQueries(0):
+            self.assertEqual(marketplace.snapshot(), [visit])
+
+        other = scheduling.create_visit(member.member, utcnow() + timedelta(days=2), 30, "do things")
+        self.assertEqual(marketplace.snapshot(), [visit, other])
+
+        fulfillment = scheduling.create_fulfillment(new_user().pal, visit)
+        self.assertEqual(marketplace.snapshot(), [other])
+
+        scheduling.cancel_fulfillment(fulfillment)
+        self.assertEqual(marketplace.snapshot(), [visit, other])
+
+        scheduling.cancel_visit(other)
+        self.assertEqual(marketplace.snapshot(), [visit])
+
+    def test__snapshot_rebuilding(self):
+        member = new_user(mins=1000)
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 30, "do things")
+        marketplace.snapshot()
+
+        scheduling.create_visit(member.member, utcnow() + timedelta(days=2), 30, "do things")
+
+        # while another request holds the rebuild lock, the previous snapshot
+        # is served without querying
+        cache.add(f"marketplace:{marketplace.version()}:lock", True)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(marketplace.snapshot(), [visit])
+
+    def test__available(self):
+        member = new_user(mins=1000)
+        pal = new_user(mins=1000)
+        when = utcnow() + timedelta(days=1)
+
+        visits = [scheduling.create_visit(member.member, when + timedelta(hours=i), 10, "do things") for i in range(5)]
+        scheduling.create_visit(pal.member, when, 10, "the pal's own visit")
+
+        page = marketplace.available(pal.member, size=3)
+        self.assertEqual(list(page), visits[:3])
+
+        page = marketplace.available(pal.member, page.next_cursor, size=3)
+        self.assertEqual(list(page), visits[3:])
+        self.assertIsNone(page.next_cursor)
@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.test import TestCase
+
+import visits.app.pagination as pagination
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.models import Visit
+from visits.tests import new_user
+
+
+class PaginationTest(TestCase):
+    def test__cursor(self):
+        when = utcnow()
+        cursor = pagination.encode_cursor(when, 42)
+        self.assertEqual(pagination.decode_cursor(cursor), (when, 42))
+        self.assertIsNone(pagination.decode_cursor(""))
+        self.assertIsNone(pagination.decode_cursor(None))
+        self.assertIsNone(pagination.decode_cursor("garbage"))
+        self.assertIsNone(pagination.decode_cursor(pagination.encode_cursor(when.replace(tzinfo=None), 42)))
+
+    def test__paginate(self):
+        user = new_user(mins=1000)
+        when = utcnow() + timedelta(days=1)
+
+        # visits sharing a start time are ordered by id
+        visits = [scheduling.create_visit(user.member, when + timedelta(hours=i // 2), 10, "do things") for i in range(7)]
+
+        page = pagination.paginate(Visit.objects.all(), size=3)
+        self.assertEqual(list(page), visits[:3])
+
+        # a visit inserted into an earlier page does not shift later pages
+        scheduling.create_visit(user.member, when - timedelta(hours=1), 10, "do things")
+
+        page = pagination.paginate(Visit.objects.all(), page.next_cursor, size=3)
+        self.assertEqual(list(page), visits[3:6])
+
+        page = pagination.paginate(Visit.objects.all(), page.next_cursor, size=3)
+        self.assertEqual(list(page), visits[6:])
+        self.assertIsNone(page.next_cursor)
+
+    def test__paginate_descending(self):
+        user = new_user(mins=1000)
+        when = utcnow() + timedelta(days=1)
+        visits = [scheduling.create_visit(user.member, when + timedelta(hours=i // 2), 10, "do things") for i in range(5)]
+
+        page = pagination.paginate(Visit.objects.all(), size=3, descending=True)
+        self.assertEqual(list(page), visits[::-1][:3])
+
+        page = pagination.paginate(Visit.objects.all(), page.next_cursor, size=3, descending=True)
+        self.assertEqual(list(page), visits[::-1][3:])
+        self.assertIsNone(page.next_cursor)
@@ -0,0 +1,103 @@
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.test import TestCase
+
+import visits.app.balances as balances
+import visits.app.plans as plans
+from visits.models import Member, MinuteRollup, PlanChange
+from visits.tests import new_user
+
+
+class PlansTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.today = plans.current_month()
+        self.next_month = (self.today + timedelta(days=31)).replace(day=1)
+        self.last_month = (self.today - timedelta(days=1)).replace(day=1)
+
+    def test__change(self):
+        ann = new_user(mins=60)
+        bob = new_user(mins=60)
+
+        # balances cached at the old plan are not served once it changes
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(balances.current(ann.member), (60, 60))
+
+        rows = [
+            {"email": ann.email, "plan_minutes": "90"},
+            {"email": bob.email, "plan_minutes": "100"},
+            {"email": "nobody@example.com", "plan_minutes": "90"},
+            {"email": bob.email, "plan_minutes": "120"},
+            {"email": ann.email, "plan_minutes": "lots"},
+        ]
+
+        chunks = list(plans.change(rows, self.today, chunk_size=2))
+        self.assertEqual(sum(chunk.changed for chunk in chunks), 3)
+        self.assertEqual([email for chunk in chunks for email in chunk.unknown], ["nobody@example.com"])
+        self.assertIn("Line 5:", chunks[2].invalid[0])
+
+        self.assertEqual(Member.objects.get(pk=ann.member.pk).plan_minutes, 90)
+        self.assertEqual(Member.objects.get(pk=bob.member.pk).plan_minutes, 120)
+        self.assertEqual(balances.current(Member.objects.get(pk=ann.member.pk)), (90, 90))
+
+    def test__future_changes(self):
+        ann = new_user(mins=60)
+        bob = new_user(mins=60)
+
+        # changes effective in a later month are stored until it arrives
+        list(plans.change([{"email": ann.email, "plan_minutes": 90}], self.next_month + timedelta(days=5)))
+        self.assertEqual(plans.change_members(Member.objects.filter(pk=bob.member.pk), 30, self.next_month), 1)
+        self.assertEqual(Member.objects.get(pk=ann.member.pk).plan_minutes, 60)
+
+        # and replaced by a later change for the same month
+        list(plans.change([{"email": ann.email, "plan_minutes": 100}], self.next_month))
+        self.assertEqual(PlanChange.objects.get(member=ann.member).plan_minutes, 100)
+        self.assertEqual(plans.apply_due(), 0)
+
+        # once the month arrives, the latest due change wins
+        PlanChange.objects.update(effective=self.today)
+        PlanChange.objects.create(member=ann.member, plan_minutes=75, effective=date(2000, 1, 1))
+        self.assertEqual(plans.apply_due(chunk_size=1), 3)
+        self.assertEqual(Member.objects.get(pk=ann.member.pk).plan_minutes, 100)
+        self.assertEqual(Member.objects.get(pk=bob.member.pk).plan_minutes, 30)
+        self.assertFalse(PlanChange.objects.exists())
+
+    def test__change_members(self):
+        ann = new_user(mins=60)
+        bob = new_user(mins=60)
+
+        # a change effective now supersedes changes waiting to be applied
+        PlanChange.objects.create(member=ann.member, plan_minutes=75, effective=self.today)
+        PlanChange.objects.create(member=ann.member, plan_minutes=80, effective=self.next_month)
+
+        self.assertEqual(plans.change_members(Member.objects.filter(pk__in=[ann.member.pk, bob.member.pk]), 45, self.today), 2)
+        self.assertEqual(set(Member.objects.values_list("plan_minutes", flat=True)), {45})
+        self.assertEqual(list(PlanChange.objects.values_list("plan_minutes", flat=True)), [80])
+
+    def test__history(self):
+        ann = new_user(mins=60)
+        bob = new_user(mins=60)
+
+        # Last month each spent 90 minutes, 30 over their plans, of the 100
+        # they had banked
+        for user in (ann, bob):
+            MinuteRollup.objects.create(account=user, month=self.last_month, credits=100, debits=-90, plan_minutes=60)
+            MinuteRollup.objects.create(account=user, month=self.today, credits=0, debits=0, plan_minutes=60)
+
+        self.assertEqual(ann.member.current_minutes_available, 60 + 100 - 30)
+
+        # A change from this month leaves last month's overage alone
+        list(plans.change([{"email": ann.email, "plan_minutes": "120"}], self.today))
+        self.assertEqual(ann.member.current_minutes_available, 120 + 100 - 30)
+        self.assertEqual(dict(MinuteRollup.objects.filter(account=ann).values_list("month", "plan_minutes")), {self.last_month: 60, self.today: 120})
+
+        # A change from last month covers it too
+        plans.change_members(Member.objects.filter(pk=bob.member.pk), 120, self.last_month)
+        self.assertEqual(bob.member.current_minutes_available, 120 + 100)
+        self.assertEqual(set(MinuteRollup.objects.filter(account=bob).values_list("plan_minutes", flat=True)), {120})
+
+        # As do stored changes once due
+        PlanChange.objects.create(member=ann.member, plan_minutes=90, effective=self.last_month)
+        plans.apply_due()
+        self.assertEqual(ann.member.current_minutes_available, 90 + 100)
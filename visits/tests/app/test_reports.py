@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+import visits.app.ledger as ledger
+import visits.app.reports as reports
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.models import MinuteLedger, MonthlyReport, Visit
+from visits.tests import new_user
+
+
+class ReportsTest(TestCase):
+    def setUp(self):
+        self.current = reports.current_month()
+        self.last = (self.current - timedelta(days=1)).replace(day=1)
+        self.ann = new_user(mins=60)
+        self.bob = new_user(mins=60)
+
+        # Ann uses her 60 plan minutes and 10 of the 25 she banked by visiting
+        # Bob, who cancels one visit
+        visit = scheduling.create_visit(self.bob.member, utcnow(), 30, "do things")
+        scheduling.complete_fulfillment(scheduling.create_fulfillment(self.ann.pal, visit))
+        scheduling.create_visit(self.ann.member, utcnow(), 40, "do things")
+        scheduling.create_visit(self.ann.member, utcnow(), 30, "do things")
+        scheduling.cancel_visit(scheduling.create_visit(self.bob.member, utcnow(), 20, "do things"))
+
+    def close_month(self):
+        """Moves everything into last month, which is then closed.
+        """
+        MinuteLedger.objects.update(created=reports.datetime_of(self.last))
+        Visit.objects.update(when=reports.datetime_of(self.last) + timedelta(days=1))
+        ledger.rebuild()
+
+    def test__current_month(self):
+        [report] = reports.monthly()
+        self.assertEqual(report.month, self.current)
+        self.assertEqual((report.minutes_used, report.plan_minutes_used, report.banked_minutes_used), (100, 90, 10))
+        self.assertEqual((report.minutes_fulfilled, report.minutes_earned, report.platform_minutes), (30, 25, 5))
+        self.assertEqual((report.visits, report.visits_cancelled), (4, 1))
+        self.assertEqual((report.fulfillments, report.fulfillments_cancelled), (1, 0))
+        self.assertFalse(MonthlyReport.objects.exists())
+
+    def test__closed_months(self):
+        self.close_month()
+
+        current, last = reports.monthly()
+        self.assertEqual((current.month, current.minutes_used, current.visits), (self.current, 0, 0))
+        self.assertEqual((last.month, last.minutes_used, last.platform_minutes, last.visits), (self.last, 100, 5, 4))
+        self.assertTrue(MonthlyReport.objects.filter(month=self.last).exists())
+
+        # Once stored, closed months are read rather than computed
+        with CaptureQueriesContext(connection) as queries:
+            reports.monthly()
+
+        self.assertEqual(len(queries.captured_queries), 2 + 4)
+
+    def test__invalidated(self):
+        self.close_month()
+        reports.monthly()
+
+        # Cancelling an entry booked last month changes last month's report
+        ledger.cancel(MinuteLedger.objects.filter(account=self.ann, reason=MinuteLedger.VISIT_SCHEDULED, amount=-40))
+        self.assertFalse(MonthlyReport.objects.exists())
+        self.assertEqual(reports.monthly()[1].minutes_used, 60)
+
+    def test__invalidated_by_visit(self):
+        self.close_month()
+
+        # Booked this month for a visit last month, so only the visit's month
+        # tells which report changes
+        visit = scheduling.create_visit(self.ann.member, reports.datetime_of(self.last) + timedelta(days=2), 10, "do things")
+        self.assertEqual(reports.monthly()[1].visits_cancelled, 1)
+
+        scheduling.cancel_visits(Visit.objects.filter(pk=visit.pk))
+        self.assertEqual(reports.monthly()[1].visits_cancelled, 2)
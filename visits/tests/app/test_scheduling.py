@@ -2,10 +2,12 @@ from datetime import timedelta
 
 from django.test import TestCase
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 
 import visits.app.scheduling as scheduling
+from visits.forms import CancelVisitSeriesForm, MemberVisitRequestForm
 from visits.app.util import utcnow
-from visits.models import Fulfillment, MinuteLedger
+from visits.models import Fulfillment, MinuteLedger, VisitSeries
 from visits.tests import new_user
 
 
@@ -37,6 +39,18 @@ class NewVisitTest(TestCase):
         self.assertEqual(tx.amount, -30)
         self.assertFalse(tx.cancelled)
 
+    def test__book_visit(self):
+        user = new_user()
+
+        visit = scheduling.book_visit(user.member, utcnow() + timedelta(days=1), 60, "sorting assorted sorts")
+        self.assertEqual(visit.minuteledger_set.get().amount, -60)
+
+        # only 30 minutes remain
+        with self.assertRaises(ValidationError):
+            scheduling.book_visit(user.member, utcnow() + timedelta(days=1), 60, "sorting assorted sorts")
+
+        self.assertEqual(user.member.visit_set.count(), 1)
+
 
 class CancelVisitTest(TestCase):
     def test__validate_member_visit_cancellation(self):
@@ -79,6 +93,107 @@ class CancelVisitTest(TestCase):
         self.assertTrue(tx.cancelled)
 
 
+class VisitSeriesTest(TestCase):
+    def test__validate_new_series(self):
+        user = new_user(mins=300)
+        when = utcnow() + timedelta(days=1)
+
+        scheduling.validate_new_series(user.member, when, 60, VisitSeries.WEEKLY, 5)  # does not raise ValidationError
+
+        # schedule in the past
+        with self.assertRaises(ValidationError):
+            scheduling.validate_new_series(user.member, utcnow() - timedelta(days=1), 60, VisitSeries.WEEKLY, 5)
+
+        # too few or too many visits
+        with self.assertRaises(ValidationError):
+            scheduling.validate_new_series(user.member, when, 10, VisitSeries.WEEKLY, 1)
+        with self.assertRaises(ValidationError):
+            scheduling.validate_new_series(user.member, when, 10, VisitSeries.WEEKLY, scheduling.MAX_SERIES_OCCURRENCES + 1)
+
+        # not enough minutes for the whole series
+        with self.assertRaises(ValidationError):
+            scheduling.validate_new_series(user.member, when, 60, VisitSeries.BIWEEKLY, 6)
+
+    def test__create_series(self):
+        user = new_user(mins=300)
+        when = utcnow() + timedelta(days=1)
+
+        series = scheduling.book_series(user.member, when, 30, "sorting assorted sorts", VisitSeries.BIWEEKLY, 4)
+
+        visits = list(series.visit_set.order_by("when"))
+        self.assertEqual([v.when for v in visits], [when + timedelta(weeks=2 * i) for i in range(4)])
+        self.assertTrue(all(v.member == user.member and v.minutes == 30 for v in visits))
+
+        txs = MinuteLedger.objects.filter(visit__series=series)
+        self.assertEqual(sorted(tx.visit_id for tx in txs), [v.pk for v in visits])
+        self.assertTrue(all(tx.amount == -30 and tx.reason == MinuteLedger.VISIT_SCHEDULED for tx in txs))
+
+        self.assertEqual(user.member.current_minutes_available, 180)
+
+        # the remaining 180 minutes are not enough for another series like it
+        with self.assertRaises(ValidationError):
+            scheduling.book_series(user.member, when, 50, "sorting assorted sorts", VisitSeries.WEEKLY, 4)
+
+    def test__request_form(self):
+        user = new_user(300)
+        when = (utcnow() + timedelta(days=1)).isoformat()
+        data = {"when": when, "minutes": 30, "tasks": "sorting assorted sorts", "repeat": VisitSeries.WEEKLY, "occurrences": 4}
+
+        form = MemberVisitRequestForm(user, data)
+        self.assertTrue(form.is_valid())
+
+        # a series is only booked whole, under lock
+        with self.assertRaises(ValueError):
+            form.save(commit=False)
+
+        self.assertFalse(VisitSeries.objects.exists())
+        self.assertEqual(form.save().visit_set.count(), 4)
+
+        form = MemberVisitRequestForm(user, dict(data, repeat=""))
+        self.assertTrue(form.is_valid())
+
+        visit = form.save(commit=False)
+        self.assertIsNone(visit.pk)
+
+    def test__cancel_series(self):
+        member = new_user(mins=300)
+        pal = new_user()
+        series = scheduling.book_series(member.member, utcnow() + timedelta(days=1), 30, "sorting assorted sorts", VisitSeries.WEEKLY, 4)
+        first, *rest = series.visit_set.order_by("when")
+        fulfillment = scheduling.create_fulfillment(pal.pal, rest[0])
+
+        # the first visit has already happened
+        first.when = utcnow() - timedelta(days=1)
+        first.save()
+
+        scheduling.validate_member_series_cancellation(member.member, series.pk)  # does not raise ValidationError
+
+        # not the member's series
+        with self.assertRaises(ValidationError):
+            scheduling.validate_member_series_cancellation(pal.member, series.pk)
+
+        # a series is only cancelled whole
+        form = CancelVisitSeriesForm(member, {"series_id": series.pk})
+        self.assertTrue(form.is_valid())
+
+        with self.assertRaises(ValueError):
+            form.save(commit=False)
+
+        self.assertEqual(form.save(), 3)
+
+        first.refresh_from_db()
+        fulfillment.refresh_from_db()
+        self.assertFalse(first.cancelled)
+        self.assertTrue(fulfillment.cancelled)
+        self.assertEqual(series.visit_set.filter(cancelled=True).count(), 3)
+        self.assertEqual(MinuteLedger.objects.filter(visit__series=series, cancelled=False).count(), 1)
+        self.assertEqual(member.member.current_minutes_available, 270)
+
+        # nothing left to cancel
+        with self.assertRaises(ValidationError):
+            scheduling.validate_member_series_cancellation(member.member, series.pk)
+
+
 class NewFulfillmentTest(TestCase):
     def test__validate_new_fulfillment(self):
         member = new_user()
@@ -117,6 +232,22 @@ class NewFulfillmentTest(TestCase):
         self.assertFalse(fulfillment.completed)
         self.assertFalse(fulfillment.cancelled)
 
+        # another pal loses the race to claim the visit
+        self.assertIsNone(scheduling.create_fulfillment(new_user().pal, visit))
+        self.assertEqual(visit.fulfillment_set.count(), 1)
+
+        # once cancelled, the visit may be claimed again
+        scheduling.cancel_fulfillment(fulfillment)
+        self.assertIsNotNone(scheduling.create_fulfillment(new_user().pal, visit))
+
+    def test__unique_active_fulfillment(self):
+        member = new_user()
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 30, "sorting assorted sorts")
+        Fulfillment(pal=new_user().pal, visit=visit).save()
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Fulfillment(pal=new_user().pal, visit=visit).save()
+
 
 class CompleteFulfillmentTest(TestCase):
     def test__validate_fulfillment_completion(self):
@@ -125,20 +256,24 @@ class CompleteFulfillmentTest(TestCase):
         visit = scheduling.create_visit(member.member, utcnow() - timedelta(hours=1), 30, "sorting assorted sorts")
         fulfillment = scheduling.create_fulfillment(pal.pal, visit)
 
-        scheduling.validate_fulfillment_completion(fulfillment.pk)  # does not raise ValidationError
+        scheduling.validate_fulfillment_completion(pal.pal, fulfillment.pk)  # does not raise ValidationError
+
+        # fulfillment belongs to another pal
+        with self.assertRaises(ValidationError):
+            scheduling.validate_fulfillment_completion(member.pal, fulfillment.pk)
 
         # fulfillment already completed
         fulfillment.completed = True
         fulfillment.save()
         with self.assertRaises(ValidationError):
-            scheduling.validate_fulfillment_completion(fulfillment.pk)
+            scheduling.validate_fulfillment_completion(pal.pal, fulfillment.pk)
 
         # fulfillment was cancelled
         fulfillment.completed = False
         fulfillment.cancelled = True
         fulfillment.save()
         with self.assertRaises(ValidationError):
-            scheduling.validate_fulfillment_completion(fulfillment.pk)
+            scheduling.validate_fulfillment_completion(pal.pal, fulfillment.pk)
 
         # visit was cancelled
         fulfillment.completed = False
@@ -147,7 +282,7 @@ class CompleteFulfillmentTest(TestCase):
         visit.cancelled = True
         visit.save()
         with self.assertRaises(ValidationError):
-            scheduling.validate_fulfillment_completion(fulfillment.pk)
+            scheduling.validate_fulfillment_completion(pal.pal, fulfillment.pk)
 
         # visit is not yet over
         visit.cancelled = False
@@ -155,7 +290,7 @@ class CompleteFulfillmentTest(TestCase):
         visit.minutes = 30
         visit.save()
         with self.assertRaises(ValidationError):
-            scheduling.validate_fulfillment_completion(fulfillment.pk)
+            scheduling.validate_fulfillment_completion(pal.pal, fulfillment.pk)
 
     def test__complete_fulfillment(self):
         member = new_user()
@@ -163,7 +298,7 @@ class CompleteFulfillmentTest(TestCase):
 
         visit = scheduling.create_visit(member.member, utcnow() - timedelta(hours=3), 100, "sorting assorted sorts")
         fulfillment = scheduling.create_fulfillment(pal.pal, visit)
-        scheduling.complete_fulfillment(fulfillment)
+        self.assertTrue(scheduling.complete_fulfillment(fulfillment))
 
         fulfillment.refresh_from_db()
         self.assertTrue(fulfillment.completed)
@@ -173,6 +308,45 @@ class CompleteFulfillmentTest(TestCase):
         self.assertEqual(tx.amount, 85)  # see visits.app.scheduling.FULFILLMENT_PAL_CUT
         self.assertFalse(tx.cancelled)
 
+        # a second completion loses and earns nothing
+        self.assertFalse(scheduling.complete_fulfillment(fulfillment))
+        self.assertEqual(MinuteLedger.objects.filter(visit=visit, account=pal).count(), 1)
+
+    def test__complete_finished_fulfillments(self):
+        member = new_user(mins=1000)
+        pal = new_user()
+
+        def fulfill(when, minutes):
+            visit = scheduling.create_visit(member.member, when, minutes, "sorting assorted sorts")
+            return scheduling.create_fulfillment(pal.pal, visit)
+
+        finished = [fulfill(utcnow() - timedelta(hours=3), 100) for _ in range(5)]
+        in_progress = fulfill(utcnow() - timedelta(minutes=30), 60)
+        recently_finished = fulfill(utcnow() - timedelta(minutes=30), 20)
+        upcoming = fulfill(utcnow() + timedelta(hours=1), 60)
+
+        # the visit ended only 10 minutes ago, so it is still in its grace period
+        self.assertEqual(sum(scheduling.complete_finished_fulfillments(timedelta(minutes=15), batch_size=2)), 5)
+
+        for fulfillment in finished:
+            fulfillment.refresh_from_db()
+            self.assertTrue(fulfillment.completed)
+
+        self.assertEqual(MinuteLedger.objects.filter(account=pal, reason=MinuteLedger.VISIT_FULFILLED).count(), 5)
+        self.assertEqual(pal.member.current_minutes_available, 90 + 5 * 85)
+
+        # running again only completes what has since become eligible
+        self.assertEqual(sum(scheduling.complete_finished_fulfillments()), 1)
+        recently_finished.refresh_from_db()
+        self.assertTrue(recently_finished.completed)
+
+        for fulfillment in (in_progress, upcoming):
+            fulfillment.refresh_from_db()
+            self.assertFalse(fulfillment.completed)
+
+        self.assertEqual(sum(scheduling.complete_finished_fulfillments()), 0)
+        self.assertEqual(MinuteLedger.objects.filter(account=pal, reason=MinuteLedger.VISIT_FULFILLED).count(), 6)
+
 
 class CancelFulfillmentTest(TestCase):
     def test__validate_fulfillment_cancellation(self):
@@ -182,20 +356,24 @@ class CancelFulfillmentTest(TestCase):
         visit = scheduling.create_visit(member.member, utcnow() + timedelta(hours=1), 30, "sorting assorted sorts")
         fulfillment = scheduling.create_fulfillment(pal.pal, visit)
 
-        scheduling.validate_fulfillment_cancellation(fulfillment.pk)  # does not raise ValidationError
+        scheduling.validate_fulfillment_cancellation(pal.pal, fulfillment.pk)  # does not raise ValidationError
+
+        # fulfillment belongs to another pal
+        with self.assertRaises(ValidationError):
+            scheduling.validate_fulfillment_cancellation(member.pal, fulfillment.pk)
 
         # fulfillment already completed
         fulfillment.completed = True
         fulfillment.save()
         with self.assertRaises(ValidationError):
-            scheduling.validate_fulfillment_cancellation(fulfillment.pk)
+            scheduling.validate_fulfillment_cancellation(pal.pal, fulfillment.pk)
 
         # fulfillment cancelled
         fulfillment.completed = False
         fulfillment.cancelled = True
         fulfillment.save()
         with self.assertRaises(ValidationError):
-            scheduling.validate_fulfillment_cancellation(fulfillment.pk)
+            scheduling.validate_fulfillment_cancellation(pal.pal, fulfillment.pk)
 
         # visit already started
         fulfillment.completed = False
@@ -204,7 +382,7 @@ class CancelFulfillmentTest(TestCase):
         visit.when = utcnow() - timedelta(minutes=10)
         visit.save()
         with self.assertRaises(ValidationError):
-            scheduling.validate_fulfillment_cancellation(fulfillment.pk)
+            scheduling.validate_fulfillment_cancellation(pal.pal, fulfillment.pk)
 
     def test__cancel_fulfillment(self):
         member = new_user()
@@ -213,7 +391,10 @@ class CancelFulfillmentTest(TestCase):
         visit = scheduling.create_visit(member.member, utcnow() + timedelta(hours=1), 30, "sorting assorted sorts")
         fulfillment = scheduling.create_fulfillment(pal.pal, visit)
 
-        scheduling.cancel_fulfillment(fulfillment)
+        self.assertTrue(scheduling.cancel_fulfillment(fulfillment))
         fulfillment.refresh_from_db()
 
         self.assertTrue(fulfillment.cancelled)
+
+        # already cancelled
+        self.assertFalse(scheduling.cancel_fulfillment(fulfillment))
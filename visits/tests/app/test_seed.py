@@ -0,0 +1,41 @@
+from django.test import TestCase
+
+import visits.app.ledger as ledger
+import visits.app.seed as seed
+from visits.models import Fulfillment, MinuteLedger, MinuteRollup, Visit
+
+
+class SeedTest(TestCase):
+    def test__seed(self):
+        counts = seed.seed(5, 300, seed=1, batch_size=100)
+
+        self.assertEqual(counts["users"], 5)
+        self.assertEqual(counts["visits"], 300)
+        self.assertEqual(Visit.objects.count(), 300)
+        self.assertEqual(MinuteLedger.objects.count(), counts["ledger"])
+
+        # every state is represented
+        statuses = set(Visit.objects.values_list("status", flat=True))
+        self.assertEqual(statuses, {Visit.UNSCHEDULED, Visit.SCHEDULED, Visit.COMPLETED, Visit.CANCELLED})
+
+        # scheduled and completed visits have a fulfillment by someone else
+        for visit in Visit.objects.filter(status__in=[Visit.SCHEDULED, Visit.COMPLETED]):
+            fulfillment = visit.fulfillment_set.get()
+            self.assertNotEqual(fulfillment.pal.account_id, visit.member.account_id)
+            self.assertEqual(fulfillment.completed, visit.status == Visit.COMPLETED)
+
+        self.assertEqual(Fulfillment.objects.filter(completed=True).count(), Visit.objects.filter(status=Visit.COMPLETED).count())
+
+        # ledger entries keep their historical dates and the rollups agree
+        # with them
+        self.assertTrue(MinuteLedger.objects.filter(created__year__lt=seed.utcnow().year).exists())
+        rollups = set(MinuteRollup.objects.values_list("account_id", "month", "credits", "debits"))
+        ledger.rebuild()
+        self.assertEqual(rollups, set(MinuteRollup.objects.values_list("account_id", "month", "credits", "debits")))
+
+    def test__repeatable(self):
+        seed.seed(2, 20, seed=7)
+        seed.seed(2, 20, seed=7)
+        rows = list(Visit.objects.order_by("pk").values_list("minutes", "tasks", "status"))
+
+        self.assertEqual(rows[:20], rows[20:])
@@ -0,0 +1,132 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.admin import helpers
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import visits.app.plans as plans
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.models import Fulfillment, Member, MinuteLedger, Visit
+from visits.tests import new_user
+
+
+class AdminTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "swordfish"))
+
+
+class ChangelistTest(AdminTest):
+    MODELS = ["member", "pal", "visit", "fulfillment", "minuteledger", "planchange"]
+
+    def grow(self):
+        member = new_user(mins=1000)
+        pal = new_user()
+        visit = scheduling.create_visit(member.member, utcnow() - timedelta(days=1), 10, "do things")
+        scheduling.complete_fulfillment(scheduling.create_fulfillment(pal.pal, visit))
+        plans.change_members(Member.objects.filter(pk=member.member.pk), 60, plans.current_month() + timedelta(days=62))
+
+    def queries(self, model, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f"admin:visits_{model}_changelist"), data)
+            self.assertEqual(response.status_code, 200)
+
+        return len(queries.captured_queries)
+
+    def test__query_counts(self):
+        # Rows do not make queries of their own
+        self.grow()
+        counts = {model: self.queries(model) for model in self.MODELS}
+
+        for _ in range(5):
+            self.grow()
+
+        for model in self.MODELS:
+            with self.subTest(model):
+                self.assertEqual(self.queries(model), counts[model])
+
+    def test__search(self):
+        user = new_user()
+        response = self.client.get(reverse("admin:visits_member_changelist"), {"q": user.username})
+        self.assertContains(response, user.email)
+
+    @patch("visits.admin.ESTIMATED_COUNT_THRESHOLD", 1)
+    def test__estimated_count(self):
+        users = [new_user() for _ in range(3)]
+        Member.objects.filter(pk=users[0].member.pk).delete()
+
+        # The largest primary key stands in for the count of the whole table
+        response = self.client.get(reverse("admin:visits_member_changelist"))
+        self.assertEqual(response.context["cl"].result_count, users[-1].member.pk)
+
+        response = self.client.get(reverse("admin:visits_member_changelist"), {"q": users[1].username})
+        self.assertEqual(response.context["cl"].result_count, 1)
+
+
+class VisitAdminTest(AdminTest):
+    def test__cancel_visits(self):
+        member = new_user(mins=1000)
+        pal = new_user()
+        upcoming = [scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 10, "do things") for _ in range(3)]
+        completed = scheduling.create_visit(member.member, utcnow() - timedelta(days=1), 10, "do things")
+        scheduling.complete_fulfillment(scheduling.create_fulfillment(pal.pal, completed))
+        scheduling.create_fulfillment(pal.pal, upcoming[0])
+        started = scheduling.create_visit(member.member, utcnow() - timedelta(hours=1), 10, "do things")
+        scheduling.create_fulfillment(pal.pal, started)
+
+        url = reverse("admin:visits_visit_changelist")
+        response = self.client.post(url, {"action": "cancel_visits", "select_across": "1", helpers.ACTION_CHECKBOX_NAME: [upcoming[0].pk]})
+        self.assertRedirects(response, url)
+
+        # visits which have started or been completed are left alone, along
+        # with their members' debits and their pals' credits
+        self.assertEqual(Visit.objects.filter(status=Visit.CANCELLED).count(), 3)
+        self.assertEqual(Visit.objects.get(pk=completed.pk).status, Visit.COMPLETED)
+        self.assertFalse(Visit.objects.get(pk=started.pk).cancelled)
+        self.assertFalse(Fulfillment.objects.filter(visit=upcoming[0], cancelled=False).exists())
+        self.assertTrue(Fulfillment.objects.filter(visit=started, cancelled=False).exists())
+        self.assertEqual(MinuteLedger.objects.filter(cancelled=False).count(), 3)
+
+
+class FulfillmentAdminTest(AdminTest):
+    def test__complete_fulfillments(self):
+        member = new_user(mins=1000)
+        pal = new_user()
+        finished = [
+            scheduling.create_fulfillment(pal.pal, scheduling.create_visit(member.member, utcnow() - timedelta(days=1), 10, "do things"))
+            for _ in range(3)
+        ]
+        upcoming = scheduling.create_fulfillment(pal.pal, scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 10, "do things"))
+
+        url = reverse("admin:visits_fulfillment_changelist")
+        pks = [f.pk for f in finished[:2]] + [upcoming.pk]
+        response = self.client.post(url, {"action": "complete_fulfillments", helpers.ACTION_CHECKBOX_NAME: pks})
+        self.assertRedirects(response, url)
+
+        # visits which have not ended are not completed
+        self.assertEqual(set(Fulfillment.objects.filter(completed=True).values_list("pk", flat=True)), {f.pk for f in finished[:2]})
+        self.assertEqual(MinuteLedger.objects.filter(account=pal, reason=MinuteLedger.VISIT_FULFILLED).count(), 2)
+
+
+class MemberAdminTest(AdminTest):
+    def test__change_plan_minutes(self):
+        members = [new_user(mins=60).member for _ in range(3)]
+        url = reverse("admin:visits_member_changelist")
+        data = {"action": "change_plan_minutes", helpers.ACTION_CHECKBOX_NAME: [members[0].pk, members[1].pk]}
+
+        # asks for the new plan first
+        response = self.client.post(url, data)
+        self.assertContains(response, "Change the monthly plan minutes of 2 members")
+
+        response = self.client.post(url, {**data, "apply": "1", "plan_minutes": 90, "effective": plans.current_month()})
+        self.assertRedirects(response, url)
+        self.assertEqual(list(Member.objects.order_by("pk").values_list("plan_minutes", flat=True)), [90, 90, 60])
+
+        # every member, across pages
+        response = self.client.post(url, {**data, "select_across": "1", "apply": "1", "plan_minutes": 30, "effective": plans.current_month()})
+        self.assertRedirects(response, url)
+        self.assertEqual(set(Member.objects.values_list("plan_minutes", flat=True)), {30})
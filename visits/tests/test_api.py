@@ -0,0 +1,123 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+import visits.api as api
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.models import Visit
+from visits.tests import new_user
+
+
+class ApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test__authentication(self):
+        self.assertEqual(self.client.get(reverse("api-visits")).status_code, 401)
+
+    def test__visits(self):
+        member = new_user(mins=100)
+        self.client.force_login(member)
+
+        response = self.client.post(
+            reverse("api-visits"),
+            {"when": (utcnow() + timedelta(days=1)).isoformat(), "minutes": 30, "tasks": "do things"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        visit = Visit.objects.get(pk=response.json()["items"][0]["id"])
+
+        response = self.client.post(reverse("api-visits"), {"when": (utcnow() + timedelta(days=1)).isoformat(), "minutes": 300}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse("api-visits"))
+        self.assertEqual([v["id"] for v in response.json()["items"]], [visit.id])
+        self.assertIsNone(response.json()["next"])
+
+        response = self.client.get(reverse("api-balance"))
+        self.assertEqual(response.json()["minutes_available"], 70)
+
+        self.assertEqual(self.client.post(reverse("api-cancel-visit", args=[visit.id])).status_code, 204)
+        self.assertEqual(self.client.post(reverse("api-cancel-visit", args=[visit.id])).status_code, 400)
+
+    def test__fulfillments(self):
+        member = new_user(mins=100)
+        pal = new_user()
+        self.client.force_login(pal)
+
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 30, "do things")
+
+        response = self.client.get(reverse("api-available"))
+        self.assertEqual([v["id"] for v in response.json()["items"]], [visit.id])
+
+        response = self.client.post(reverse("api-accept-visit", args=[visit.id]))
+        self.assertEqual(response.status_code, 201)
+        fulfillment_id = response.json()["id"]
+
+        response = self.client.get(reverse("api-fulfillments"))
+        self.assertEqual([f["id"] for f in response.json()["items"]], [fulfillment_id])
+
+        self.assertEqual(self.client.post(reverse("api-complete-fulfillment", args=[fulfillment_id])).status_code, 400)
+        self.assertEqual(self.client.post(reverse("api-cancel-fulfillment", args=[fulfillment_id])).status_code, 204)
+        self.assertEqual(self.client.get(reverse("api-fulfillments")).json()["items"], [])
+
+    def test__etags(self):
+        member = new_user(mins=100)
+        pal = new_user()
+        self.client.force_login(member)
+
+        for name in ("api-visits", "api-balance"):
+            etag = self.client.get(reverse(name))["ETag"]
+
+            # answered without running the list query
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+        etags = {name: self.client.get(reverse(name))["ETag"] for name in ("api-visits", "api-balance")}
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 30, "do things")
+
+        for name, etag in etags.items():
+            self.assertEqual(self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # the member's visits change when a pal accepts one
+        etag = self.client.get(reverse("api-visits"))["ETag"]
+        scheduling.create_fulfillment(pal.pal, visit)
+        self.assertEqual(self.client.get(reverse("api-visits"), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.client.force_login(pal)
+
+        for name in ("api-fulfillments", "api-available"):
+            etag = self.client.get(reverse(name))["ETag"]
+            self.assertEqual(self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        etags = {name: self.client.get(reverse(name))["ETag"] for name in ("api-fulfillments", "api-available")}
+        scheduling.cancel_visit(visit)
+
+        for name, etag in etags.items():
+            self.assertEqual(self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test__available_events(self):
+        member = new_user(mins=100)
+        pal = new_user()
+
+        def get(**headers):
+            request = RequestFactory().get(reverse("api-available-events"), **headers)
+            request.user = pal
+            return api.available_events(request)
+
+        # a new connection starts from the latest event
+        response = get()
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        last_id = int(response.content.decode().split("id: ")[1].split()[0])
+
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 30, "do things")
+        scheduling.cancel_visit(visit)
+
+        body = get(HTTP_LAST_EVENT_ID=str(last_id)).content.decode()
+        self.assertIn("event: created\n", body)
+        self.assertIn("event: cancelled\n", body)
+        self.assertIn(f'"id": {visit.id}', body)
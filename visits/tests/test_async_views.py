@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, TestCase
+
+import visits.async_views as async_views
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.tests import new_user
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def request(self, user, path="/", data=None):
+        request = AsyncRequestFactory().get(path, data)
+        request.user = user
+        return request
+
+    async def test__login_required(self):
+        response = await async_views.list_visits(self.request(AnonymousUser()))
+        self.assertEqual(response.status_code, 302)
+
+    async def test__list_visits(self):
+        member = await sync_to_async(new_user)(mins=1000)
+        await sync_to_async(scheduling.create_visit)(member.member, utcnow() + timedelta(days=1), 10, "upcoming things")
+        await sync_to_async(scheduling.create_visit)(member.member, utcnow() - timedelta(days=1), 10, "past things")
+
+        response = await async_views.list_visits(self.request(member))
+        self.assertContains(response, "upcoming things")
+        self.assertNotContains(response, "past things")
+
+        response = await async_views.list_visits(self.request(member, data={"past": ""}))
+        self.assertContains(response, "past things")
+
+    async def test__list_fulfillments(self):
+        member = await sync_to_async(new_user)(mins=1000)
+        pal = await sync_to_async(new_user)()
+        visit = await sync_to_async(scheduling.create_visit)(member.member, utcnow() + timedelta(days=1), 10, "scheduled things")
+        await sync_to_async(scheduling.create_fulfillment)(pal.pal, visit)
+        await sync_to_async(scheduling.create_visit)(member.member, utcnow() + timedelta(days=1), 10, "available things")
+
+        response = await async_views.list_fulfillments(self.request(pal))
+        self.assertContains(response, "scheduled things")
+        self.assertContains(response, "available things")
+
+    async def test__request_visit(self):
+        member = await sync_to_async(new_user)(mins=120)
+
+        response = await async_views.request_visit(self.request(member))
+        self.assertContains(response, "<strong>120</strong>")
+
+    async def test__available_events(self):
+        member = await sync_to_async(new_user)(mins=1000)
+        pal = await sync_to_async(new_user)()
+
+        response = await async_views.available_events(self.request(pal))
+        stream = aiter(response.streaming_content)
+        self.assertIn(b"retry: ", await anext(stream))
+
+        visit = await sync_to_async(scheduling.create_visit)(member.member, utcnow() + timedelta(days=1), 10, "do things")
+
+        message = (await anext(stream)).decode()
+        self.assertIn("event: created\n", message)
+        self.assertIn(f'"id": {visit.id}', message)
+
+    async def test__export_ledger(self):
+        member = await sync_to_async(new_user)(mins=1000)
+        await sync_to_async(scheduling.create_visit)(member.member, utcnow() + timedelta(days=1), 10, "do things")
+
+        response = await async_views.export_ledger(self.request(member))
+        self.assertEqual(response.status_code, 302)
+
+        member.is_staff = True
+        response = await async_views.export_ledger(self.request(member, data={"format": "jsonl"}))
+        content = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn(member.email, content)
@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.middleware import QueryInstrumentationMiddleware, fingerprint
+from visits.models import Visit
+from visits.tests import new_user
+
+
+@override_settings(SQL_INSTRUMENTATION=True, SQL_LOG_QUERIES=100, SQL_LOG_MS=10000, SQL_LOG_DUPLICATES=100)
+class QueryInstrumentationMiddlewareTest(TestCase):
+    def run_middleware(self, view):
+        response = QueryInstrumentationMiddleware(view)(RequestFactory().get("/"))
+        return response
+
+    def metrics(self, response):
+        return dict(metric.split(";", 1) for metric in response.headers["Server-Timing"].split(", "))
+
+    @override_settings(SQL_INSTRUMENTATION=False)
+    def test__disabled(self):
+        self.client.force_login(new_user())
+        response = self.client.get(reverse("list-visits"))
+        self.assertFalse(response.has_header("Server-Timing"))
+
+    def test__server_timing(self):
+        self.client.force_login(new_user())
+        response = self.client.get(reverse("list-visits"))
+        metrics = self.metrics(response)
+
+        self.assertIn("sql", metrics)
+        self.assertIn("sql-duplicates", metrics)
+        self.assertIn("sql-slowest", metrics)
+        self.assertIn("total", metrics)
+
+    def test__duplicates(self):
+        def view(request):
+            for pk in range(4):
+                Visit.objects.filter(pk=pk).exists()
+            list(Visit.objects.filter(pk__in=[1, 2, 3]))
+            list(Visit.objects.filter(pk__in=[1, 2]))
+            return HttpResponse()
+
+        metrics = self.metrics(self.run_middleware(view))
+        self.assertIn('desc="6 queries"', metrics["sql"])
+        self.assertEqual('desc="4 queries"', metrics["sql-duplicates"])
+
+    def test__fingerprint(self):
+        self.assertEqual(fingerprint("SELECT 1 WHERE id IN (%s, %s, %s)"), fingerprint("SELECT 1 WHERE id IN (%s, %s)"))
+        self.assertNotEqual(fingerprint("SELECT 1 WHERE id = %s"), fingerprint("SELECT 2 WHERE id = %s"))
+
+    @override_settings(SQL_LOG_QUERIES=2)
+    def test__logs_expensive_requests(self):
+        member = new_user(mins=100)
+
+        def view(request):
+            scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 10, "do things")
+            return HttpResponse()
+
+        with self.assertLogs("visits.middleware", "WARNING") as logs:
+            self.run_middleware(view)
+
+        self.assertIn("Expensive request GET /", logs.output[0])
+        self.assertIn("visits.app.scheduling.create_visit", logs.records[0].sql_callers)
+
+    def test__below_thresholds(self):
+        with self.assertNoLogs("visits.middleware", "WARNING"):
+            self.run_middleware(lambda request: HttpResponse(Visit.objects.count()))
+
+    async def test__async(self):
+        async def view(request):
+            await Visit.objects.acount()
+            await sync_to_async(Visit.objects.count)()
+            return HttpResponse()
+
+        # The test database connection belongs to the main thread, so the
+        # middleware is set up there to wrap it
+        middleware = await sync_to_async(QueryInstrumentationMiddleware)(view)
+        metrics = self.metrics(await middleware(RequestFactory().get("/")))
+        self.assertIn('desc="2 queries"', metrics["sql"])
+        self.assertEqual('desc="1 queries"', metrics["sql-duplicates"])
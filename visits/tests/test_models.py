@@ -1,10 +1,11 @@
-from datetime import timedelta
+from datetime import date, datetime, time, timedelta, timezone
 
 from django.test import TestCase
 
+import visits.app.ledger as ledger
 import visits.app.scheduling as scheduling
 from visits.app.util import utcnow
-from visits.models import Member, MinuteLedger
+from visits.models import Member, MinuteLedger, Visit
 from visits.tests import new_user
 
 
@@ -62,3 +63,112 @@ class MemberTest(TestCase):
         # Cancel the visit. The minutes are returned to the member's balance.
         scheduling.cancel_visit(visit2)
         self.assertEqual(member.member.plan_minutes_remaining(when.month, when.year), 200)
+
+    def test__with_minutes_available(self):
+        now = utcnow()
+        last_month = now.replace(day=1) - timedelta(days=1)
+
+        member = new_user(mins=100)
+        pal = new_user(mins=100)
+        idle = new_user(mins=100)
+
+        # 150 minutes last month, 50 of which came out of banked minutes
+        old = scheduling.create_visit(member.member, last_month, 150, "do things")
+        MinuteLedger.objects.filter(visit=old).update(created=last_month)
+
+        # 30 minutes this month, plus 85 minutes earned
+        scheduling.create_visit(member.member, now, 30, "do things")
+        visit = scheduling.create_visit(pal.member, now - timedelta(hours=3), 100, "do things")
+        scheduling.complete_fulfillment(scheduling.create_fulfillment(member.pal, visit))
+
+        ledger.rebuild()
+
+        with self.assertNumQueries(1):
+            members = {m.pk: m for m in Member.objects.with_minutes_available(now.month, now.year)}
+
+        self.assertEqual(members[member.member.pk].remaining_plan_minutes, 70)
+        self.assertEqual(members[member.member.pk].available_minutes, 70 + 85 - 50)
+        self.assertEqual(members[pal.member.pk].remaining_plan_minutes, 0)
+        self.assertEqual(members[pal.member.pk].available_minutes, 0)
+        self.assertEqual(members[idle.member.pk].remaining_plan_minutes, 100)
+        self.assertEqual(members[idle.member.pk].available_minutes, 100)
+
+        for user in (member, pal, idle):
+            annotated = members[user.member.pk]
+            self.assertEqual(user.member.minutes_available(now.month, now.year), annotated.available_minutes)
+            self.assertEqual(user.member.plan_minutes_remaining(now.month, now.year), annotated.remaining_plan_minutes)
+
+        # Last month's plan is fully used, but banked minutes still count
+        last = Member.objects.with_minutes_available(last_month.month, last_month.year).get(pk=member.member.pk)
+        self.assertEqual(last.remaining_plan_minutes, 0)
+        self.assertEqual(last.available_minutes, 85 - 50)
+
+
+class VisitTest(TestCase):
+    def test__status(self):
+        member = new_user(mins=300)
+        pal = new_user()
+
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(hours=1), 30, "do things")
+        self.assertEqual(visit.status, Visit.UNSCHEDULED)
+
+        fulfillment = scheduling.create_fulfillment(pal.pal, visit)
+        visit.refresh_from_db()
+        self.assertEqual(visit.status, Visit.SCHEDULED)
+
+        scheduling.cancel_fulfillment(fulfillment)
+        visit.refresh_from_db()
+        self.assertEqual(visit.status, Visit.UNSCHEDULED)
+
+        fulfillment = scheduling.create_fulfillment(pal.pal, visit)
+        Visit.objects.filter(pk=visit.pk).update(when=utcnow() - timedelta(hours=1))
+        scheduling.complete_fulfillment(scheduling.validate_fulfillment_completion(pal.pal, fulfillment.pk))
+        visit.refresh_from_db()
+        self.assertEqual(visit.status, Visit.COMPLETED)
+
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(hours=1), 30, "do things")
+        scheduling.cancel_visit(visit)
+        visit.refresh_from_db()
+        self.assertEqual(visit.status, Visit.CANCELLED)
+
+    def test__unscheduled(self):
+        member = new_user(mins=300)
+
+        visit = scheduling.create_visit(member.member, utcnow() + timedelta(hours=1), 30, "do things")
+        scheduling.create_visit(member.member, utcnow() - timedelta(hours=1), 30, "do things")
+        scheduling.cancel_visit(scheduling.create_visit(member.member, utcnow() + timedelta(hours=1), 30, "do things"))
+        scheduling.create_fulfillment(new_user().pal, scheduling.create_visit(member.member, utcnow() + timedelta(hours=1), 30, "do things"))
+
+        # several cancelled fulfillments do not produce duplicate rows
+        for _ in range(3):
+            scheduling.cancel_fulfillment(scheduling.create_fulfillment(new_user().pal, visit))
+
+        self.assertEqual(list(Visit.objects.unscheduled()), [visit])
+
+    def test__matching(self):
+        member = new_user(mins=1000)
+
+        def visit(when, minutes=30):
+            return scheduling.create_visit(member.member, when, minutes, "do things")
+
+        # Monday 2030-01-07 through Sunday 2030-01-13
+        monday_morning = visit(datetime(2030, 1, 7, 9, 0, tzinfo=timezone.utc))
+        monday_night = visit(datetime(2030, 1, 7, 23, 0, tzinfo=timezone.utc), 90)
+        wednesday_noon = visit(datetime(2030, 1, 9, 12, 0, tzinfo=timezone.utc), 60)
+        sunday_early = visit(datetime(2030, 1, 13, 5, 0, tzinfo=timezone.utc))
+        everything = {monday_morning, monday_night, wednesday_noon, sunday_early}
+
+        def matching(**kwargs):
+            return set(Visit.objects.unscheduled().matching(**kwargs))
+
+        self.assertEqual(matching(), everything)
+        self.assertEqual(matching(start=date(2030, 1, 8)), {wednesday_noon, sunday_early})
+        self.assertEqual(matching(end=date(2030, 1, 7)), {monday_morning, monday_night})
+        self.assertEqual(matching(start=date(2030, 1, 9), end=date(2030, 1, 9)), {wednesday_noon})
+        self.assertEqual(matching(earliest=time(8, 0), latest=time(12, 0)), {monday_morning, wednesday_noon})
+        self.assertEqual(matching(earliest=time(22, 0), latest=time(6, 0)), {monday_night, sunday_early})
+        self.assertEqual(matching(weekdays=[1]), {monday_morning, monday_night})
+        self.assertEqual(matching(weekdays=[3, 7]), {wednesday_noon, sunday_early})
+        self.assertEqual(matching(min_minutes=60), {monday_night, wednesday_noon})
+        self.assertEqual(matching(min_minutes=45, max_minutes=75), {wednesday_noon})
+        self.assertEqual(matching(weekdays=[1], min_minutes=60), {monday_night})
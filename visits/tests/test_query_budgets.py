@@ -0,0 +1,234 @@
+import json
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import visits.api as api
+import visits.app.scheduling as scheduling
+from visits.app.util import first_day_of_month, utcnow
+from visits.models import Visit, VisitSeries
+from visits.tests import new_user
+
+
+SCALES = (1, 10, 100)
+SERIES_OCCURRENCES = 4
+
+# The most queries each view and scheduling function may make. Each is
+# measured once the acting member (who is also a pal) has 1, 10 and 100 rows
+# of every kind, and must make the same number of queries at every scale, so
+# per-row queries (N+1 patterns) fail here even when they fit the budget.
+# Functions acting on a set of rows are given as many rows as the scale,
+# except that series are of a fixed length within one month:
+# validate_new_series makes one balance query per month the series touches.
+BUDGETS = {
+    # HTML views
+    "index": 2,
+    "register": 2,
+    "request-visit": 5,
+    "request-visit POST": 17,
+    "list-visits": 5,
+    "list-visits past": 7,
+    "cancel-visit": 22,
+    "cancel-series": 20,
+    "list-fulfillments": 7,
+    "schedule-fulfillment": 10,
+    "complete-fulfillment": 13,
+    "cancel-fulfillment": 9,
+
+    # JSON API
+    "api-balance": 6,
+    "api-visits": 4,
+    "api-visits POST": 17,
+    "api-cancel-visit": 22,
+    "api-available": 4,
+    "api-available-events": 1,
+    "api-accept-visit": 10,
+    "api-fulfillments": 4,
+    "api-complete-fulfillment": 13,
+    "api-cancel-fulfillment": 9,
+
+    # visits.app.scheduling
+    "validate_new_visit": 1,
+    "create_visit": 9,
+    "book_visit": 13,
+    "validate_member_visit_cancellation": 1,
+    "cancel_visit": 18,
+    "cancel_visits": 15,
+    "validate_new_series": 1,
+    "create_series": 11,
+    "book_series": 15,
+    "validate_member_series_cancellation": 2,
+    "cancel_series": 15,
+    "validate_new_fulfillment": 2,
+    "create_fulfillment": 5,
+    "validate_fulfillment_completion": 1,
+    "complete_fulfillment": 9,
+    "complete_finished_fulfillments": 13,
+    "validate_fulfillment_cancellation": 1,
+    "cancel_fulfillment": 5,
+}
+
+
+class QueryBudgetTest(TestCase):
+    """Checks every view and scheduling function against its entry in
+    BUDGETS.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = new_user(mins=10 ** 6)
+        self.other = new_user(mins=10 ** 6)
+        self.member = self.user.member
+        self.pal = self.user.pal
+        self.client.force_login(self.user)
+        self.rows = 0
+        self.offset = 0
+
+    def when(self, days):
+        # Distinct times, so that no two visits coincide
+        self.offset += 1
+        return utcnow() + timedelta(days=days, minutes=self.offset)
+
+    def upcoming(self, member=None):
+        return scheduling.create_visit(member or self.member, self.when(1), 30, "do things")
+
+    def past(self, member=None):
+        return scheduling.create_visit(member or self.member, self.when(-2), 30, "do things")
+
+    def grow(self, rows):
+        """Adds rows of each kind until there are the requested number.
+        """
+        for _ in range(rows - self.rows):
+            # The member's visits, in every state
+            self.upcoming()
+            scheduling.create_fulfillment(self.other.pal, self.upcoming())
+            scheduling.complete_fulfillment(scheduling.create_fulfillment(self.other.pal, self.past()))
+            scheduling.cancel_visit(self.upcoming())
+            scheduling.create_series(self.member, self.when(2), 30, "do things", VisitSeries.WEEKLY, 2)
+
+            # The pal's fulfillments, and the visits available to them
+            self.upcoming(self.other.member)
+            scheduling.create_fulfillment(self.pal, self.upcoming(self.other.member))
+            scheduling.complete_fulfillment(scheduling.create_fulfillment(self.pal, self.past(self.other.member)))
+
+        self.rows = rows
+
+    def finished(self):
+        return scheduling.create_fulfillment(self.pal, self.past(self.other.member))
+
+    def scheduled(self):
+        return scheduling.create_fulfillment(self.pal, self.upcoming(self.other.member))
+
+    def series(self):
+        return scheduling.create_series(self.member, self.when(3), 30, "do things", VisitSeries.WEEKLY, 2)
+
+    def get(self, name, data=None):
+        return lambda: self.client.get(reverse(name), data)
+
+    def post(self, name, data=None, args=None):
+        return lambda: self.client.post(reverse(name, args=args), data)
+
+    def json(self, name, data):
+        return lambda: self.client.post(reverse(name), json.dumps(data), content_type="application/json")
+
+    def available_events(self):
+        # Called directly, since under ASGI the URL serves a stream which
+        # stays open
+        request = RequestFactory().get(reverse("api-available-events"), {"after": 0})
+        request.user = self.user
+        return api.available_events(request)
+
+    def cases(self):
+        """Returns the function to measure for each entry in BUDGETS. Each is
+        called with the data it acts upon already prepared.
+        """
+        when = self.when(4).replace(second=0, microsecond=0)
+
+        # The start of the month after next, so that series fall in a single
+        # month whatever the date
+        later = utcnow().replace(day=1) + timedelta(days=62)
+        series_when = first_day_of_month(later.month, later.year) + timedelta(hours=12)
+
+        return {
+            "index": lambda: self.get("index"),
+            "register": lambda: self.get("register"),
+            "request-visit": lambda: self.get("request-visit"),
+            "request-visit POST": lambda: self.post("request-visit", {"when": self.when(4).replace(second=0, microsecond=0).isoformat(), "minutes": 30, "tasks": "do things"}),
+            "list-visits": lambda: self.get("list-visits"),
+            "list-visits past": lambda: self.get("list-visits", {"past": ""}),
+            "cancel-visit": lambda: self.post("cancel-visit", {"visit_id": self.upcoming().id}),
+            "cancel-series": lambda: self.post("cancel-series", {"series_id": self.series().id}),
+            "list-fulfillments": lambda: self.get("list-fulfillments"),
+            "schedule-fulfillment": lambda: self.post("schedule-fulfillment", {"visit_id": self.upcoming(self.other.member).id}),
+            "complete-fulfillment": lambda: self.post("complete-fulfillment", {"fulfillment_id": self.finished().id}),
+            "cancel-fulfillment": lambda: self.post("cancel-fulfillment", {"fulfillment_id": self.scheduled().id}),
+
+            "api-balance": lambda: self.get("api-balance"),
+            "api-visits": lambda: self.get("api-visits"),
+            "api-visits POST": lambda: self.json("api-visits", {"when": self.when(4).replace(second=0, microsecond=0).isoformat(), "minutes": 30, "tasks": "do things"}),
+            "api-cancel-visit": lambda: self.post("api-cancel-visit", args=[self.upcoming().id]),
+            "api-available": lambda: self.get("api-available"),
+            "api-available-events": lambda: self.available_events,
+            "api-accept-visit": lambda: self.post("api-accept-visit", args=[self.upcoming(self.other.member).id]),
+            "api-fulfillments": lambda: self.get("api-fulfillments"),
+            "api-complete-fulfillment": lambda: self.post("api-complete-fulfillment", args=[self.finished().id]),
+            "api-cancel-fulfillment": lambda: self.post("api-cancel-fulfillment", args=[self.scheduled().id]),
+
+            "validate_new_visit": lambda: lambda: scheduling.validate_new_visit(self.member, when, 30),
+            "create_visit": lambda: lambda: scheduling.create_visit(self.member, when, 30, "do things"),
+            "book_visit": lambda: lambda: scheduling.book_visit(self.member, when, 30, "do things"),
+            "validate_member_visit_cancellation": self.prepare(self.upcoming, lambda v: scheduling.validate_member_visit_cancellation(self.member, v.id)),
+            "cancel_visit": self.prepare(self.upcoming, scheduling.cancel_visit),
+            "cancel_visits": self.prepare(
+                lambda: Visit.objects.filter(pk__in=[self.upcoming().pk for _ in range(self.rows)]),
+                scheduling.cancel_visits,
+            ),
+            "validate_new_series": lambda: lambda: scheduling.validate_new_series(self.member, series_when, 30, VisitSeries.WEEKLY, SERIES_OCCURRENCES),
+            "create_series": lambda: lambda: scheduling.create_series(self.member, series_when, 30, "do things", VisitSeries.WEEKLY, SERIES_OCCURRENCES),
+            "book_series": lambda: lambda: scheduling.book_series(self.member, series_when, 30, "do things", VisitSeries.WEEKLY, SERIES_OCCURRENCES),
+            "validate_member_series_cancellation": self.prepare(self.series, lambda s: scheduling.validate_member_series_cancellation(self.member, s.id)),
+            "cancel_series": self.prepare(self.series, scheduling.cancel_series),
+            "validate_new_fulfillment": self.prepare(lambda: self.upcoming(self.other.member), lambda v: scheduling.validate_new_fulfillment(self.pal, v.id)),
+            "create_fulfillment": self.prepare(lambda: self.upcoming(self.other.member), lambda v: scheduling.create_fulfillment(self.pal, v)),
+            "validate_fulfillment_completion": self.prepare(self.finished, lambda f: scheduling.validate_fulfillment_completion(self.pal, f.id)),
+            "complete_fulfillment": self.prepare(self.finished, scheduling.complete_fulfillment),
+            "complete_finished_fulfillments": self.prepare(
+                lambda: [self.finished() for _ in range(self.rows)],
+                lambda _: list(scheduling.complete_finished_fulfillments()),
+            ),
+            "validate_fulfillment_cancellation": self.prepare(self.scheduled, lambda f: scheduling.validate_fulfillment_cancellation(self.pal, f.id)),
+            "cancel_fulfillment": self.prepare(self.scheduled, scheduling.cancel_fulfillment),
+        }
+
+    def prepare(self, setup, function):
+        def prepared():
+            arg = setup()
+            return lambda: function(arg)
+
+        return prepared
+
+    def test__budgets(self):
+        cases = self.cases()
+        self.assertEqual(set(cases), set(BUDGETS))
+
+        counts = {name: [] for name in BUDGETS}
+
+        for rows in SCALES:
+            self.grow(rows)
+
+            for name, prepare in cases.items():
+                function = prepare()
+                cache.clear()
+
+                with CaptureQueriesContext(connection) as queries:
+                    function()
+
+                counts[name].append(len(queries.captured_queries))
+
+        for name, budget in BUDGETS.items():
+            with self.subTest(name):
+                self.assertEqual(len(set(counts[name])), 1, f"{name} makes {counts[name]} queries at {SCALES} rows")
+                self.assertLessEqual(counts[name][0], budget, f"{name} makes {counts[name][0]} queries; its budget is {budget}")
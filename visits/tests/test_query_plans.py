@@ -0,0 +1,100 @@
+import re
+from datetime import time, timedelta
+from unittest import skipUnless
+
+from django.db import connection
+from django.db.models.functions import Now
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+import visits.app.exports as exports
+import visits.app.reports as reports
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.models import Member, Visit, VisitSeries, Fulfillment, MinuteLedger, MinuteRollup
+from visits.tests import new_user
+
+
+@skipUnless(connection.vendor == "sqlite", "query plans are checked using sqlite's EXPLAIN QUERY PLAN")
+class QueryPlanTest(TestCase):
+    """Runs EXPLAIN on the queries made by visits.models, visits.views, and
+    visits.app.scheduling, failing if any of them scans an entire table
+    rather than searching an index.
+    """
+    # sqlite reports a full table scan as "SCAN <table>", without naming an
+    # index
+    FULL_SCAN = re.compile(r"\bSCAN (\w+)$")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = new_user(mins=1000)
+        cls.pal = new_user(mins=1000)
+
+        for i in range(5):
+            scheduling.create_visit(cls.member.member, utcnow() + timedelta(days=i + 1), 10, "do things")
+            visit = scheduling.create_visit(cls.member.member, utcnow() - timedelta(days=i + 1), 10, "do things")
+            scheduling.complete_fulfillment(scheduling.create_fulfillment(cls.pal.pal, visit))
+
+        cls.series = scheduling.create_series(cls.member.member, utcnow() + timedelta(days=1), 10, "do things", VisitSeries.WEEKLY, 3)
+        cls.visit = Visit.objects.unscheduled().first()
+        scheduling.create_fulfillment(cls.pal.pal, cls.visit)
+
+    def assertSearchesIndexes(self, queryset):
+        plan = queryset.explain()
+
+        for line in plan.splitlines():
+            self.assertIsNone(self.FULL_SCAN.search(line), f"Full table scan:\n{plan}\n\n{queryset.query}")
+
+    def test__member_queries(self):
+        now = utcnow()
+        self.assertSearchesIndexes(Member.objects.with_minutes_available(now.month, now.year).filter(pk=self.member.member.pk))
+        self.assertSearchesIndexes(Member.objects.filter(account_id__in=[self.member.pk, self.pal.pk]))  # ledger.lock
+        self.assertSearchesIndexes(MinuteRollup.objects.filter(account=self.member, month=now.date().replace(day=1)))
+
+    def test__visit_queries(self):
+        self.assertSearchesIndexes(Visit.objects.pending())
+        self.assertSearchesIndexes(
+            Visit.objects.unscheduled()
+            .matching(start=utcnow().date(), end=utcnow().date() + timedelta(days=7), earliest=time(9), latest=time(17), weekdays=[1, 2], min_minutes=30)
+            .order_by("when", "id")
+        )
+        self.assertSearchesIndexes(Visit.objects.unscheduled().exclude(member=self.pal.member).order_by("when", "id"))
+        self.assertSearchesIndexes(self.member.member.visit_set.filter(cancelled=False, when__gte=utcnow()).order_by("when", "id"))
+        self.assertSearchesIndexes(self.member.member.visit_set.filter(cancelled=False, when__lt=utcnow()).order_by("-when", "-id"))
+        self.assertSearchesIndexes(Fulfillment.objects.filter(visit__in=[self.visit.pk], cancelled=False))  # with_active_fulfillment
+        self.assertSearchesIndexes(self.series.visit_set.filter(cancelled=False, when__gt=Now()))
+
+    def test__fulfillment_queries(self):
+        self.assertSearchesIndexes(self.pal.pal.fulfillment_set.select_related("visit").order_by("visit__when").filter(completed=False, cancelled=False))
+        self.assertSearchesIndexes(self.visit.fulfillment_set.filter(cancelled=False))
+        self.assertSearchesIndexes(self.pal.pal.fulfillment_set.select_related("visit", "pal__account").filter(pk=1))
+        self.assertSearchesIndexes(
+            Fulfillment.objects.select_related("visit", "pal")
+            .filter(completed=False, cancelled=False, visit__cancelled=False, visit__when__lte=utcnow(), pk__gt=0)
+            .order_by("pk")[:500]
+        )  # complete_finished_fulfillments
+
+    def test__ledger_queries(self):
+        self.assertSearchesIndexes(MinuteLedger.objects.filter(visit__in=[self.visit.pk], cancelled=False))  # ledger.cancel
+        self.assertSearchesIndexes(MinuteLedger.objects.filter(account_id__in=[self.member.pk], cancelled=False))  # ledger.rebuild
+
+        start, end = exports.month_range(utcnow().month, utcnow().year)
+        self.assertSearchesIndexes(
+            MinuteLedger.objects.select_related("account", "visit")
+            .filter(created__gte=start, created__lt=end)
+            .order_by("created", "id")[:100]
+        )  # exports.ledger_chunks
+
+    def test__report_queries(self):
+        month = reports.current_month()
+
+        with CaptureQueriesContext(connection) as queries:
+            reports.compute(month, reports.next_month(month))
+
+        for query in queries.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                plan = "\n".join(row[-1] for row in cursor.fetchall())
+
+            for line in plan.splitlines():
+                self.assertIsNone(self.FULL_SCAN.search(line), f"Full table scan:\n{plan}\n\n{query['sql']}")
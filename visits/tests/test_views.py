@@ -0,0 +1,155 @@
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+
+from django.db import connection
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import visits.app.scheduling as scheduling
+from visits.app.util import utcnow
+from visits.tests import new_user
+
+
+class ListVisitsTest(TestCase):
+    def queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("list-visits"))
+            self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test__list_visits_query_count(self):
+        member = new_user(mins=1000)
+        pal = new_user()
+        self.client.force_login(member)
+
+        def add_visits():
+            scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 10, "do things")
+            scheduling.create_fulfillment(pal.pal, scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 10, "do things"))
+            visit = scheduling.create_visit(member.member, utcnow() - timedelta(days=1), 10, "do things")
+            scheduling.complete_fulfillment(scheduling.create_fulfillment(pal.pal, visit))
+
+        add_visits()
+        expected = self.queries()
+
+        for _ in range(5):
+            add_visits()
+
+        self.assertEqual(self.queries(), expected)
+
+    def test__list_visits_sections(self):
+        member = new_user(mins=1000)
+        self.client.force_login(member)
+
+        upcoming = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 10, "upcoming things")
+        past = scheduling.create_visit(member.member, utcnow() - timedelta(days=1), 10, "past things")
+
+        response = self.client.get(reverse("list-visits"))
+        self.assertEqual([row.visit for row in response.context["upcoming_visits"]], [upcoming])
+        self.assertIsNone(response.context["past"])
+
+        response = self.client.get(reverse("list-visits"), {"past": ""})
+        self.assertEqual([row.visit for row in response.context["past_visits"]], [past])
+
+    def test__list_visits_actions(self):
+        member = new_user(mins=1000)
+        self.client.force_login(member)
+
+        visits = [scheduling.create_visit(member.member, utcnow() + timedelta(days=i + 1), 10, "do things") for i in range(3)]
+
+        # every row's buttons share the page's one form
+        response = self.client.get(reverse("list-visits"))
+        self.assertContains(response, "csrfmiddlewaretoken", count=1)
+        self.assertContains(response, 'form="visit-actions"', count=3)
+
+        self.client.post(reverse("cancel-visit"), {"visit_id": visits[0].id})
+        visits[0].refresh_from_db()
+        self.assertTrue(visits[0].cancelled)
+
+    def test__cancel_series_invalid(self):
+        member = new_user()
+        self.client.force_login(member)
+
+        for data in [{"series_id": "abc"}, {}]:
+            response = self.client.post(reverse("cancel-series"), data)
+            self.assertRedirects(response, reverse("list-visits"), fetch_redirect_response=False)
+
+
+class ListFulfillmentsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test__list_fulfillments_filters(self):
+        member = new_user(mins=1000)
+        pal = new_user()
+        self.client.force_login(pal)
+
+        short = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 20, "do things")
+        long = scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 90, "do things")
+        scheduling.create_visit(pal.member, utcnow() + timedelta(days=1), 90, "the pal's own visit")
+
+        response = self.client.get(reverse("list-fulfillments"))
+        self.assertEqual(set(response.context["available"]), {short, long})
+
+        response = self.client.get(reverse("list-fulfillments"), {"min_minutes": 60})
+        self.assertEqual(list(response.context["available"]), [long])
+        self.assertEqual(response.context["filter_params"], "min_minutes=60")
+
+    def test__invalid_cursors(self):
+        member = new_user(mins=1000)
+        pal = new_user()
+        self.client.force_login(pal)
+        scheduling.create_visit(member.member, utcnow() + timedelta(days=1), 20, "do things")
+
+        # Cursors come from the client; those which do not decode, or hold a
+        # time without a timezone, show the first page
+        cursors = [
+            "garbage",
+            urlsafe_b64encode(b"\xff\xfe").decode(),
+            urlsafe_b64encode(b"2030-01-01T00:00:00|5").decode(),
+        ]
+
+        for url in (reverse("list-fulfillments"), reverse("api-available")):
+            for cursor in cursors:
+                with self.subTest(url=url, cursor=cursor):
+                    response = self.client.get(url, {"after": cursor})
+                    self.assertContains(response, "do things")
+
+
+class ExportLedgerTest(TestCase):
+    def setUp(self):
+        self.user = new_user(mins=1000)
+        scheduling.create_visit(self.user.member, utcnow() + timedelta(days=1), 10, "do things")
+
+    def test__staff_only(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("ledger-export"))
+        self.assertEqual(response.status_code, 302)
+
+    def test__export(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse("ledger-export"), {"month": f"{utcnow():%Y-%m}", "format": "jsonl"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertIn(f"ledger-{utcnow():%Y-%m}.jsonl", response["Content-Disposition"])
+        self.assertIn(self.user.email, b"".join(response).decode())
+
+        for params in ({"month": "2024-13"}, {"month": "0000-01"}, {"month": "9999-12"}, {"end": "9999-12-31"}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse("ledger-export"), params)
+                self.assertEqual(response.status_code, 400)
+
+
+class MonthlyReportsTest(TestCase):
+    def test__staff_only(self):
+        user = new_user()
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse("monthly-reports")).status_code, 302)
+
+        user.is_staff = True
+        user.save()
+        self.assertContains(self.client.get(reverse("monthly-reports")), f"{utcnow():%Y-%m}")
@@ -1,19 +1,39 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import api, views, async_views
+
+# The read-heavy views have async versions for use under ASGI
+reads = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     path("", views.index, name="index"),
     path("register", views.register, name="register"),
 
     # Member views
-    path("request-visit", views.request_visit, name="request-visit"),
-    path("list-visits", views.list_visits, name="list-visits"),
+    path("request-visit", reads.request_visit, name="request-visit"),
+    path("list-visits", reads.list_visits, name="list-visits"),
     path("cancel-visit", views.cancel_visit, name="cancel-visit"),
+    path("cancel-series", views.cancel_series, name="cancel-series"),
 
     # Pal views
-    path("list-fulfillments", views.list_fulfillments, name="list-fulfillments"),
+    path("list-fulfillments", reads.list_fulfillments, name="list-fulfillments"),
     path("schedule-fulfillment", views.schedule_fulfillment, name="schedule-fulfillment"),
     path("complete-fulfillment", views.complete_fulfillment, name="complete-fulfillment"),
     path("cancel-fulfillment", views.cancel_fulfillment, name="cancel-fulfillment"),
+
+    # Staff views
+    path("export/ledger", reads.export_ledger, name="ledger-export"),
+    path("reports/monthly", views.monthly_reports, name="monthly-reports"),
+
+    # JSON API
+    path("api/v1/balance", api.balance, name="api-balance"),
+    path("api/v1/visits", api.visits, name="api-visits"),
+    path("api/v1/visits/<int:visit_id>/cancel", api.cancel_visit, name="api-cancel-visit"),
+    path("api/v1/available", api.available, name="api-available"),
+    path("api/v1/available/events", (async_views if settings.ASYNC_VIEWS else api).available_events, name="api-available-events"),
+    path("api/v1/available/<int:visit_id>/accept", api.accept_visit, name="api-accept-visit"),
+    path("api/v1/fulfillments", api.fulfillments, name="api-fulfillments"),
+    path("api/v1/fulfillments/<int:fulfillment_id>/complete", api.complete_fulfillment, name="api-complete-fulfillment"),
+    path("api/v1/fulfillments/<int:fulfillment_id>/cancel", api.cancel_fulfillment, name="api-cancel-fulfillment"),
 ]
@@ -1,14 +1,93 @@
+from collections import namedtuple
+
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render, redirect
 
-from .models import Visit
+import visits.app.balances as balances
+import visits.app.events as events
+import visits.app.exports as exports
+import visits.app.marketplace as marketplace
+import visits.app.pagination as pagination
+import visits.app.reports as reports
+from visits.app.util import utcnow
+from .models import Fulfillment, Visit
 from .forms import UserRegistrationForm,\
     MemberVisitRequestForm, \
     CancelRequestedVisitForm, \
+    CancelVisitSeriesForm, \
     AcceptVisitForm, \
+    AvailableVisitsFilterForm, \
     CompleteFulfillmentForm, \
-    CancelFulfillmentForm
+    CancelFulfillmentForm, \
+    LedgerExportForm
+
+
+# Rows of the list pages, with each row's state and available actions worked
+# out once in the view. The row actions are plain buttons submitting the
+# page's single actions form, rather than a Form instance per row.
+VisitRow = namedtuple("VisitRow", ["visit", "state", "cancellable", "series_cancellable"])
+FulfillmentRow = namedtuple("FulfillmentRow", ["fulfillment", "completable", "cancellable"])
+
+
+def visit_rows(visits):
+    rows = []
+
+    for visit in visits:
+        state = visit.str_state
+        started = visit.has_started
+        rows.append(VisitRow(visit, state, state != "completed" and not started, bool(visit.series_id) and not started))
+
+    return rows
+
+
+def fulfillment_rows(fulfillments):
+    return [FulfillmentRow(f, f.is_ready_to_complete, f.is_cancellable) for f in fulfillments]
+
+
+# The queries behind the list pages, shared with their asynchronous versions
+# in visits.async_views.
+def member_visits(member):
+    return Visit.objects.filter(member=member, cancelled=False).with_active_fulfillment()
+
+
+def active_fulfillments(pal):
+    return Fulfillment.objects.select_related("visit").order_by("visit__when").filter(pal=pal, completed=False, cancelled=False)
+
+
+def available_visits(member, filters, cursor):
+    """Returns the Page of Visits available to the member, served from the
+    shared marketplace snapshot unless filtered.
+    """
+    if filters.is_valid() and filters.is_filtered():
+        return pagination.paginate(filters.filter(Visit.objects.unscheduled().exclude(member=member)), cursor)
+
+    return marketplace.available(member, cursor)
+
+
+def list_visits_context(upcoming, past):
+    return {
+        "upcoming": upcoming,
+        "upcoming_visits": visit_rows(upcoming),
+        "past": past,
+        "past_visits": visit_rows(past) if past else [],
+    }
+
+
+def list_fulfillments_context(request, fulfillments, filters, available, last_event):
+    # Keep the filters when following the link to the next page
+    params = request.GET.copy()
+    params.pop("after", None)
+
+    return {
+        "fulfillments": fulfillment_rows(fulfillments),
+        "available": available,
+        "filters": filters,
+        "filter_params": params.urlencode(),
+        "last_event": last_event,
+    }
 
 
 def index(request):
@@ -43,25 +122,35 @@ def request_visit(request):
 
     if request.method == "POST":
         form = MemberVisitRequestForm(request.user, request.POST)
-        if form.is_valid():
-            form.save()
+        if form.is_valid() and form.save():
             return redirect("list-visits")
 
+    plan_minutes_remaining, minutes_available = balances.current(request.user.member)
+
     return render(request, "request-visit.html", {
         "form": form,
+        "plan_minutes_remaining": plan_minutes_remaining,
+        "minutes_available": minutes_available,
     })
 
 
 @login_required
 def list_visits(request):
-    """Displays the list of visits.
+    """Displays the list of visits, split into upcoming visits (soonest first)
+    and past visits (most recent first), each paginated by its own cursor. Past
+    visits are only selected once requested by the "past" parameter, so the
+    default page only touches the member's upcoming visits.
     """
-    query = request.user.member.visit_set.order_by("-when").filter(cancelled=False)
-    visits = [(v, CancelRequestedVisitForm(request.user, initial={"visit_id": v.id})) for v in query.all()]
+    query = member_visits(request.user.member)
+    now = utcnow()
 
-    return render(request, "list-visits.html", {
-        "visits": visits,
-    })
+    upcoming = pagination.paginate(query.filter(when__gte=now), request.GET.get("upcoming"))
+    past = None
+
+    if "past" in request.GET:
+        past = pagination.paginate(query.filter(when__lt=now), request.GET.get("past"), descending=True)
+
+    return render(request, "list-visits.html", list_visits_context(upcoming, past))
 
 
 @login_required
@@ -78,6 +167,20 @@ def cancel_visit(request):
     return redirect("list-visits")
 
 
+@login_required
+def cancel_series(request):
+    """list_views displays a form to cancel the remaining visits in a series
+    of visits requested by the member. This endpoint handles the POST from
+    that form.
+    """
+    if request.method == "POST":
+        form = CancelVisitSeriesForm(request.user, request.POST)
+        if form.is_valid():
+            form.save()
+
+    return redirect("list-visits")
+
+
 @login_required
 def list_fulfillments(request):
     """Displays two lists. The first is of the Pal's active Fulfillments - that
@@ -86,25 +189,17 @@ def list_fulfillments(request):
 
     The Pal is able to cancel their commitments to future appointments, accept
     new appointments, and complete Visits which they have finished.
+
+    The list of available Visits may be filtered by the fields of
+    AvailableVisitsFilterForm and is paginated by the "after" cursor. When it
+    is not filtered, it is served from the shared marketplace snapshot.
     """
-    fulfillments = [
-        (
-            f,
-            CompleteFulfillmentForm(request.user, initial={"fulfillment_id": f.id}),
-            CancelFulfillmentForm(request.user, initial={"fulfillment_id": f.id})
-        )
-        for f in request.user.pal.fulfillment_set.order_by("visit__when").filter(completed=False, cancelled=False).all()
-    ]
-
-    visits = [
-        (v, AcceptVisitForm(request.user, initial={"visit_id": v.id}))
-        for v in Visit.objects.unscheduled().exclude(member=request.user.member).order_by("when").all()
-    ]
-
-    return render(request, "list-fulfillments.html", {
-        "fulfillments": fulfillments,
-        "visits": visits,
-    })
+    filters = AvailableVisitsFilterForm(request.GET)
+    available = available_visits(request.user.member, filters, request.GET.get("after"))
+
+    last_event = events.latest()
+
+    return render(request, "list-fulfillments.html", list_fulfillments_context(request, active_fulfillments(request.user.pal), filters, available, last_event))
 
 
 @login_required
@@ -144,3 +239,35 @@ def cancel_fulfillment(request):
             form.save()
 
     return redirect("list-fulfillments")
+
+
+def ledger_export_response(form, content):
+    """Returns the download of a valid LedgerExportForm's export, streaming
+    the content (an iterator of strings).
+    """
+    _, content_type = exports.FORMATS[form.cleaned_data["format"]]
+    disposition = f'attachment; filename="{form.filename()}"'
+    return StreamingHttpResponse(content, content_type=content_type, headers={"Content-Disposition": disposition})
+
+
+@staff_member_required
+def export_ledger(request):
+    """Staff only. Downloads the MinuteLedger entries selected by a
+    LedgerExportForm in the query string (e.g. ?month=2024-01&format=jsonl),
+    streamed a chunk at a time (see visits.app.exports).
+    """
+    form = LedgerExportForm(request.GET)
+
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text(), content_type="text/plain")
+
+    return ledger_export_response(form, form.export())
+
+
+@staff_member_required
+def monthly_reports(request):
+    """Staff only. Displays each month's minutes used and earned, the
+    platform's cut and cancellation rates, from the reports stored for closed
+    months and the open month computed live (see visits.app.reports).
+    """
+    return render(request, "monthly-reports.html", {"reports": reports.monthly()})